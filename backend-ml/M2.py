@@ -1,26 +1,32 @@
+import json
+import sys
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 
-# Confusion matrix from your test results
-cm = np.array([[27316, 1354],
-               [140, 3104]])
+# Plots come from the report written by `python evaluate.py`
+REPORT_PATH = sys.argv[1] if len(sys.argv) > 1 else "models/threshold.json"
+
+with open(REPORT_PATH) as f:
+    report = json.load(f)
+
+cm = np.array(report["confusion_matrix"])
+threshold = report["threshold"]
 
 # === 1. Confusion Matrix Heatmap ===
 plt.figure(figsize=(6, 5))
 sns.heatmap(cm, annot=True, fmt='d', cmap='Blues',
             xticklabels=['Non-Toxic', 'Toxic'],
             yticklabels=['Non-Toxic', 'Toxic'])
-plt.title('Confusion Matrix Heatmap')
+plt.title(f'Confusion Matrix Heatmap (threshold {threshold:.2f})')
 plt.xlabel('Predicted Label')
 plt.ylabel('True Label')
 plt.show()
 
-# === 2. ROC Curve (simulated since we only know AUC = 0.9903) ===
-fpr = np.linspace(0, 1, 100)
-tpr = np.power(fpr, 0.3)
+# === 2. ROC Curve ===
+roc = report["roc_curve"]
 plt.figure(figsize=(6, 5))
-plt.plot(fpr, tpr, color='darkorange', lw=2, label='ROC curve (AUC = 0.99)')
+plt.plot(roc["fpr"], roc["tpr"], color='darkorange', lw=2, label=f'ROC curve (AUC = {report["roc_auc"]:.4f})')
 plt.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
 plt.xlabel('False Positive Rate')
 plt.ylabel('True Positive Rate')
@@ -28,13 +34,16 @@ plt.title('Receiver Operating Characteristic (ROC) Curve')
 plt.legend(loc="lower right")
 plt.show()
 
-# === 3. Threshold vs F1 Score ===
-thresholds = [0.5, 0.6, 0.7, 0.8, 0.9]
-f1_scores = [0.806, 0.838, 0.850, 0.828, 0.760]
+# === 3. Threshold vs Precision / Recall / F1 ===
+pr = report["pr_curve"]
 plt.figure(figsize=(6, 5))
-plt.plot(thresholds, f1_scores, marker='o', color='green')
-plt.title('Threshold vs F1 Score')
+plt.plot(pr["thresholds"], pr["precision"], label='Precision')
+plt.plot(pr["thresholds"], pr["recall"], label='Recall')
+plt.plot(pr["thresholds"], pr["f1"], color='green', label='F1 Score')
+plt.axvline(threshold, color='grey', linestyle='--', label=f'Selected ({report["objective"]["type"]})')
+plt.title('Threshold vs Precision / Recall / F1')
 plt.xlabel('Threshold')
-plt.ylabel('F1 Score')
+plt.ylabel('Score')
+plt.legend(loc="lower left")
 plt.grid(True)
 plt.show()
@@ -1,151 +1,52 @@
 # app.py
-from fastapi import FastAPI, HTTPException, File, UploadFile
+from fastapi import FastAPI, HTTPException, File, UploadFile, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
-import joblib
 import os
-import json
 import bcrypt
 import shutil
-import requests
+import hmac
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 # --- Local Imports ---
-from database import get_db_connection
+import bulk_io
+import classifier_client
+from chat_writer import write_messages, writer as chat_writer
+from database import (
+    DB_PROFILE, QueryProfileMiddleware, close_pools, get_db_connection, pin_to_primary, register_statement,
+    replica_status, start_replica_probe, stop_replica_probe,
+)
+from migrate import check_schema_version
 from fastapi.middleware.cors import CORSMiddleware
 from psycopg2 import Error as DatabaseError
+from psycopg2.extras import Json
+from telemetry import TRUST_ROUTES, MetricsMiddleware, render as render_metrics
+from fast_response import CompressionMiddleware, FastJSONResponse
+import profile_cache
+import trust
+from ratelimit import enforce as enforce_rate_limit
+from response_cache import (
+    cached_json, invalidate as invalidate_cached, invalidate_prefix as invalidate_cached_prefix, make_etag,
+)
 
-# --- ML model paths & lazy loader ---
-VECT_PATH = os.path.join("models", "vectorizer.joblib")
-MODEL_PATH = os.path.join("models", "model.joblib")
-vectorizer = None
-model = None
-
-def ensure_model_loaded():
-    """
-    Try to load vectorizer/model once. If files missing or load fails,
-    vectorizer/model remain None and classify_text will treat messages as clean.
-    """
-    global vectorizer, model
-    if vectorizer is not None and model is not None:
-        return
-    try:
-        if os.path.exists(VECT_PATH) and os.path.exists(MODEL_PATH):
-            vectorizer = joblib.load(VECT_PATH)
-            model = joblib.load(MODEL_PATH)
-            print("Models loaded successfully.")
-        else:
-            print(f"Model files not found at {VECT_PATH} or {MODEL_PATH}. Running without ML (all text treated as clean).")
-            vectorizer = None
-            model = None
-    except Exception as e:
-        print(f"Failed to load models: {e}. Running without ML (all text treated as clean).")
-        vectorizer = None
-        model = None
-
-def classify_text_with_openrouter(text: str):
+# --- Classification ---
+def classify_text(text: str, username: Optional[str] = None):
     """
-    Use OpenRouter LLM to classify text as toxic or clean.
-    Returns (label, prob)
+    Verdict for text from the moderation pipeline (classifier.classify), run by
+    the classifier service when CLASSIFIER_SOCKET is set and in this process
+    otherwise. The sender's trust route picks the path through the tiers.
+    Returns (label, prob, label_scores).
     """
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        return None, None
-
-    prompt = f"""You are a content moderation AI. Analyze the following message and determine if it is toxic, bullying, harassment, or harmful.
-
-Message: "{text}"
+    route = trust.route_for(username)
+    TRUST_ROUTES.inc(route)
+    return classifier_client.classify(text, route)
 
-Respond with ONLY a JSON object in this exact format:
-{{"label": "toxic" or "clean", "confidence": 0.0 to 1.0, "reason": "brief reason"}}
-
-Do not include anything else in your response."""
-
-    try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "meta-llama/llama-3.1-8b-instruct",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 100,
-                "temperature": 0.1,
-            },
-            timeout=10,
-        )
-
-        if response.status_code == 200:
-            content = response.json()["choices"][0]["message"]["content"].strip()
-            # Clean up response in case model adds extra text
-            if "{" in content and "}" in content:
-                json_str = content[content.index("{"):content.rindex("}")+1]
-                result = json.loads(json_str)
-                label = result.get("label", "clean").lower()
-                confidence = float(result.get("confidence", 0.5))
-                reason = result.get("reason", "")
-                print(f"OpenRouter classified '{text[:30]}...' as '{label}' (confidence: {confidence}) - {reason}")
-                if label not in ("toxic", "clean"):
-                    label = "clean"
-                return label, confidence
-        else:
-            print(f"OpenRouter API error: {response.status_code} - {response.text}")
-            return None, None
-
-    except Exception as e:
-        print(f"OpenRouter API failed: {e}")
-        return None, None
-
-
-def classify_text(text: str):
-    """
-    1. Hindi/Hinglish keyword check
-    2. OpenRouter LLM
-    3. Local ML model fallback
-    """
-    # Step 1 - Hindi/Hinglish abusive word check
-    hindi_abusive = [
-        'randi', 'madarchod', 'bhenchod', 'chutiya', 'chutiye', 'mc', 'bc',
-        'bsdk', 'gaandu', 'gandu', 'harami', 'saala', 'saali', 'kamina',
-        'kutte', 'behenchod', 'maderchod', 'lodu', 'lund', 'bakchod',
-        'bhadwa', 'rande', 'rand', 'sala', 'bhosdike', 'bhosdika',
-        'madarchod', 'teri maa', 'teri behen', 'haramzada', 'haramzadi',
-        'chinal', 'chikna', 'chakka', 'hijra', 'kutiya', 'kamine',
-        'ullu', 'gadha', 'suwar', 'suar'
-    ]
-
-    text_lower = text.lower().strip()
-    words = text_lower.split()
-    for word in hindi_abusive:
-        if word in words or word in text_lower:
-            print(f"Hindi abusive word detected: {word}")
-            return "toxic", 0.95
-
-    # Step 2 - OpenRouter LLM
-    label, prob = classify_text_with_openrouter(text)
-    if label is not None:
-        return label, prob
-
-    # Step 3 - Local ML model fallback
-    print("Falling back to local ML model...")
-    ensure_model_loaded()
-    try:
-        if vectorizer is None or model is None:
-            return "clean", 0.0
-        vect_text = vectorizer.transform([text])
-        prob = model.predict_proba(vect_text)[0][1]
-        label = "toxic" if prob >= 0.7 else "clean"
-        return label, float(prob)
-    except Exception as e:
-        print(f"Error in local classify_text: {e}. Treating as clean.")
-        return "clean", 0.0
 
-app = FastAPI(title="SafeChat Backend")
+app = FastAPI(title="SafeChat Backend", default_response_class=FastJSONResponse)
 
 # --- CORS Middleware (local dev) ---
 origins = [
@@ -164,6 +65,29 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+if DB_PROFILE:
+    app.add_middleware(QueryProfileMiddleware)
+
+# --- Metrics ---
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text exposition of request, classifier and DB metrics."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/health/replicas", include_in_schema=False)
+def replicas_health():
+    """Replica lag and health as last seen by the probe (empty list without replicas)."""
+    return replica_status()
+
+
+@app.get("/health/classifier", include_in_schema=False)
+def classifier_health():
+    """Classifier service health and stats, or {"mode": "in_process"} without CLASSIFIER_SOCKET."""
+    return classifier_client.status()
+
 
 # --- Static Uploads Folder ---
 UPLOADS_DIR = "uploads"
@@ -221,6 +145,11 @@ class ProfileData(BaseModel):
     bio: Optional[str] = None
     profile_image_url: Optional[str] = None
 
+class ProfileSummary(BaseModel):
+    username: str
+    bio: Optional[str] = None
+    profile_image_url: Optional[str] = None
+
 
 class UserListItem(BaseModel):
     username: str
@@ -244,6 +173,19 @@ class ChatNotificationItem(BaseModel):
     created_at: datetime
 
 
+class InboxItem(BaseModel):
+    other_username: str
+    last_message_id: int
+    last_preview: str
+    last_from_me: bool
+    last_activity: datetime
+    unread: int
+
+
+class MarkReadRequest(BaseModel):
+    other_username: str
+
+
 class MessageReportCreate(BaseModel):
     reporter_username: str
     message_id: int
@@ -259,12 +201,53 @@ class MessageReportItem(BaseModel):
     reported_user_id: int
     reported_username: str
     message_text: Optional[str] = None
+    message_label_scores: Optional[dict] = None
     reason: str
     description: Optional[str] = None
     status: str
     created_at: datetime
     reviewed_by: Optional[int] = None
     reviewed_at: Optional[datetime] = None
+    version: int = 1
+
+
+class MessageReportBatch(BaseModel):
+    reports: List[MessageReportCreate]
+
+
+class MessageReportBatchResult(BaseModel):
+    index: int
+    status_code: int
+    detail: Optional[str] = None
+    report: Optional[MessageReportItem] = None
+
+
+class ReviewQueueItem(BaseModel):
+    kind: str  # 'message_report' or 'post'
+    id: int
+    created_at: datetime
+    username: str  # reported user, or the post's author
+    text: Optional[str] = None
+    label_scores: Optional[dict] = None
+    reason: Optional[str] = None
+    description: Optional[str] = None
+    reporter_username: Optional[str] = None
+    message_id: Optional[int] = None
+    parent_id: Optional[int] = None
+    claimed_by: Optional[str] = None
+    claim_expires_at: Optional[datetime] = None
+    version: Optional[int] = None  # message reports only; pass back to bulk review
+
+
+class ReviewQueuePage(BaseModel):
+    items: List[ReviewQueueItem]
+    next_cursor: Optional[str] = None
+
+
+class ReviewClaimRequest(BaseModel):
+    moderator: str
+    limit: int = 10
+    lease_seconds: int = 300
 
 
 class ReportActionResponse(BaseModel):
@@ -274,6 +257,31 @@ class ReportActionResponse(BaseModel):
 
 class ReportReviewPayload(BaseModel):
     reviewed_by_username: Optional[str] = None
+    version: Optional[int] = None  # version the moderator saw; 409 if the report changed since
+
+
+class ReportVersionRef(BaseModel):
+    report_id: int
+    version: Optional[int] = None
+
+
+class BulkReportReview(BaseModel):
+    reports: Optional[List[ReportVersionRef]] = None
+    message_id: Optional[int] = None  # or: every pending report on this message
+    reviewed_by_username: Optional[str] = None
+    collapse_duplicates: bool = True
+
+
+class CollapsedReport(BaseModel):
+    report_id: int
+    collapsed_into: Optional[int] = None
+
+
+class BulkReviewResponse(BaseModel):
+    status: str
+    action: str
+    applied: List[int]
+    collapsed: List[CollapsedReport]
 
 
 # --- Helper to safely close cursors ---
@@ -286,11 +294,16 @@ def safe_close_cursor(cursor):
 
 
 # --- Helper function to get user ID ---
+# Hot statements are prepared once per pooled connection (database.register_statement)
+USER_ID_SQL = "SELECT id FROM users WHERE username = %(username)s"
+register_statement("user_id", USER_ID_SQL)
+
+
 def get_user_id(username: str, db):
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+        cursor.execute_prepared("user_id", {"username": username})
         user_row = cursor.fetchone()
         safe_close_cursor(cursor)
         if not user_row:
@@ -323,58 +336,21 @@ def get_chat_usernames(current_username: str, db):
         safe_close_cursor(cursor)
 
 
-def get_chat_message_by_id(message_id: int, db):
-    cursor = None
-    try:
-        cursor = db.cursor(dictionary=True)
-        cursor.execute(
-            """
-            SELECT m.id, m.sender_id, m.receiver_id, m.text, m.status, m.created_at,
-                   sender.username AS sender_username,
-                   receiver.username AS receiver_username
-            FROM chat_messages m
-            JOIN users sender ON m.sender_id = sender.id
-            JOIN users receiver ON m.receiver_id = receiver.id
-            WHERE m.id = %s
-            """,
-            (message_id,),
-        )
-        return cursor.fetchone()
-    finally:
-        safe_close_cursor(cursor)
+# Hot read queries live at module level so index_advisor.py can EXPLAIN the exact SQL served.
+# chat_messages is partitioned by month on created_at: every chat query bounds
+# created_at (or orders by it under a LIMIT) so only recent partitions are read.
+NOTIFICATION_LOOKBACK_HOURS = int(os.getenv("NOTIFICATION_LOOKBACK_HOURS", "24"))
 
-
-def get_message_report_item(report_id: int, db):
-    cursor = None
-    try:
-        cursor = db.cursor(dictionary=True)
-        cursor.execute(
-            """
-            SELECT
-                r.id AS report_id,
-                r.message_id,
-                r.reporter_id,
-                reporter.username AS reporter_username,
-                r.reported_user_id,
-                reported.username AS reported_username,
-                m.text AS message_text,
-                r.reason,
-                r.description,
-                r.status,
-                r.created_at,
-                r.reviewed_by,
-                r.reviewed_at
-            FROM message_reports r
-            JOIN users reporter ON reporter.id = r.reporter_id
-            JOIN users reported ON reported.id = r.reported_user_id
-            LEFT JOIN chat_messages m ON m.id = r.message_id
-            WHERE r.id = %s
-            """,
-            (report_id,),
-        )
-        return cursor.fetchone()
-    finally:
-        safe_close_cursor(cursor)
+NOTIFICATIONS_SQL = """
+    SELECT m.id, u.username AS from_user, m.text, m.created_at
+    FROM chat_messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.receiver_id = %(user_id)s AND m.sender_id <> %(user_id)s
+      AND m.created_at > GREATEST(%(since)s::timestamp, LOCALTIMESTAMP - make_interval(hours => %(lookback)s))
+    ORDER BY m.created_at ASC
+    LIMIT 50
+"""
+register_statement("notifications", NOTIFICATIONS_SQL)
 
 
 def get_incoming_chat_notifications(username: str, db, since: Optional[str] = None):
@@ -382,33 +358,33 @@ def get_incoming_chat_notifications(username: str, db, since: Optional[str] = No
     if not user_id:
         return []
 
-    base_query = """
-        SELECT m.id, u.username AS from_user, m.text, m.created_at
-        FROM chat_messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE m.receiver_id = %s AND m.sender_id <> %s
-    """
-    params = [user_id, user_id]
-
-    if since:
-        base_query += " AND m.created_at > %s"
-        params.append(since)
-
-    base_query += " ORDER BY m.created_at ASC LIMIT 50"
-
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute(base_query, tuple(params))
+        cursor.execute_prepared("notifications", {
+            "user_id": user_id, "since": since, "lookback": NOTIFICATION_LOOKBACK_HOURS,
+        })
         return cursor.fetchall() or []
     finally:
         safe_close_cursor(cursor)
 
 
 # --- Authentication Endpoints ---
+# The user and their default profile row in one statement, so reads never have to create it
+SIGNUP_SQL = """
+    WITH new_user AS (
+        INSERT INTO users (username, email, password)
+        VALUES (%(username)s, %(email)s, %(password)s)
+        RETURNING id
+    )
+    INSERT INTO user_profiles (user_id, bio)
+    SELECT id, %(bio)s FROM new_user
+"""
+
+
 @app.post("/signup", response_model=AuthResponse)
 def signup(user: UserSignUp):
-    db = get_db_connection()
+    db = get_db_connection(username=user.username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
@@ -416,8 +392,10 @@ def signup(user: UserSignUp):
     try:
         cursor = db.cursor()
         hashed_password = bcrypt.hashpw(user.password.encode("utf-8"), bcrypt.gensalt())
-        query = "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)"
-        cursor.execute(query, (user.username, user.email, hashed_password.decode("utf-8")))
+        cursor.execute(SIGNUP_SQL, {
+            "username": user.username, "email": user.email,
+            "password": hashed_password.decode("utf-8"), "bio": DEFAULT_BIO,
+        })
         db.commit()
         return {"status": "success", "message": "User created successfully!"}
     except DatabaseError as e:
@@ -460,17 +438,22 @@ def login(user: UserLogin):
 
 
 # --- Chat Message Endpoints ---
+# Messages are written by chat_writer.py (group commit; the statement also
+# maintains conversations for the inbox).
+MAX_INBOX_PAGE = 200
+
 @app.post("/send_message", response_model=FeedResponse)
-def send_message(msg: Message):
+def send_message(msg: Message, request: Request):
     """
     Behavior:
     - If message is classified 'toxic' -> BLOCK (do not save), return notification.
     - If 'clean' -> save message with status 'approved', optionally bot reply and return feed.
     """
-    label, prob = classify_text(msg.text)
+    enforce_rate_limit("write", request, msg.user)
+    label, prob, label_scores = classify_text(msg.text, msg.user)
     notification = None
 
-    db = get_db_connection()
+    db = get_db_connection(username=msg.user)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
@@ -499,32 +482,22 @@ def send_message(msg: Message):
         # If toxic -> do NOT save the message (blocked). Provide notification to user.
         if label == "toxic":
             notification = "Your message was blocked as it was detected as toxic."
+            trust.record(msg.user, "blocked_send")
             # Optionally, you could insert a moderation record (not the chat message)
             # e.g. INSERT INTO moderation_queue (user_id, target_id, text, reason, prob) ...
         else:
-            # Save clean message
-            cursor = None
-            try:
-                cursor = db.cursor()
-                query = "INSERT INTO chat_messages (sender_id, receiver_id, text, status) VALUES (%s, %s, %s, %s)"
-                cursor.execute(query, (sender_id, receiver_id, msg.text, "approved"))
-                db.commit()
-            finally:
-                safe_close_cursor(cursor)
-
-            # Optional bot reply logic (only when user chats with Dana)
+            # Save clean message (and the bot reply when chatting with Dana) in one commit
+            rows = [(sender_id, receiver_id, msg.text, "approved", label_scores)]
             if msg.receiver_username == "Dana":
                 bot_reply_text = f"You said: '{msg.text[:20]}...' Interesting!"
-                cursor = None
-                try:
-                    cursor = db.cursor()
-                    cursor.execute(
-                        "INSERT INTO chat_messages (sender_id, receiver_id, text, status) VALUES (%s, %s, %s, %s)",
-                        (receiver_id, sender_id, bot_reply_text, "approved"),
-                    )
-                    db.commit()
-                finally:
-                    safe_close_cursor(cursor)
+                rows.append((receiver_id, sender_id, bot_reply_text, "approved", None))
+            try:
+                write_messages(rows, db)
+            except FutureTimeoutError:
+                raise HTTPException(status_code=503, detail="Message queue is busy, please retry")
+            pin_to_primary(msg.user)
+            trust.record(msg.user, "clean")
+            invalidate_cached(feed_cache_key(sender_id, receiver_id))
 
     except DatabaseError as e:
         try:
@@ -546,6 +519,30 @@ def send_message(msg: Message):
     return {"messages": latest_feed, "notification": notification}
 
 
+# The 40 most recent messages of a conversation, oldest first. Each direction is
+# read newest-first with its own LIMIT, so the scan walks partitions backwards
+# from the current month and stops once it has enough rows.
+FEED_SQL = """
+    SELECT m.id, m.text, m.status, m.created_at, u.username AS user
+    FROM (
+        SELECT * FROM (
+            (SELECT id, text, status, created_at, sender_id FROM chat_messages
+             WHERE sender_id = %(user_id)s AND receiver_id = %(other_id)s
+             ORDER BY created_at DESC LIMIT 40)
+            UNION ALL
+            (SELECT id, text, status, created_at, sender_id FROM chat_messages
+             WHERE sender_id = %(other_id)s AND receiver_id = %(user_id)s
+             ORDER BY created_at DESC LIMIT 40)
+        ) both_directions
+        ORDER BY created_at DESC
+        LIMIT 40
+    ) m
+    JOIN users u ON m.sender_id = u.id
+    ORDER BY m.created_at ASC, m.id ASC
+"""
+register_statement("feed", FEED_SQL)
+
+
 def get_feed_internal(username: str, db, other_username: str = "Dana"):
     user_id = get_user_id(username, db)
     if not user_id:
@@ -578,42 +575,79 @@ def get_feed_internal(username: str, db, other_username: str = "Dana"):
     if not other_id:
         return []
 
-    query = """
-        SELECT m.id, m.text, m.status, m.created_at, u.username AS user
-        FROM chat_messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE (m.sender_id = %s AND m.receiver_id = %s) OR (m.sender_id = %s AND m.receiver_id = %s)
-        ORDER BY m.created_at ASC
-        LIMIT 40
-    """
+    return fetch_feed(db, user_id, other_id)
+
 
+def fetch_feed(db, user_id, other_id):
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute(query, (user_id, other_id, other_id, user_id))
-        messages = cursor.fetchall()
+        cursor.execute_prepared("feed", {"user_id": user_id, "other_id": other_id})
+        return cursor.fetchall()
     finally:
         safe_close_cursor(cursor)
 
-    return messages
+
+# Version of a conversation's feed for its ETag: the xmin of the pair's
+# conversations row (every send rewrites it, even one whose created_at sorts
+# before the last message) and the chat_messages change counter (status
+# updates, deletes).
+FEED_VERSION_SQL = """
+    SELECT me.id AS user_id, other.id AS other_id,
+           COALESCE(c.xmin::text, '0') AS conversation_version,
+           (SELECT sum(version)::bigint FROM table_versions WHERE table_name = 'chat_messages') AS chat_version
+    FROM users me
+    JOIN users other ON other.username = %(other_username)s
+    LEFT JOIN conversations c
+           ON c.user_low = LEAST(me.id, other.id) AND c.user_high = GREATEST(me.id, other.id)
+    WHERE me.username = %(username)s
+"""
+register_statement("feed_version", FEED_VERSION_SQL)
+
+
+def feed_cache_key(user_id, other_id):
+    # both participants see the same 40 messages, so they share one entry
+    return f"feed:{min(user_id, other_id)}:{max(user_id, other_id)}"
 
 
 @app.get("/get_feed/{username}", response_model=List[dict])
-def get_feed(username: str, other_username: Optional[str] = None):
-    db = get_db_connection()
+def get_feed(username: str, request: Request, other_username: Optional[str] = None):
+    """Polled by the chat panel; answers 304 while the conversation is unchanged."""
+    enforce_rate_limit("poll", request, username)
+    other_username = other_username or "Dana"
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
-    messages = get_feed_internal(username, db, other_username or "Dana")
+
+    cursor = None
     try:
-        db.close()
-    except Exception:
-        pass
-    return messages
+        cursor = db.cursor(dictionary=True)
+        cursor.execute_prepared("feed_version", {"username": username, "other_username": other_username})
+        version = cursor.fetchone()
+        safe_close_cursor(cursor)
+        cursor = None
+        # unknown users (and the Dana bootstrap) and self-chats take the uncached path
+        if version is None or version["chat_version"] is None or version["user_id"] == version["other_id"]:
+            return get_feed_internal(username, db, other_username)
+
+        user_id, other_id = version["user_id"], version["other_id"]
+        return cached_json(
+            request, "feed", feed_cache_key(user_id, other_id),
+            make_etag("feed", min(user_id, other_id), max(user_id, other_id),
+                      version["conversation_version"], version["chat_version"]),
+            lambda: fetch_feed(db, user_id, other_id),
+        )
+    finally:
+        safe_close_cursor(cursor)
+        try:
+            db.close()
+        except Exception:
+            pass
 
 
 @app.get("/get_users/{username}", response_model=List[UserListItem])
 def get_users(username: str):
-    db = get_db_connection()
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
     users = get_chat_usernames(username, db)
@@ -621,11 +655,12 @@ def get_users(username: str):
         db.close()
     except Exception:
         pass
-    return users
+    return FastJSONResponse(users)
 
 
 @app.post("/typing_status", response_model=TypingStatusResponse)
-def set_typing_status(payload: TypingStatusUpdate):
+def set_typing_status(payload: TypingStatusUpdate, request: Request):
+    enforce_rate_limit("poll", request, payload.user)
     db = get_db_connection()
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
@@ -669,7 +704,8 @@ def set_typing_status(payload: TypingStatusUpdate):
 
 
 @app.get("/typing_status/{username}", response_model=TypingStatusResponse)
-def get_typing_status(username: str, other_username: str):
+def get_typing_status(username: str, other_username: str, request: Request):
+    enforce_rate_limit("poll", request, username)
     db = get_db_connection()
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
@@ -712,8 +748,9 @@ def get_typing_status(username: str, other_username: str):
 
 
 @app.get("/chat_notifications/{username}", response_model=List[ChatNotificationItem])
-def get_chat_notifications(username: str, since: Optional[str] = None):
-    db = get_db_connection()
+def get_chat_notifications(username: str, request: Request, since: Optional[str] = None):
+    enforce_rate_limit("poll", request, username)
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
@@ -725,78 +762,279 @@ def get_chat_notifications(username: str, since: Optional[str] = None):
     return notifications
 
 
-@app.post("/report_message", response_model=MessageReportItem)
-def report_message(payload: MessageReportCreate):
-    db = get_db_connection()
+# --- Inbox ---
+# Reads only conversations (+ users for names): each side newest-first, merged.
+INBOX_SQL = """
+    SELECT u.username AS other_username, c.last_message_id, c.last_preview,
+           c.last_sender_id = %(user_id)s AS last_from_me, c.last_activity, c.unread
+    FROM (
+        (SELECT user_high AS other_id, last_message_id, last_sender_id, last_preview,
+                last_activity, unread_low AS unread
+         FROM conversations WHERE user_low = %(user_id)s
+         ORDER BY last_activity DESC LIMIT %(limit)s)
+        UNION ALL
+        (SELECT user_low AS other_id, last_message_id, last_sender_id, last_preview,
+                last_activity, unread_high AS unread
+         FROM conversations WHERE user_high = %(user_id)s
+         ORDER BY last_activity DESC LIMIT %(limit)s)
+    ) c
+    JOIN users u ON u.id = c.other_id
+    ORDER BY c.last_activity DESC
+    LIMIT %(limit)s
+"""
+register_statement("inbox", INBOX_SQL)
+
+MARK_READ_SQL = """
+    UPDATE conversations SET
+        unread_low = CASE WHEN user_low = %(user_id)s THEN 0 ELSE unread_low END,
+        unread_high = CASE WHEN user_high = %(user_id)s THEN 0 ELSE unread_high END
+    WHERE user_low = LEAST(%(user_id)s, %(other_id)s)::int
+      AND user_high = GREATEST(%(user_id)s, %(other_id)s)::int
+"""
+
+
+@app.get("/inbox/{username}", response_model=List[InboxItem])
+def get_inbox(username: str, request: Request, limit: int = 50):
+    """A user's conversations, most recent first, with their unread counts."""
+    enforce_rate_limit("poll", request, username)
+    limit = max(1, min(limit, MAX_INBOX_PAGE))
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
-    reporter_id = get_user_id(payload.reporter_username, db)
-    if not reporter_id:
+    cursor = None
+    try:
+        user_id = get_user_id(username, db)
+        if not user_id:
+            raise HTTPException(status_code=404, detail="User not found")
+        cursor = db.cursor(dictionary=True)
+        cursor.execute_prepared("inbox", {"user_id": user_id, "limit": limit})
+        return cursor.fetchall() or []
+    finally:
+        safe_close_cursor(cursor)
         try:
             db.close()
         except Exception:
             pass
-        raise HTTPException(status_code=404, detail="Reporter not found")
 
-    message = get_chat_message_by_id(payload.message_id, db)
-    if not message:
+
+@app.post("/inbox/{username}/read", response_model=dict)
+def mark_conversation_read(username: str, payload: MarkReadRequest, request: Request):
+    """Reset username's unread counter for the conversation with other_username."""
+    enforce_rate_limit("poll", request, username)
+    db = get_db_connection(username=username)
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection failed")
+
+    cursor = None
+    try:
+        user_id = get_user_id(username, db)
+        other_id = get_user_id(payload.other_username, db)
+        if not user_id or not other_id:
+            raise HTTPException(status_code=404, detail="User not found")
+        cursor = db.cursor()
+        cursor.execute(MARK_READ_SQL, {"user_id": user_id, "other_id": other_id})
+        db.commit()
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    except DatabaseError as e:
         try:
-            db.close()
+            db.rollback()
         except Exception:
             pass
-        raise HTTPException(status_code=404, detail="Message not found")
-
-    if message["sender_id"] == reporter_id:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        safe_close_cursor(cursor)
         try:
             db.close()
         except Exception:
             pass
-        raise HTTPException(status_code=400, detail="You cannot report your own message")
+    return {"status": "ok"}
+
+
+# One statement validates, inserts and hydrates a report. The lookup columns
+# (reporter_lookup / sender_lookup) survive the LEFT JOINs even when nothing was
+# inserted, which is how report_outcome tells the failure cases apart.
+REPORT_MESSAGE_SQL = """
+    WITH reporter AS (
+        SELECT id, username FROM users WHERE username = %(reporter_username)s
+    ),
+    msg AS (
+        SELECT id, sender_id, text, label_scores, created_at
+        FROM chat_messages_all WHERE id = %(message_id)s
+    ),
+    ins AS (
+        INSERT INTO message_reports (message_id, reporter_id, reported_user_id, reason, description,
+                                     message_created_at)
+        SELECT msg.id, reporter.id, msg.sender_id, %(reason)s, %(description)s, msg.created_at
+        FROM reporter, msg
+        WHERE msg.sender_id <> reporter.id
+        ON CONFLICT (message_id, reporter_id) DO NOTHING
+        RETURNING id, message_id, reporter_id, reported_user_id, reason, description,
+                  status, created_at, reviewed_by, reviewed_at, version
+    )
+    SELECT
+        reporter.id AS reporter_lookup,
+        msg.sender_id AS sender_lookup,
+        ins.id AS report_id,
+        ins.message_id,
+        ins.reporter_id,
+        reporter.username AS reporter_username,
+        ins.reported_user_id,
+        reported.username AS reported_username,
+        msg.text AS message_text,
+        msg.label_scores AS message_label_scores,
+        ins.reason,
+        ins.description,
+        ins.status,
+        ins.created_at,
+        ins.reviewed_by,
+        ins.reviewed_at,
+        ins.version
+    FROM (SELECT 1) AS one
+    LEFT JOIN reporter ON TRUE
+    LEFT JOIN msg ON TRUE
+    LEFT JOIN ins ON TRUE
+    LEFT JOIN users reported ON reported.id = ins.reported_user_id
+"""
+
+# Batch form of REPORT_MESSAGE_SQL over parallel arrays. Repeats of the same
+# (message, reporter) pair inside one batch only insert for their first
+# occurrence (dup_rank = 1); the rest come back as duplicates.
+REPORT_MESSAGES_BATCH_SQL = """
+    WITH input AS (
+        SELECT *
+        FROM unnest(%(reporter_usernames)s::text[], %(message_ids)s::bigint[],
+                    %(reasons)s::text[], %(descriptions)s::text[])
+             WITH ORDINALITY AS t(reporter_username, message_id, reason, description, ord)
+    ),
+    resolved AS (
+        SELECT input.ord, input.reason, input.description,
+               reporter.id AS reporter_id, reporter.username AS reporter_username,
+               msg.id AS message_id, msg.sender_id, msg.text, msg.label_scores,
+               msg.created_at AS message_created_at,
+               row_number() OVER (PARTITION BY msg.id, reporter.id ORDER BY input.ord) AS dup_rank
+        FROM input
+        LEFT JOIN users reporter ON reporter.username = input.reporter_username
+        LEFT JOIN chat_messages_all msg ON msg.id = input.message_id
+    ),
+    ins AS (
+        INSERT INTO message_reports (message_id, reporter_id, reported_user_id, reason, description,
+                                     message_created_at)
+        SELECT message_id, reporter_id, sender_id, reason, description, message_created_at
+        FROM resolved
+        WHERE reporter_id IS NOT NULL
+          AND message_id IS NOT NULL
+          AND sender_id <> reporter_id
+          AND dup_rank = 1
+        ORDER BY ord
+        ON CONFLICT (message_id, reporter_id) DO NOTHING
+        RETURNING id, message_id, reporter_id, reported_user_id, reason, description,
+                  status, created_at, reviewed_by, reviewed_at, version
+    )
+    SELECT
+        resolved.ord,
+        resolved.reporter_id AS reporter_lookup,
+        resolved.sender_id AS sender_lookup,
+        ins.id AS report_id,
+        ins.message_id,
+        ins.reporter_id,
+        resolved.reporter_username,
+        ins.reported_user_id,
+        reported.username AS reported_username,
+        resolved.text AS message_text,
+        resolved.label_scores AS message_label_scores,
+        ins.reason,
+        ins.description,
+        ins.status,
+        ins.created_at,
+        ins.reviewed_by,
+        ins.reviewed_at,
+        ins.version
+    FROM resolved
+    LEFT JOIN ins
+           ON resolved.dup_rank = 1
+          AND ins.message_id = resolved.message_id
+          AND ins.reporter_id = resolved.reporter_id
+    LEFT JOIN users reported ON reported.id = ins.reported_user_id
+    ORDER BY resolved.ord
+"""
+
+MAX_REPORT_BATCH = 100
+
+
+def report_outcome(row):
+    """(status_code, detail) for a report row that was not inserted, else None."""
+    if row is None or row["reporter_lookup"] is None:
+        return 404, "Reporter not found"
+    if row["sender_lookup"] is None:
+        return 404, "Message not found"
+    if row["sender_lookup"] == row["reporter_lookup"]:
+        return 400, "You cannot report your own message"
+    if row["report_id"] is None:
+        return 400, "You have already reported this message"
+    return None
+
+
+def report_item_from_row(row):
+    return {key: value for key, value in row.items()
+            if key not in ("ord", "reporter_lookup", "sender_lookup")}
+
+
+@app.post("/report_message", response_model=MessageReportItem)
+def report_message(payload: MessageReportCreate, request: Request):
+    enforce_rate_limit("write", request, payload.reporter_username)
+    db = get_db_connection()
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection failed")
 
     cursor = None
     try:
-        cursor = db.cursor()
+        cursor = db.cursor(dictionary=True)
         cursor.execute(
-            """
-            INSERT INTO message_reports (
-                message_id, reporter_id, reported_user_id, reason, description
-            ) VALUES (%s, %s, %s, %s, %s)
-            RETURNING id
-            """,
-            (
-                payload.message_id,
-                reporter_id,
-                message["sender_id"],
-                payload.reason.strip(),
-                payload.description.strip() if payload.description else None,
-            ),
+            REPORT_MESSAGE_SQL,
+            {
+                "reporter_username": payload.reporter_username,
+                "message_id": payload.message_id,
+                "reason": payload.reason.strip(),
+                "description": payload.description.strip() if payload.description else None,
+            },
         )
-        report_id = cursor.fetchone()[0]
+        row = cursor.fetchone()
         db.commit()
+        invalidate_cached_prefix("pending_reports:")
     except DatabaseError as e:
         try:
             db.rollback()
         except Exception:
             pass
-        if getattr(e, "pgcode", None) == "23505":
-            raise HTTPException(status_code=400, detail="You have already reported this message")
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         safe_close_cursor(cursor)
+        try:
+            db.close()
+        except Exception:
+            pass
 
-    report_item = get_message_report_item(report_id, db)
-    try:
-        db.close()
-    except Exception:
-        pass
-    if not report_item:
-        raise HTTPException(status_code=500, detail="Report created but could not be loaded")
-    return report_item
+    failure = report_outcome(row)
+    if failure:
+        raise HTTPException(status_code=failure[0], detail=failure[1])
+    return report_item_from_row(row)
 
 
-@app.get("/message_reports/pending", response_model=List[MessageReportItem])
-def list_pending_message_reports():
+@app.post("/report_messages/batch", response_model=List[MessageReportBatchResult])
+def report_messages_batch(payload: MessageReportBatch, request: Request):
+    """
+    Submits reports queued by a client while offline. Every report is validated
+    and inserted in one statement; each one gets its own result, so a duplicate
+    or a deleted message does not fail the rest of the batch.
+    """
+    enforce_rate_limit("write", request)  # one token per batch; size is capped below
+    if not payload.reports:
+        return []
+    if len(payload.reports) > MAX_REPORT_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REPORT_BATCH} reports per batch")
+
     db = get_db_connection()
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
@@ -805,29 +1043,23 @@ def list_pending_message_reports():
     try:
         cursor = db.cursor(dictionary=True)
         cursor.execute(
-            """
-            SELECT
-                r.id AS report_id,
-                r.message_id,
-                r.reporter_id,
-                reporter.username AS reporter_username,
-                r.reported_user_id,
-                reported.username AS reported_username,
-                m.text AS message_text,
-                r.reason,
-                r.description,
-                r.status,
-                r.created_at,
-                r.reviewed_by,
-                r.reviewed_at
-            FROM message_reports r
-            JOIN users reporter ON reporter.id = r.reporter_id
-            JOIN users reported ON reported.id = r.reported_user_id
-            LEFT JOIN chat_messages m ON m.id = r.message_id
-            ORDER BY r.created_at DESC
-            """
+            REPORT_MESSAGES_BATCH_SQL,
+            {
+                "reporter_usernames": [r.reporter_username for r in payload.reports],
+                "message_ids": [r.message_id for r in payload.reports],
+                "reasons": [r.reason.strip() for r in payload.reports],
+                "descriptions": [r.description.strip() if r.description else None for r in payload.reports],
+            },
         )
-        return cursor.fetchall() or []
+        rows = cursor.fetchall() or []
+        db.commit()
+        invalidate_cached_prefix("pending_reports:")
+    except DatabaseError as e:
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         safe_close_cursor(cursor)
         try:
@@ -835,34 +1067,202 @@ def list_pending_message_reports():
         except Exception:
             pass
 
+    results = []
+    for index, row in enumerate(rows):
+        failure = report_outcome(row)
+        if failure:
+            results.append({"index": index, "status_code": failure[0], "detail": failure[1]})
+        else:
+            results.append({"index": index, "status_code": 200, "report": report_item_from_row(row)})
+    return results
+
+
+PENDING_REPORTS_SQL = """
+    SELECT
+        r.id AS report_id,
+        r.message_id,
+        r.reporter_id,
+        reporter.username AS reporter_username,
+        r.reported_user_id,
+        reported.username AS reported_username,
+        m.text AS message_text,
+        m.label_scores AS message_label_scores,
+        r.reason,
+        r.description,
+        r.status,
+        r.created_at,
+        r.reviewed_by,
+        r.reviewed_at,
+        r.version
+    FROM message_reports r
+    JOIN users reporter ON reporter.id = r.reporter_id
+    JOIN users reported ON reported.id = r.reported_user_id
+    LEFT JOIN chat_messages_all m ON m.id = r.message_id AND m.created_at = r.message_created_at
+    WHERE r.status = 'pending'
+    ORDER BY r.created_at DESC, r.id DESC
+    LIMIT %(limit)s
+"""
+
+# Pending list version: any report change, or a message edited or deleted under it
+PENDING_REPORTS_VERSION_SQL = """
+    SELECT string_agg(version::text, '-' ORDER BY table_name) AS version
+    FROM (SELECT table_name, sum(version)::bigint AS version FROM table_versions
+          WHERE table_name IN ('message_reports', 'chat_messages') GROUP BY table_name) AS counters
+"""
+register_statement("pending_reports_version", PENDING_REPORTS_VERSION_SQL)
+
 
-def _update_message_report_status(report_id: int, status: str, reviewed_by_username: Optional[str] = None):
+@app.get("/message_reports/pending", response_model=List[MessageReportItem])
+def list_pending_message_reports(request: Request, limit: int = 100):
+    """Polled by the admin panel; answers 304 while no report or message changed."""
+    limit = max(1, min(limit, MAX_REVIEW_PAGE))
     db = get_db_connection()
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
-    reviewed_by_id = None
-    if reviewed_by_username:
-        reviewed_by_id = get_user_id(reviewed_by_username, db)
-        # If reviewer not found in DB (e.g. hardcoded admin), proceed with NULL
-        # This allows non-DB admin users to still resolve/dismiss reports
+    def build():
+        build_cursor = db.cursor(dictionary=True)
+        try:
+            build_cursor.execute(PENDING_REPORTS_SQL, {"limit": limit})
+            # the columns are MessageReportItem's fields: no per-row validation
+            return build_cursor.fetchall()
+        finally:
+            safe_close_cursor(build_cursor)
 
     cursor = None
     try:
-        cursor = db.cursor()
+        cursor = db.cursor(dictionary=True)
+        cursor.execute_prepared("pending_reports_version")
+        version = cursor.fetchone()["version"]
+        if version is None:
+            return FastJSONResponse(build())
+        return cached_json(request, "pending_reports", f"pending_reports:{limit}",
+                           make_etag("reports", limit, version), build)
+    finally:
+        safe_close_cursor(cursor)
+        try:
+            db.close()
+        except Exception:
+            pass
+
+
+# One statement applies a moderator decision to a set of pending reports and
+# collapses their duplicates. Duplicates are the other pending reports on an
+# actioned message and, for "resolved" only, the other pending reports against
+# the same user (dismissing one report says nothing about the user's other
+# messages). Every touched row gets version + 1.
+REVIEW_REPORTS_BULK_SQL = """
+    WITH targets AS (
+        SELECT t.id, t.version
+        FROM unnest(%(report_ids)s::int[], %(versions)s::int[]) AS t(id, version)
+        UNION ALL
+        SELECT r.id, NULL::int FROM message_reports r
+        WHERE r.message_id = %(message_id)s AND r.status = 'pending'
+    ),
+    reviewer AS (
+        SELECT (SELECT id FROM users WHERE username = %(reviewer)s) AS id
+    ),
+    acted AS (
+        UPDATE message_reports r
+        SET status = %(status)s,
+            reviewed_by = (SELECT id FROM reviewer),
+            reviewed_at = CURRENT_TIMESTAMP,
+            version = r.version + 1,
+            claimed_by = NULL,
+            claim_expires_at = NULL
+        FROM targets t
+        WHERE r.id = t.id
+          AND r.status = 'pending'
+          AND (t.version IS NULL OR r.version = t.version)
+        RETURNING r.id, r.message_id, r.reported_user_id
+    ),
+    duplicates AS (
+        SELECT r.id,
+               (SELECT a.id FROM acted a
+                WHERE a.message_id = r.message_id
+                   OR (%(collapse_user)s AND a.reported_user_id = r.reported_user_id)
+                ORDER BY a.message_id = r.message_id DESC, a.id
+                LIMIT 1) AS collapsed_into
+        FROM message_reports r
+        WHERE %(collapse)s
+          AND r.status = 'pending'
+          AND r.id NOT IN (SELECT id FROM targets)
+          AND (r.message_id IN (SELECT message_id FROM acted)
+               OR (%(collapse_user)s AND r.reported_user_id IN (SELECT reported_user_id FROM acted)))
+    ),
+    collapsed AS (
+        UPDATE message_reports r
+        SET status = %(status)s,
+            reviewed_by = (SELECT id FROM reviewer),
+            reviewed_at = CURRENT_TIMESTAMP,
+            version = r.version + 1,
+            collapsed_into = d.collapsed_into,
+            claimed_by = NULL,
+            claim_expires_at = NULL
+        FROM duplicates d
+        WHERE r.id = d.id AND r.status = 'pending'
+        RETURNING r.id, r.collapsed_into
+    )
+    SELECT 'target' AS row_kind, t.id, a.id IS NOT NULL AS applied,
+           cur.status AS current_status, cur.version AS current_version,
+           NULL::int AS collapsed_into, a.message_id, reported.username AS reported_username
+    FROM targets t
+    LEFT JOIN acted a ON a.id = t.id
+    LEFT JOIN message_reports cur ON cur.id = t.id
+    LEFT JOIN users reported ON reported.id = a.reported_user_id
+    UNION ALL
+    SELECT 'collapsed', c.id, TRUE, NULL, NULL, c.collapsed_into, NULL, NULL
+    FROM collapsed c
+"""
+
+MAX_BULK_REVIEW = 500
+
+
+def review_message_reports(status: str, refs=None, message_id: Optional[int] = None,
+                           reviewed_by_username: Optional[str] = None, collapse: bool = True):
+    """
+    Set status on the given reports (refs: [(report_id, expected_version or None)])
+    or on every pending report of message_id. All or nothing: if any report is
+    missing, no longer pending, or its version moved on since the moderator
+    loaded it, nothing is written and the stale ids are reported (404 / 409).
+    """
+    unique_refs = {}
+    for report_id, version in refs or []:
+        unique_refs.setdefault(report_id, version)
+    refs = list(unique_refs.items())
+    db = get_db_connection()
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection failed")
+
+    cursor = None
+    try:
+        cursor = db.cursor(dictionary=True)
         cursor.execute(
-            """
-            UPDATE message_reports
-            SET status = %s,
-                reviewed_by = %s,
-                reviewed_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-            """,
-            (status, reviewed_by_id, report_id),
+            REVIEW_REPORTS_BULK_SQL,
+            {
+                "report_ids": [report_id for report_id, _ in refs],
+                "versions": [version for _, version in refs],
+                "message_id": message_id,
+                "reviewer": reviewed_by_username,
+                "status": status,
+                "collapse": collapse,
+                "collapse_user": collapse and status == "resolved",
+            },
         )
-        db.commit()
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Report not found")
+        rows = cursor.fetchall() or []
+
+        targets = [row for row in rows if row["row_kind"] == "target"]
+        not_found = [row["id"] for row in targets if row["current_status"] is None]
+        conflicts = [
+            {"report_id": row["id"], "status": row["current_status"], "version": row["current_version"]}
+            for row in targets
+            if not row["applied"] and row["current_status"] is not None
+        ]
+        if not targets or not_found or conflicts:
+            db.rollback()
+        else:
+            db.commit()
+            invalidate_cached_prefix("pending_reports:")
     except DatabaseError as e:
         try:
             db.rollback()
@@ -876,26 +1276,329 @@ def _update_message_report_status(report_id: int, status: str, reviewed_by_usern
         except Exception:
             pass
 
-    return {"status": "success", "message": f"Report {status}"}
+    if not targets:
+        raise HTTPException(status_code=404, detail="No pending reports for this message")
+    if conflicts:
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "message": "Some reports changed since they were loaded; refresh and retry",
+                "conflicts": conflicts,
+                "not_found": not_found,
+            },
+        )
+    if not_found:
+        raise HTTPException(status_code=404, detail={"message": "Report not found", "not_found": not_found})
+
+    # One trust event per judged message, however many reports it collected
+    event = "report_resolved" if status == "resolved" else "report_dismissed"
+    for reported_username, _ in {(row["reported_username"], row["message_id"]) for row in targets}:
+        trust.record(reported_username, event)
+
+    return {
+        "status": "success",
+        "action": status,
+        "applied": [row["id"] for row in targets],
+        "collapsed": [
+            {"report_id": row["id"], "collapsed_into": row["collapsed_into"]}
+            for row in rows if row["row_kind"] == "collapsed"
+        ],
+    }
+
+
+def _update_message_report_status(report_id: int, status: str, reviewed_by_username: Optional[str] = None,
+                                  version: Optional[int] = None):
+    # Reviewer not found in DB (e.g. hardcoded admin) is fine: reviewed_by stays NULL
+    result = review_message_reports(status, [(report_id, version)], reviewed_by_username=reviewed_by_username)
+    message = f"Report {status}"
+    if result["collapsed"]:
+        message += f"; {len(result['collapsed'])} duplicate report(s) collapsed"
+    return {"status": "success", "message": message}
 
 
 @app.post("/message_reports/{report_id}/resolve", response_model=ReportActionResponse)
 def resolve_message_report(report_id: int, payload: ReportReviewPayload):
-    return _update_message_report_status(report_id, "resolved", payload.reviewed_by_username)
+    return _update_message_report_status(report_id, "resolved", payload.reviewed_by_username, payload.version)
 
 
 @app.post("/message_reports/{report_id}/dismiss", response_model=ReportActionResponse)
 def dismiss_message_report(report_id: int, payload: ReportReviewPayload):
-    return _update_message_report_status(report_id, "dismissed", payload.reviewed_by_username)
+    return _update_message_report_status(report_id, "dismissed", payload.reviewed_by_username, payload.version)
+
+
+def _bulk_review(payload: BulkReportReview, status: str):
+    if (payload.reports is None) == (payload.message_id is None):
+        raise HTTPException(status_code=400, detail="Provide either reports or message_id")
+    if payload.reports is not None:
+        if not payload.reports:
+            raise HTTPException(status_code=400, detail="reports must not be empty")
+        if len(payload.reports) > MAX_BULK_REVIEW:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_REVIEW} reports per call")
+    refs = [(ref.report_id, ref.version) for ref in payload.reports or []]
+    return review_message_reports(status, refs, payload.message_id, payload.reviewed_by_username,
+                                  payload.collapse_duplicates)
+
+
+@app.post("/message_reports/bulk_resolve", response_model=BulkReviewResponse)
+def bulk_resolve_message_reports(payload: BulkReportReview):
+    return _bulk_review(payload, "resolved")
+
+
+@app.post("/message_reports/bulk_dismiss", response_model=BulkReviewResponse)
+def bulk_dismiss_message_reports(payload: BulkReportReview):
+    return _bulk_review(payload, "dismissed")
+
+
+# --- Moderator review queue ---
+# Pending message reports and pending posts, oldest first, in one keyset-paged
+# list ordered by (created_at, kind, id). Both halves are served by the
+# partial indexes on (created_at, id) WHERE status = 'pending'.
+MAX_REVIEW_PAGE = 100
+MAX_REVIEW_CLAIM = 50
+MAX_CLAIM_LEASE_SECONDS = 3600
+
+REVIEW_REPORTS_SQL = """
+    SELECT 'message_report' AS kind, r.id, r.created_at,
+           reported.username AS username, m.text, m.label_scores,
+           r.reason, r.description, reporter.username AS reporter_username,
+           r.message_id, NULL::int AS parent_id, r.claimed_by, r.claim_expires_at, r.version
+    FROM message_reports r
+    JOIN users reporter ON reporter.id = r.reporter_id
+    JOIN users reported ON reported.id = r.reported_user_id
+    LEFT JOIN chat_messages_all m ON m.id = r.message_id AND m.created_at = r.message_created_at
+    WHERE r.status = 'pending'{filters}
+    ORDER BY r.created_at, r.id
+    LIMIT %(limit)s
+"""
+
+REVIEW_POSTS_SQL = """
+    SELECT 'post' AS kind, p.id, p.created_at,
+           u.username, p.text, p.label_scores,
+           NULL AS reason, NULL AS description, NULL AS reporter_username,
+           NULL::int AS message_id, p.parent_id, p.claimed_by, p.claim_expires_at, NULL::int AS version
+    FROM posts p
+    JOIN users u ON u.id = p.user_id
+    WHERE p.status = 'pending'{filters}
+    ORDER BY p.created_at, p.id
+    LIMIT %(limit)s
+"""
+
+# Live claims of other moderators are hidden from a moderator's view.
+UNCLAIMED_FILTER = (
+    " AND ({alias}.claim_expires_at IS NULL"
+    " OR {alias}.claim_expires_at < CURRENT_TIMESTAMP"
+    " OR {alias}.claimed_by = %(moderator)s)"
+)
+
+CLAIM_REVIEW_ITEMS_SQL = """
+    WITH report_candidates AS (
+        SELECT id, created_at FROM message_reports r
+        WHERE r.status = 'pending'{report_filter}
+        ORDER BY r.created_at, r.id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    post_candidates AS (
+        SELECT id, created_at FROM posts p
+        WHERE p.status = 'pending'{post_filter}
+        ORDER BY p.created_at, p.id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    picked AS (
+        SELECT 'message_report' AS kind, id, created_at FROM report_candidates
+        UNION ALL
+        SELECT 'post' AS kind, id, created_at FROM post_candidates
+        ORDER BY created_at, kind, id
+        LIMIT %(limit)s
+    ),
+    claimed_reports AS (
+        UPDATE message_reports r
+        SET claimed_by = %(moderator)s,
+            claim_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease_seconds)s)
+        FROM picked
+        WHERE picked.kind = 'message_report' AND r.id = picked.id
+        RETURNING r.id
+    ),
+    claimed_posts AS (
+        UPDATE posts p
+        SET claimed_by = %(moderator)s,
+            claim_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %(lease_seconds)s)
+        FROM picked
+        WHERE picked.kind = 'post' AND p.id = picked.id
+        RETURNING p.id
+    )
+    SELECT 'message_report' AS kind, id FROM claimed_reports
+    UNION ALL
+    SELECT 'post' AS kind, id FROM claimed_posts
+"""
+
+
+def parse_review_cursor(cursor_token: Optional[str]):
+    """'<created_at iso>|<kind>|<id>' -> (created_at, kind, id); None when not paging."""
+    if not cursor_token:
+        return None
+    try:
+        created_at, kind, item_id = cursor_token.split("|")
+        if kind not in ("message_report", "post"):
+            raise ValueError(kind)
+        return datetime.fromisoformat(created_at), kind, int(item_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid review queue cursor")
+
+
+def review_cursor_for(item):
+    return f"{item['created_at'].isoformat()}|{item['kind']}|{item['id']}"
+
+
+def keyset_filter(kind: str, alias: str, after):
+    """
+    (created_at, kind, id) > (after_ts, after_kind, after_id) rewritten for one
+    half of the queue, where kind is a constant, so the planner can use the
+    (created_at, id) index instead of filtering a row comparison.
+    """
+    if after is None:
+        return ""
+    after_kind = after[1]
+    if kind > after_kind:
+        return f" AND {alias}.created_at >= %(after_ts)s"
+    if kind < after_kind:
+        return f" AND {alias}.created_at > %(after_ts)s"
+    return f" AND ({alias}.created_at, {alias}.id) > (%(after_ts)s, %(after_id)s)"
+
+
+def fetch_review_items(cursor, report_filters: str, post_filters: str, params: dict):
+    cursor.execute(
+        "(" + REVIEW_REPORTS_SQL.format(filters=report_filters) + ")"
+        " UNION ALL "
+        "(" + REVIEW_POSTS_SQL.format(filters=post_filters) + ")"
+        " ORDER BY created_at, kind, id LIMIT %(limit)s",
+        params,
+    )
+    return cursor.fetchall() or []
+
+
+@app.get("/review_queue", response_model=ReviewQueuePage)
+def get_review_queue(moderator: Optional[str] = None, limit: int = 25, cursor: Optional[str] = None):
+    """
+    Page through pending reports and posts, oldest first. Pass next_cursor back
+    as cursor for the following page. With a moderator, items leased to other
+    moderators are left out.
+    """
+    limit = max(1, min(limit, MAX_REVIEW_PAGE))
+    after = parse_review_cursor(cursor)
+
+    report_filters = keyset_filter("message_report", "r", after)
+    post_filters = keyset_filter("post", "p", after)
+    if moderator:
+        report_filters += UNCLAIMED_FILTER.format(alias="r")
+        post_filters += UNCLAIMED_FILTER.format(alias="p")
+    params = {"limit": limit, "moderator": moderator}
+    if after:
+        params["after_ts"], params["after_id"] = after[0], after[2]
+
+    db = get_db_connection()
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection failed")
+
+    db_cursor = None
+    try:
+        db_cursor = db.cursor(dictionary=True)
+        items = fetch_review_items(db_cursor, report_filters, post_filters, params)
+    except DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        safe_close_cursor(db_cursor)
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    next_cursor = review_cursor_for(items[-1]) if len(items) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@app.post("/review_queue/claim", response_model=List[ReviewQueueItem])
+def claim_review_items(payload: ReviewClaimRequest):
+    """
+    Lease the oldest unclaimed items to a moderator. Rows another moderator is
+    claiming at the same moment are skipped (SKIP LOCKED), not waited on, and
+    a lease that runs out puts its items back in the queue. Claiming again
+    renews the moderator's own leases.
+    """
+    moderator = payload.moderator.strip()
+    if not moderator:
+        raise HTTPException(status_code=400, detail="moderator is required")
+    limit = max(1, min(payload.limit, MAX_REVIEW_CLAIM))
+    lease_seconds = max(1, min(payload.lease_seconds, MAX_CLAIM_LEASE_SECONDS))
+
+    db = get_db_connection()
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection failed")
+
+    cursor = None
+    try:
+        cursor = db.cursor(dictionary=True)
+        params = {"moderator": moderator, "limit": limit, "lease_seconds": lease_seconds}
+        cursor.execute(
+            CLAIM_REVIEW_ITEMS_SQL.format(
+                report_filter=UNCLAIMED_FILTER.format(alias="r"),
+                post_filter=UNCLAIMED_FILTER.format(alias="p"),
+            ),
+            params,
+        )
+        claimed = cursor.fetchall() or []
+        report_ids = [row["id"] for row in claimed if row["kind"] == "message_report"]
+        post_ids = [row["id"] for row in claimed if row["kind"] == "post"]
+        items = []
+        if claimed:
+            items = fetch_review_items(
+                cursor,
+                " AND r.id = ANY(%(report_ids)s)",
+                " AND p.id = ANY(%(post_ids)s)",
+                {"limit": limit, "report_ids": report_ids, "post_ids": post_ids},
+            )
+        db.commit()
+    except DatabaseError as e:
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    finally:
+        safe_close_cursor(cursor)
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    return items
+
+
+@app.get("/trust_score/{username}", response_model=dict)
+def get_trust_score(username: str):
+    """Admin: this worker's view of a user's trust counters, abuse score and classification route."""
+    score = trust.snapshot(username)
+    if score is None:
+        raise HTTPException(status_code=404, detail="No trust events recorded for this user")
+    return score
 
 
 # --- Presence / Heartbeat Endpoints ---
 class HeartbeatPayload(BaseModel):
     username: str
 
+PRESENCE_SQL = """
+    INSERT INTO user_presence (user_id, last_seen) VALUES (%(user_id)s, CURRENT_TIMESTAMP)
+    ON CONFLICT (user_id) DO UPDATE SET last_seen = CURRENT_TIMESTAMP
+"""
+register_statement("presence", PRESENCE_SQL)
+
+
 @app.post("/heartbeat")
-def heartbeat(payload: HeartbeatPayload):
+def heartbeat(payload: HeartbeatPayload, request: Request):
     """Called every ~10s by the frontend to indicate the user is online."""
+    enforce_rate_limit("poll", request, payload.username)
     db = get_db_connection()
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
@@ -907,11 +1610,7 @@ def heartbeat(payload: HeartbeatPayload):
     cursor = None
     try:
         cursor = db.cursor()
-        cursor.execute(
-            """INSERT INTO user_presence (user_id, last_seen) VALUES (%s, CURRENT_TIMESTAMP)
-            ON CONFLICT (user_id) DO UPDATE SET last_seen = CURRENT_TIMESTAMP""",
-            (user_id,)
-        )
+        cursor.execute_prepared("presence", {"user_id": user_id})
         db.commit()
     except DatabaseError as e:
         try: db.rollback()
@@ -923,20 +1622,25 @@ def heartbeat(payload: HeartbeatPayload):
         except: pass
     return {"status": "ok"}
 
+ONLINE_USERS_SQL = """
+    SELECT u.username FROM user_presence p
+    JOIN users u ON u.id = p.user_id
+    WHERE p.last_seen > CURRENT_TIMESTAMP - INTERVAL '15 seconds'
+"""
+register_statement("online_users", ONLINE_USERS_SQL)
+
+
 @app.get("/online_users")
-def get_online_users():
+def get_online_users(request: Request):
     """Returns list of usernames who sent a heartbeat in the last 15 seconds."""
-    db = get_db_connection()
+    enforce_rate_limit("poll", request)
+    db = get_db_connection(read_only=True)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute(
-            """SELECT u.username FROM user_presence p
-            JOIN users u ON u.id = p.user_id
-            WHERE p.last_seen > CURRENT_TIMESTAMP - INTERVAL '15 seconds'"""
-        )
+        cursor.execute_prepared("online_users")
         rows = cursor.fetchall()
         return [r["username"] for r in rows]
     finally:
@@ -945,139 +1649,26 @@ def get_online_users():
         except: pass
 
 # --- Create Database Tables (idempotent) ---
-def create_tables():
-    db = get_db_connection()
-    if db is None:
-        print("Could not connect to DB to create tables.")
-        return
-    cursor = None
-    try:
-        cursor = db.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) UNIQUE NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS posts (
-                id SERIAL PRIMARY KEY,
-                user_id INT NOT NULL,
-                text TEXT NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'approved' CHECK (status IN ('approved', 'pending', 'blocked')),
-                parent_id INT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (parent_id) REFERENCES posts(id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                id SERIAL PRIMARY KEY,
-                user_id INT NOT NULL UNIQUE,
-                bio TEXT,
-                profile_image_url VARCHAR(255),
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id SERIAL PRIMARY KEY,
-                sender_id INT NOT NULL,
-                receiver_id INT NOT NULL,
-                text TEXT NOT NULL,
-                status VARCHAR(20) NOT NULL DEFAULT 'approved' CHECK (status IN ('approved', 'pending')),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS message_reports (
-                id SERIAL PRIMARY KEY,
-                message_id INT NOT NULL,
-                reporter_id INT NOT NULL,
-                reported_user_id INT NOT NULL,
-                reason VARCHAR(50) NOT NULL,
-                description TEXT,
-                status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'resolved', 'dismissed')),
-                reviewed_by INT NULL,
-                reviewed_at TIMESTAMP NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (message_id, reporter_id),
-                FOREIGN KEY (message_id) REFERENCES chat_messages(id) ON DELETE CASCADE,
-                FOREIGN KEY (reporter_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (reported_user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (reviewed_by) REFERENCES users(id) ON DELETE SET NULL
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS chat_typing_status (
-                id SERIAL PRIMARY KEY,
-                sender_id INT NOT NULL,
-                receiver_id INT NOT NULL,
-                is_typing BOOLEAN NOT NULL DEFAULT FALSE,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE (sender_id, receiver_id),
-                FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INT PRIMARY KEY,
-                last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_reports_reporter ON message_reports(reporter_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_reports_reported ON message_reports(reported_user_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_reports_status ON message_reports(status)")
-        cursor.execute(
-            """
-            CREATE OR REPLACE VIEW v_pending_reports AS
-            SELECT
-                r.id AS report_id,
-                r.message_id,
-                r.reporter_id,
-                reporter.username AS reporter_username,
-                r.reported_user_id,
-                reported.username AS reported_username,
-                m.text AS message_content,
-                r.reason,
-                r.description,
-                r.status,
-                r.created_at
-            FROM message_reports r
-            JOIN users reporter ON reporter.id = r.reporter_id
-            JOIN users reported ON reported.id = r.reported_user_id
-            LEFT JOIN chat_messages m ON m.id = r.message_id
-            WHERE r.status = 'pending'
-            ORDER BY r.created_at DESC
-            """
-        )
-        db.commit()
-        print("Tables (posts, user_profiles, chat_messages, message_reports) checked/created successfully.")
-    except DatabaseError as e:
-        print(f"Error creating tables: {e}")
-    finally:
-        safe_close_cursor(cursor)
-        try:
-            db.close()
-        except Exception:
-            pass
+# Schema changes live in migrations/ and are applied by `python migrate.py`;
+# startup only compares the database's schema_version with this build.
+check_schema_version(auto_migrate=os.getenv("SCHEMA_AUTO_MIGRATE", "0") == "1")
+trust.start()
+start_replica_probe()
 
-create_tables()
+
+@app.on_event("shutdown")
+def flush_trust_scores():
+    chat_writer.stop()
+    trust.stop()
+    stop_replica_probe()
+    close_pools()
 
 
 # --- Post & Comment Endpoints ---
 @app.post("/create_post", response_model=PostResponse)
-def create_post(post: NewPost):
-    label, prob = classify_text(post.text)
+def create_post(post: NewPost, request: Request):
+    enforce_rate_limit("write", request, post.user)
+    label, prob, label_scores = classify_text(post.text, post.user)
     status = "pending" if label == "toxic" else "approved"
     notification = None
     if label == "toxic":
@@ -1086,7 +1677,7 @@ def create_post(post: NewPost):
         else:
             notification = f"Post from '{post.user}' is toxic ⚠️, waiting approval"
 
-    db = get_db_connection()
+    db = get_db_connection(username=post.user)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
@@ -1102,10 +1693,12 @@ def create_post(post: NewPost):
     cursor = None
     try:
         cursor = db.cursor()
-        query = "INSERT INTO posts (user_id, text, status, parent_id) VALUES (%s, %s, %s, %s) RETURNING id"
-        cursor.execute(query, (user_id, post.text, status, post.parent_id))
+        query = "INSERT INTO posts (user_id, text, status, parent_id, label_scores) VALUES (%s, %s, %s, %s, %s) RETURNING id"
+        cursor.execute(query, (user_id, post.text, status, post.parent_id, Json(label_scores) if label_scores else None))
         new_post_id = cursor.fetchone()[0]
         db.commit()
+        invalidate_cached("posts")
+        trust.record(post.user, "pending_post" if status == "pending" else "clean")
     except DatabaseError as e:
         try:
             db.rollback()
@@ -1120,7 +1713,7 @@ def create_post(post: NewPost):
     try:
         cursor = db.cursor(dictionary=True)
         cursor.execute(
-            "SELECT p.id, p.text, p.status, p.created_at, p.parent_id, u.username "
+            "SELECT p.id, p.text, p.status, p.created_at, p.parent_id, p.label_scores, u.username "
             "FROM posts p JOIN users u ON p.user_id = u.id WHERE p.id = %s",
             (new_post_id,),
         )
@@ -1133,6 +1726,7 @@ def create_post(post: NewPost):
             "status": status,
             "created_at": datetime.utcnow().isoformat(),
             "parent_id": post.parent_id,
+            "label_scores": label_scores,
             "username": post.user,
         }
     finally:
@@ -1145,23 +1739,43 @@ def create_post(post: NewPost):
     return {"post": created_post, "notification": notification}
 
 
+POSTS_SQL = """
+    SELECT p.id, p.text, p.status, p.created_at, p.parent_id, p.label_scores, u.username
+    FROM posts p
+    JOIN users u ON p.user_id = u.id
+    ORDER BY p.created_at DESC
+"""
+
+
+# table_versions counters are striped over slot rows (0008_striped_table_versions.sql)
+POSTS_VERSION_SQL = "SELECT sum(version)::bigint AS version FROM table_versions WHERE table_name = 'posts'"
+register_statement("posts_version", POSTS_VERSION_SQL)
+
+
 @app.get("/get_posts", response_model=List[dict])
-def get_posts():
-    db = get_db_connection()
+def get_posts(request: Request, username: Optional[str] = None):
+    """Polled by the home page and admin panel; answers 304 while no post changed."""
+    enforce_rate_limit("poll", request, username)
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
-    query = """
-        SELECT p.id, p.text, p.status, p.created_at, p.parent_id, u.username
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        ORDER BY p.created_at DESC
-    """
+    def build():
+        build_cursor = db.cursor(dictionary=True)
+        try:
+            build_cursor.execute(POSTS_SQL)
+            return build_post_tree(build_cursor.fetchall())
+        finally:
+            safe_close_cursor(build_cursor)
+
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute(query)
-        all_posts_and_comments = cursor.fetchall()
+        cursor.execute_prepared("posts_version")
+        version = cursor.fetchone()
+        if version is None:
+            return FastJSONResponse(build())
+        return cached_json(request, "posts", "posts", make_etag("posts", version["version"]), build)
     finally:
         safe_close_cursor(cursor)
         try:
@@ -1169,8 +1783,11 @@ def get_posts():
         except Exception:
             pass
 
-    posts_dict = {item["id"]: {**item, "comments": []} for item in all_posts_and_comments if item["parent_id"] is None}
-    for item in all_posts_and_comments:
+
+def build_post_tree(rows):
+    """Nest comment rows under their parent post, keeping the query's ordering."""
+    posts_dict = {item["id"]: {**item, "comments": []} for item in rows if item["parent_id"] is None}
+    for item in rows:
         if item["parent_id"] is not None:
             parent = posts_dict.get(item["parent_id"])
             if parent:
@@ -1187,6 +1804,7 @@ def approve_post(post_id: int):
         cursor = db.cursor()
         cursor.execute("UPDATE posts SET status = 'approved' WHERE id = %s", (post_id,))
         db.commit()
+        invalidate_cached("posts")
     finally:
         safe_close_cursor(cursor)
         try:
@@ -1204,6 +1822,7 @@ def block_post(post_id: int):
         cursor = db.cursor()
         cursor.execute("UPDATE posts SET status = 'blocked' WHERE id = %s", (post_id,))
         db.commit()
+        invalidate_cached("posts")
     finally:
         safe_close_cursor(cursor)
         try:
@@ -1223,6 +1842,7 @@ def delete_post(post_id: int):
         cursor = db.cursor()
         cursor.execute("DELETE FROM posts WHERE id = %s", (post_id,))
         db.commit()
+        invalidate_cached("posts")
         affected = cursor.rowcount
     except DatabaseError as e:
         try:
@@ -1244,42 +1864,86 @@ def delete_post(post_id: int):
 
 
 # --- Profile Endpoints ---
+DEFAULT_BIO = "Welcome to my SafeChat profile!"
+MAX_PROFILE_BATCH = 200
+
+# Users created before signup wrote a profile row (or bots) read as the default profile
+PROFILES_SQL = """
+    SELECT u.username, u.email,
+           CASE WHEN up.user_id IS NULL THEN %(default_bio)s ELSE up.bio END AS bio,
+           up.profile_image_url
+    FROM users u
+    LEFT JOIN user_profiles up ON up.user_id = u.id
+    WHERE u.username = ANY(%(usernames)s)
+"""
+register_statement("profiles", PROFILES_SQL)
+
+
+def load_profiles(usernames, db):
+    """{username: profile row} for the given usernames in one query; fills profile_cache."""
+    found = {}
+    cursor = None
+    try:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute_prepared("profiles", {"usernames": list(usernames), "default_bio": DEFAULT_BIO})
+        for row in cursor.fetchall():
+            profile_cache.put(row["username"], row)
+            found[row["username"]] = row
+    finally:
+        safe_close_cursor(cursor)
+    return found
+
+
 @app.get("/get_profile/{username}", response_model=ProfileData)
 def get_profile(username: str):
-    db = get_db_connection()
+    cached = profile_cache.get(username)
+    if cached is not None:
+        return ProfileData(**cached)
+
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
-
-    user_id = get_user_id(username, db)
-    if not user_id:
+    try:
+        profiles = load_profiles([username], db)
+    finally:
         try:
             db.close()
         except Exception:
             pass
-        raise HTTPException(status_code=404, detail="User not found")
 
-    cursor = None
-    try:
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT id, username, email FROM users WHERE id = %s", (user_id,))
-        user_data_full = cursor.fetchone()
+    if username not in profiles:
+        raise HTTPException(status_code=404, detail="User not found")
+    return ProfileData(**profiles[username])
 
-        cursor.execute("SELECT bio, profile_image_url FROM user_profiles WHERE user_id = %s", (user_data_full["id"],))
-        profile_data = cursor.fetchone()
 
-        if not profile_data:
-            default_bio = "Welcome to my SafeChat profile!"
-            cursor.execute("INSERT INTO user_profiles (user_id, bio) VALUES (%s, %s)", (user_data_full["id"], default_bio))
-            db.commit()
-            profile_data = {"bio": default_bio, "profile_image_url": None}
-    finally:
-        safe_close_cursor(cursor)
+@app.get("/profiles", response_model=List[ProfileSummary])
+def get_profiles(request: Request, username: List[str] = Query(default=[])):
+    """
+    Profiles for many users at once (?username=a&username=b), in request order;
+    unknown usernames are left out. Lets feed and user-list renders fetch every
+    avatar and bio with one request instead of one get_profile per row.
+    """
+    enforce_rate_limit("poll", request)
+    usernames = list(dict.fromkeys(username))
+    if not usernames:
+        return []
+    if len(usernames) > MAX_PROFILE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PROFILE_BATCH} usernames per request")
+
+    found, missing = profile_cache.get_many(usernames)
+    if missing:
+        db = get_db_connection(read_only=True)
+        if db is None:
+            raise HTTPException(status_code=500, detail="Database connection failed")
         try:
-            db.close()
-        except Exception:
-            pass
+            found.update(load_profiles(missing, db))
+        finally:
+            try:
+                db.close()
+            except Exception:
+                pass
 
-    return ProfileData(**user_data_full, **profile_data)
+    return [ProfileSummary(**found[name]) for name in usernames if name in found]
 
 
 @app.post("/upload_image/{username}")
@@ -1298,12 +1962,14 @@ async def upload_image(username: str, file: UploadFile = File(...)):
         except Exception:
             pass
 
+    # the file behind an existing URL may have been replaced
+    profile_cache.invalidate(username)
     return {"file_url": f"/{UPLOADS_DIR}/{filename}"}
 
 
 @app.post("/update_profile/{username}", response_model=ProfileData)
 def update_profile(username: str, profile: ProfileUpdate):
-    db = get_db_connection()
+    db = get_db_connection(username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
@@ -1348,6 +2014,7 @@ def update_profile(username: str, profile: ProfileUpdate):
         except Exception:
             pass
 
+    profile_cache.put(username, updated_data)
     return ProfileData(**updated_data)
 
 
@@ -1367,6 +2034,7 @@ def update_chat_message_status(message_id: int, status: str):
         cursor = db.cursor()
         cursor.execute("UPDATE chat_messages SET status = %s WHERE id = %s", (status, message_id))
         db.commit()
+        invalidate_cached_prefix("feed:")
         affected = cursor.rowcount
     except DatabaseError as e:
         try:
@@ -1388,10 +2056,19 @@ def update_chat_message_status(message_id: int, status: str):
 
 
 # --- Post History Endpoint ---
+USER_POST_HISTORY_SQL = """
+    SELECT p.id, p.text, p.status, p.created_at, p.parent_id, p.label_scores, u.username
+    FROM posts p
+    JOIN users u ON p.user_id = u.id
+    WHERE p.user_id = %(user_id)s
+    ORDER BY p.created_at DESC
+"""
+
+
 @app.get("/get_user_post_history/{username}", response_model=List[dict])
 def get_user_post_history(username: str):
     """Get all posts and comments by a specific user."""
-    db = get_db_connection()
+    db = get_db_connection(read_only=True, username=username)
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
@@ -1403,17 +2080,10 @@ def get_user_post_history(username: str):
             pass
         raise HTTPException(status_code=404, detail="User not found")
 
-    query = """
-        SELECT p.id, p.text, p.status, p.created_at, p.parent_id, u.username
-        FROM posts p
-        JOIN users u ON p.user_id = u.id
-        WHERE p.user_id = %s
-        ORDER BY p.created_at DESC
-    """
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute(query, (user_id,))
+        cursor.execute(USER_POST_HISTORY_SQL, {"user_id": user_id})
         posts = cursor.fetchall()
     finally:
         safe_close_cursor(cursor)
@@ -1434,16 +2104,17 @@ def get_reported_posts():
         raise HTTPException(status_code=500, detail="Database connection failed")
 
     query = """
-        SELECT p.id, p.post_id, p.text, p.created_at, u.username
+        SELECT p.id, p.parent_id AS post_id, p.text, p.created_at, u.username
         FROM posts p
         JOIN users u ON p.user_id = u.id
-        WHERE p.status = 'flag'
-        ORDER BY p.created_at DESC
+        WHERE p.status = 'pending'
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT %s
     """
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
-        cursor.execute(query)
+        cursor.execute(query, (MAX_REVIEW_PAGE,))
         posts = [ReportedPost(**row) for row in cursor.fetchall()]
     finally:
         safe_close_cursor(cursor)
@@ -1470,6 +2141,7 @@ def update_post_status(post_id: int, status: str):
         cursor = db.cursor(dictionary=True)
         cursor.execute("UPDATE posts SET status = %s WHERE id = %s", (status, post_id))
         db.commit()
+        invalidate_cached("posts")
 
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Post not found")
@@ -1522,7 +2194,7 @@ def get_users():
     try:
         cursor = db.cursor(dictionary=True)
         cursor.execute(query)
-        users = [UserSummary(**row) for row in cursor.fetchall()]
+        users = cursor.fetchall()
     finally:
         safe_close_cursor(cursor)
         try:
@@ -1530,7 +2202,8 @@ def get_users():
         except Exception:
             pass
 
-    return users
+    # rows already have UserSummary's fields; serialize them as they are
+    return FastJSONResponse(users)
 
 
 # --- Bulk Moderation Endpoint ---
@@ -1575,6 +2248,7 @@ def bulk_moderate(request: BulkModerationRequest):
 
         cursor.execute(query, [status_value] + request.item_ids)
         db.commit()
+        invalidate_cached("posts")
         updated_count = cursor.rowcount
     except HTTPException:
         raise
@@ -1609,6 +2283,19 @@ class ModerationStats(BaseModel):
     active_today: int = 0
 
 
+# One pass over posts instead of a COUNT per status.
+MODERATION_STATS_SQL = """
+    SELECT COUNT(*) AS total_posts,
+           COUNT(*) FILTER (WHERE status = 'pending') AS pending_review,
+           COUNT(*) FILTER (WHERE status = 'approved') AS approved,
+           COUNT(*) FILTER (WHERE status IN ('spam', 'toxic')) AS flagged,
+           COUNT(*) FILTER (WHERE status = 'removed') AS removed,
+           (SELECT COUNT(*) FROM users) AS total_users,
+           COUNT(DISTINCT user_id) FILTER (WHERE created_at >= CURRENT_DATE) AS active_today
+    FROM posts
+"""
+
+
 @app.get("/moderation_stats", response_model=ModerationStats)
 def get_moderation_stats():
     """Get dashboard statistics for content moderation."""
@@ -1616,43 +2303,89 @@ def get_moderation_stats():
     if db is None:
         raise HTTPException(status_code=500, detail="Database connection failed")
 
-    stats = {}
     cursor = None
     try:
         cursor = db.cursor(dictionary=True)
+        cursor.execute(MODERATION_STATS_SQL)
+        stats = cursor.fetchone()
+    finally:
+        safe_close_cursor(cursor)
+        try:
+            db.close()
+        except Exception:
+            pass
 
-        cursor.execute("SELECT COUNT(*) as total_posts FROM posts")
-        stats["total_posts"] = cursor.fetchone()["total_posts"]
+    return ModerationStats(**stats)
 
-        cursor.execute("SELECT COUNT(*) as pending FROM posts WHERE status = 'flag'")
-        stats["pending_review"] = cursor.fetchone()["pending"]
 
-        cursor.execute("SELECT COUNT(*) as approved FROM posts WHERE status = 'approved'")
-        stats["approved"] = cursor.fetchone()["approved"]
+# --- Bulk import / export (admin) ---
+# Streams tables in and out with COPY (see bulk_io.py). Exports include password
+# hashes, so these endpoints only exist when BULK_IO_TOKEN is set, and every
+# call must send it in X-Admin-Token.
+BULK_IO_TOKEN = os.getenv("BULK_IO_TOKEN", "")
 
-        cursor.execute("SELECT COUNT(*) as flagged FROM posts WHERE status IN ('spam', 'toxic')")
-        stats["flagged"] = cursor.fetchone()["flagged"]
 
-        cursor.execute("SELECT COUNT(*) as removed FROM posts WHERE status = 'removed'")
-        stats["removed"] = cursor.fetchone()["removed"]
+class BulkImportResult(BaseModel):
+    table: str
+    rows: int
+    inserted: int
+    updated: int
+    skipped: int
 
-        cursor.execute("SELECT COUNT(*) as total_users FROM users")
-        stats["total_users"] = cursor.fetchone()["total_users"]
 
-        cursor.execute("""
-            SELECT COUNT(DISTINCT user_id) as active FROM posts
-            WHERE created_at >= CURRENT_DATE
-        """)
-        stats["active_today"] = cursor.fetchone()["active"]
+def check_bulk_access(request: Request):
+    if not BULK_IO_TOKEN:
+        raise HTTPException(status_code=404, detail="Bulk import/export is disabled")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), BULK_IO_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
 
+@app.get("/admin/export/{table}", include_in_schema=False)
+def bulk_export(table: str, request: Request, format: str = "ndjson", since: Optional[str] = None):
+    """Stream a table as NDJSON or CSV (chunked; compressed when the client accepts it)."""
+    check_bulk_access(request)
+    try:
+        chunks = bulk_io.stream_export(table, format, since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DatabaseError as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
+    return StreamingResponse(chunks, media_type=bulk_io.MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="{table}.{format}"',
+    })
+
+
+def _import_stream(table, body, format, on_conflict):
+    db = get_db_connection()
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database connection failed")
+    try:
+        return bulk_io.import_table(db, table, body, format, on_conflict)
+    except DatabaseError as e:
+        raise HTTPException(status_code=400, detail=f"Import rejected: {e}")
     finally:
-        safe_close_cursor(cursor)
         try:
             db.close()
         except Exception:
             pass
 
-    return ModerationStats(**stats)
+
+@app.post("/admin/import/{table}", response_model=BulkImportResult, include_in_schema=False)
+async def bulk_import(table: str, request: Request, format: str = "ndjson", on_conflict: str = "skip"):
+    """Merge a streamed NDJSON / CSV body into a table; idempotent (see bulk_io.import_table)."""
+    check_bulk_access(request)
+    if table not in bulk_io.TABLES or format not in bulk_io.FORMATS or on_conflict not in bulk_io.CONFLICT_MODES:
+        raise HTTPException(status_code=400, detail=(
+            f"table must be one of {', '.join(bulk_io.TABLES)}; format one of {', '.join(bulk_io.FORMATS)}; "
+            f"on_conflict one of {', '.join(bulk_io.CONFLICT_MODES)}"
+        ))
+    body = bulk_io.StreamReader(request.stream())
+    result = await run_in_threadpool(_import_stream, table, body, format, on_conflict)
+    # imported rows bypass the write endpoints: drop what they would have invalidated
+    invalidate_cached_prefix("")
+    profile_cache.clear()
+    return result
 
 
 # --- End of File ---
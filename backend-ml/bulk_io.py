@@ -0,0 +1,570 @@
+# bulk_io.py
+"""
+Bulk export / import of the tables app.py owns (users, user_profiles, posts,
+chat_messages, message_reports) with Postgres COPY, as NDJSON or CSV.
+
+Export runs COPY ... TO STDOUT; NDJSON lines are built by Postgres
+(row_to_json), so rows never become Python objects. chat_messages exports
+chat_messages_all, archived months included. stream_export() runs the COPY in
+a thread that feeds a bounded queue of BULK_CHUNK_BYTES chunks, so an HTTP
+export holds at most BULK_QUEUE_CHUNKS chunks in memory, whatever the table
+size.
+
+Import is idempotent. Rows are COPYed into a temporary staging table, and rows
+that cannot be merged are dropped there:
+- duplicates within the file;
+- rows missing required columns;
+- rows referencing users (or parent posts) that do not exist;
+- rows whose unique key (username, email, report per message and reporter)
+  belongs to another row.
+The rest is merged with one INSERT ... ON CONFLICT, either skipping rows whose
+key already exists (on_conflict="skip") or overwriting them ("update").
+Re-running an import therefore changes nothing. Ids are kept, so a dataset
+exported from one database restores with its references intact; sequences
+are moved past the imported ids. Imported chat messages also upsert their
+conversations rows (inbox), counted as read. Each table is imported in one
+transaction.
+
+Usage:
+    python bulk_io.py export users -o users.ndjson
+    python bulk_io.py export chat_messages --format csv --since 2025-01-01 -o chat.csv.gz
+    python bulk_io.py export all --dir dataset/          # one snapshot, one file per table
+    python bulk_io.py import all --dir dataset/          # in dependency order
+    python bulk_io.py import posts posts.ndjson --on-conflict update
+
+Months imported into chat_messages that are older than CHAT_HOT_MONTHS are
+moved to the archive by the next chat_archive.py run.
+"""
+import argparse
+import gzip
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+from anyio.from_thread import run as run_in_event_loop
+from psycopg2 import Error as DatabaseError
+
+from database import get_db_connection
+
+
+BULK_CHUNK_BYTES = int(os.getenv("BULK_CHUNK_BYTES", str(64 * 1024)))
+BULK_QUEUE_CHUNKS = int(os.getenv("BULK_QUEUE_CHUNKS", "16"))
+
+FORMATS = ("ndjson", "csv")
+CONFLICT_MODES = ("skip", "update")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# In dependency order: importing "all" follows it, so references resolve.
+TABLES = {
+    "users": {
+        "source": "users",
+        "columns": ("id", "username", "email", "password", "created_at"),
+        "required": ("id", "username", "email", "password"),
+        "unique": (("id",), ("username",), ("email",)),
+        "key": ("id",),
+        "since": "created_at",
+        "sequence": True,
+        "checks": (
+            """DELETE FROM bulk_stage s WHERE EXISTS (
+                   SELECT 1 FROM users u WHERE (u.username = s.username OR u.email = s.email) AND u.id <> s.id)""",
+        ),
+    },
+    "user_profiles": {
+        "source": "user_profiles",
+        "columns": ("user_id", "bio", "profile_image_url", "updated_at"),
+        "required": ("user_id",),
+        "unique": (("user_id",),),
+        "key": ("user_id",),
+        "since": "updated_at",
+        "sequence": False,
+        "checks": (
+            "DELETE FROM bulk_stage s WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id)",
+        ),
+    },
+    "posts": {
+        "source": "posts",
+        "columns": ("id", "user_id", "text", "status", "parent_id", "created_at", "label_scores"),
+        "required": ("id", "user_id", "text", "status"),
+        "unique": (("id",),),
+        "key": ("id",),
+        "since": "created_at",
+        "sequence": True,
+        "checks": (
+            "DELETE FROM bulk_stage s WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id)",
+        ),
+        # comments whose parent is neither in posts nor staged; repeated for reply chains
+        "repeat_checks": (
+            """DELETE FROM bulk_stage s WHERE s.parent_id IS NOT NULL
+                   AND NOT EXISTS (SELECT 1 FROM posts p WHERE p.id = s.parent_id)
+                   AND NOT EXISTS (SELECT 1 FROM bulk_stage parent WHERE parent.id = s.parent_id)""",
+        ),
+    },
+    "chat_messages": {
+        "source": "chat_messages_all",
+        "columns": ("id", "sender_id", "receiver_id", "text", "status", "created_at", "label_scores"),
+        "required": ("id", "sender_id", "receiver_id", "text", "status", "created_at"),
+        "unique": (("id",),),
+        "key": ("id", "created_at"),
+        "since": "created_at",
+        "sequence": True,
+        "checks": (
+            """DELETE FROM bulk_stage s
+               WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.sender_id)
+                  OR NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.receiver_id)""",
+            # the primary key is (id, created_at); an id is still one message
+            """DELETE FROM bulk_stage s
+               WHERE EXISTS (SELECT 1 FROM chat_messages_archive a WHERE a.id = s.id)
+                  OR EXISTS (SELECT 1 FROM chat_messages m WHERE m.id = s.id AND m.created_at <> s.created_at)""",
+        ),
+        "before_merge": "SELECT ensure_chat_partitions(MIN(created_at)::date, 0) FROM bulk_stage HAVING COUNT(*) > 0",
+    },
+    "message_reports": {
+        "source": "message_reports",
+        "columns": ("id", "message_id", "message_created_at", "reporter_id", "reported_user_id", "reason",
+                    "description", "status", "reviewed_by", "reviewed_at", "created_at"),
+        "required": ("id", "message_id", "reporter_id", "reported_user_id", "reason", "status"),
+        "unique": (("id",), ("message_id", "reporter_id")),
+        "key": ("id",),
+        "since": "created_at",
+        "sequence": True,
+        "checks": (
+            """DELETE FROM bulk_stage s
+               WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.reporter_id)
+                  OR NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.reported_user_id)""",
+            """DELETE FROM bulk_stage s WHERE EXISTS (
+                   SELECT 1 FROM message_reports r
+                   WHERE r.message_id = s.message_id AND r.reporter_id = s.reporter_id AND r.id <> s.id)""",
+            """UPDATE bulk_stage s SET reviewed_by = NULL
+               WHERE s.reviewed_by IS NOT NULL AND NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.reviewed_by)""",
+        ),
+    },
+}
+
+# Imported messages count as read; a pair's last message only moves forward.
+CHAT_CONVERSATIONS_CTE = """,
+    pairs AS (
+        SELECT DISTINCT ON (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id))
+               LEAST(sender_id, receiver_id) AS user_low, GREATEST(sender_id, receiver_id) AS user_high,
+               id, sender_id, left(text, 120) AS preview, created_at
+        FROM merged
+        WHERE sender_id <> receiver_id
+        ORDER BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), created_at DESC, id DESC
+    ), conv AS (
+        INSERT INTO conversations AS c (user_low, user_high, last_message_id, last_sender_id, last_preview,
+                                        last_activity)
+        SELECT user_low, user_high, id, sender_id, preview, created_at FROM pairs
+        ON CONFLICT (user_low, user_high) DO UPDATE SET
+            last_message_id = EXCLUDED.last_message_id,
+            last_sender_id = EXCLUDED.last_sender_id,
+            last_preview = EXCLUDED.last_preview,
+            last_activity = EXCLUDED.last_activity
+        WHERE EXCLUDED.last_activity >= c.last_activity
+    )"""
+
+# COPY's CSV format with a quote and delimiter that never occur in row_to_json
+# output passes each JSON document through untouched (no escaping either way).
+_RAW_LINES = "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'"
+
+
+def table_spec(table):
+    spec = TABLES.get(table)
+    if spec is None:
+        raise ValueError(f"Unknown table {table!r}; expected one of {', '.join(TABLES)}")
+    return spec
+
+
+def export_sql(cursor, table, fmt="ndjson", since=None):
+    """The COPY ... TO STDOUT statement for one table (since filters on its time column)."""
+    spec = table_spec(table)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    select = f"SELECT {', '.join(spec['columns'])} FROM {spec['source']}"
+    if since is not None:
+        if isinstance(since, str):
+            try:
+                since = datetime.fromisoformat(since)
+            except ValueError:
+                raise ValueError(f"Invalid since timestamp {since!r}; expected ISO 8601") from None
+        select += cursor.mogrify(f" WHERE {spec['since']} >= %s", (since,)).decode()
+    if fmt == "csv":
+        return f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+    return f"COPY (SELECT row_to_json(r) FROM ({select}) r) TO STDOUT WITH ({_RAW_LINES})"
+
+
+def copy_out(db, table, sink, fmt="ndjson", since=None):
+    """COPY one table into sink (anything with write(bytes))."""
+    cursor = db.cursor()
+    try:
+        cursor.copy_expert(export_sql(cursor, table, fmt, since), sink, size=BULK_CHUNK_BYTES)
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+# --- Streaming export (HTTP) ---
+class ExportCancelled(Exception):
+    pass
+
+
+_DONE = object()
+
+
+class _QueueSink:
+    """File-like COPY target that batches rows into chunks on a bounded queue."""
+
+    def __init__(self, chunks, cancelled):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data.encode("utf-8") if isinstance(data, str) else data
+        if len(self._buffer) >= BULK_CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def stream_export(table, fmt="ndjson", since=None):
+    """
+    One table's COPY output as an iterator of chunks (for a StreamingResponse).
+    Bad arguments and connection failures raise here, before any byte is sent.
+    Reads go to a replica when one is healthy.
+    """
+    db = get_db_connection(read_only=True)
+    if db is None:
+        raise DatabaseError("Database connection failed")
+    cursor = db.cursor()
+    try:
+        sql = export_sql(cursor, table, fmt, since)
+    except Exception:
+        db.close()
+        raise
+    finally:
+        cursor.close()
+    return _stream_copy(db, sql, table)
+
+
+def _stream_copy(db, sql, table):
+    """Closing the generator early (client gone) stops the COPY."""
+    chunks = queue.Queue(maxsize=BULK_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    sink = _QueueSink(chunks, cancelled)
+    finished = threading.Event()
+
+    def produce():
+        cursor = db.cursor()
+        try:
+            cursor.copy_expert(sql, sink, size=BULK_CHUNK_BYTES)
+            sink.flush()
+            sink.put(_DONE)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            print(f"Bulk export of {table} failed: {e}")
+            try:
+                sink.put(e)
+            except ExportCancelled:
+                pass
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            finished.set()
+
+    thread = threading.Thread(target=produce, name=f"bulk-export-{table}", daemon=True)
+    thread.start()
+    completed = False
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                completed = True
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        finished.wait(timeout=10)
+        if completed:
+            db.close()
+        else:
+            # a COPY cut short leaves the session mid-protocol: do not pool it
+            db.discard()
+
+
+# --- Import ---
+def _stage_sql(spec, fmt):
+    columns = ", ".join(spec["columns"])
+    if fmt == "csv":
+        # HEADER MATCH: a file whose columns are in another order is rejected, not misread
+        return [f"COPY bulk_stage ({columns}) FROM STDIN WITH (FORMAT csv, HEADER MATCH)"], []
+    return (
+        [f"COPY bulk_stage_json (doc) FROM STDIN WITH ({_RAW_LINES})"],
+        [f"""INSERT INTO bulk_stage ({columns})
+             SELECT r.* FROM bulk_stage_json j, jsonb_populate_record(NULL::bulk_stage, j.doc) r
+             WHERE j.doc IS NOT NULL"""],
+    )
+
+
+def _merge_sql(spec, table, on_conflict):
+    columns = ", ".join(spec["columns"])
+    key = ", ".join(spec["key"])
+    if on_conflict == "update":
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in spec["columns"] if c not in spec["key"])
+        action = f"DO UPDATE SET {updates}"
+    else:
+        action = "DO NOTHING"
+    sql = f"""
+        WITH merged AS (
+            INSERT INTO {table} AS t ({columns})
+            SELECT {columns} FROM bulk_stage
+            ON CONFLICT ({key}) {action}
+            RETURNING t.*
+        )"""
+    if table == "chat_messages":
+        sql += CHAT_CONVERSATIONS_CTE
+    return sql + """
+        SELECT COUNT(*) FROM merged
+    """
+
+
+def import_table(db, table, source, fmt="ndjson", on_conflict="skip"):
+    """
+    COPY source (anything with read(size)) into table through a staging table
+    and commit; returns {"table", "rows", "inserted", "updated", "skipped"}.
+    Rolls back and re-raises on errors.
+    """
+    spec = table_spec(table)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"Unknown conflict mode {on_conflict!r}; expected one of {', '.join(CONFLICT_MODES)}")
+    columns = ", ".join(spec["columns"])
+    copy_sql, load_sql = _stage_sql(spec, fmt)
+
+    cursor = db.cursor()
+    try:
+        cursor.execute(f"CREATE TEMP TABLE bulk_stage ON COMMIT DROP AS "
+                       f"SELECT {columns} FROM {table} WITH NO DATA")
+        cursor.execute("CREATE TEMP TABLE bulk_stage_json (doc JSONB) ON COMMIT DROP")
+        cursor.copy_expert(copy_sql[0], source, size=BULK_CHUNK_BYTES)
+        for sql in load_sql:
+            cursor.execute(sql)
+        cursor.execute("SELECT COUNT(*) FROM bulk_stage")
+        staged = cursor.fetchone()[0]
+
+        missing = " OR ".join(f"{c} IS NULL" for c in spec["required"])
+        cursor.execute(f"DELETE FROM bulk_stage WHERE {missing}")
+        for unique in spec["unique"]:
+            match = " AND ".join(f"a.{c} = b.{c}" for c in unique)
+            cursor.execute(f"DELETE FROM bulk_stage a USING bulk_stage b WHERE a.ctid > b.ctid AND {match}")
+        for sql in spec["checks"]:
+            cursor.execute(sql)
+        for sql in spec.get("repeat_checks", ()):
+            cursor.execute(sql)
+            while cursor.rowcount > 0:
+                cursor.execute(sql)
+        cursor.execute("ANALYZE bulk_stage")
+        if spec.get("before_merge"):
+            cursor.execute(spec["before_merge"])
+
+        # rows whose key exists are the updates (RETURNING xmax is not available on partitioned tables)
+        match = " AND ".join(f"t.{c} = s.{c}" for c in spec["key"])
+        cursor.execute(f"SELECT COUNT(*) FROM bulk_stage s WHERE EXISTS (SELECT 1 FROM {table} t WHERE {match})")
+        existing = cursor.fetchone()[0]
+        cursor.execute(_merge_sql(spec, table, on_conflict))
+        merged = cursor.fetchone()[0]
+        updated = existing if on_conflict == "update" else 0
+        inserted = merged - updated
+        if spec["sequence"]:
+            # move the sequence past imported ids so new rows do not collide with them
+            cursor.execute(
+                """SELECT setval(s.seq, m.max_id)
+                   FROM (SELECT pg_get_serial_sequence(%s, 'id')::regclass AS seq) s,
+                        (SELECT MAX(id) AS max_id FROM bulk_stage) m
+                   WHERE m.max_id > COALESCE(pg_sequence_last_value(s.seq), 0)""",
+                (table,),
+            )
+        db.commit()
+    except Exception:
+        try:
+            db.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    return {"table": table, "rows": staged, "inserted": inserted, "updated": updated,
+            "skipped": staged - inserted - updated}
+
+
+class StreamReader:
+    """
+    File-like view of an async byte iterator (a request body) for COPY FROM,
+    read from a worker thread: each read pulls the next chunk from the event
+    loop, so only one chunk is held at a time.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._buffer = b""
+        self._done = False
+
+    async def _next(self):
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, size=-1):
+        while not self._done and (size < 0 or len(self._buffer) < size):
+            chunk = run_in_event_loop(self._next)
+            if chunk is None:
+                self._done = True
+            else:
+                self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+# --- CLI ---
+def _format_for(path, default):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return default
+
+
+def _open(path, mode):
+    if path == "-":
+        return sys.stdin.buffer if "r" in mode else sys.stdout.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _table_path(directory, table, fmt, compress):
+    return os.path.join(directory, f"{table}.{fmt}{'.gz' if compress else ''}")
+
+
+def export_all(db, directory, fmt="ndjson", since=None, compress=False):
+    """Every table from one snapshot, so references between the files are consistent."""
+    os.makedirs(directory, exist_ok=True)
+    cursor = db.cursor()
+    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+    cursor.close()
+    for table in TABLES:
+        path = _table_path(directory, table, fmt, compress)
+        with _open(path, "wb") as f:
+            copy_out(db, table, f, fmt, since)
+        print(f"Exported {table} -> {path}")
+    db.rollback()
+
+
+def import_all(db, directory, on_conflict="skip"):
+    results = []
+    for table in TABLES:
+        for fmt in FORMATS:
+            path = next((p for p in (_table_path(directory, table, fmt, False),
+                                     _table_path(directory, table, fmt, True)) if os.path.exists(p)), None)
+            if path is not None:
+                break
+        if path is None:
+            print(f"Skipping {table}: no {table}.ndjson / {table}.csv in {directory}")
+            continue
+        with _open(path, "rb") as f:
+            result = import_table(db, table, f, fmt, on_conflict)
+        print(_summary(result))
+        results.append(result)
+    return results
+
+
+def _summary(result):
+    return (f"Imported {result['table']}: {result['rows']} rows, {result['inserted']} inserted, "
+            f"{result['updated']} updated, {result['skipped']} skipped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream SafeChat tables in or out with COPY (NDJSON or CSV).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    targets = list(TABLES) + ["all"]
+
+    export = sub.add_parser("export", help="write a table (or all of them) to files or stdout")
+    export.add_argument("table", choices=targets)
+    export.add_argument("-o", "--output", default="-", help="file (.gz to compress) or - for stdout")
+    export.add_argument("--dir", help="output directory for 'all'")
+    export.add_argument("--format", choices=FORMATS, help="default: from the file name, else ndjson")
+    export.add_argument("--since", help="only rows created (profiles: updated) at or after this timestamp")
+    export.add_argument("--gzip", action="store_true", help="compress the files written for 'all'")
+
+    imp = sub.add_parser("import", help="merge a file (or a directory from 'export all') into the database")
+    imp.add_argument("table", choices=targets)
+    imp.add_argument("input", nargs="?", default="-", help="file (.gz is decompressed) or - for stdin")
+    imp.add_argument("--dir", help="input directory for 'all'")
+    imp.add_argument("--format", choices=FORMATS, help="default: from the file name, else ndjson")
+    imp.add_argument("--on-conflict", choices=CONFLICT_MODES, default="skip",
+                     help="rows whose key exists: keep the database's (skip) or overwrite them (update)")
+    args = parser.parse_args(argv)
+
+    if args.table == "all" and not args.dir:
+        parser.error("'all' needs --dir")
+    db = get_db_connection()
+    if db is None:
+        print("Database connection failed")
+        return 1
+    try:
+        if args.command == "export":
+            if args.table == "all":
+                export_all(db, args.dir, args.format or "ndjson", args.since, args.gzip)
+            else:
+                fmt = args.format or _format_for(args.output, "ndjson")
+                with _open(args.output, "wb") as f:
+                    copy_out(db, args.table, f, fmt, args.since)
+                db.rollback()
+        elif args.table == "all":
+            import_all(db, args.dir, args.on_conflict)
+        else:
+            fmt = args.format or _format_for(args.input, "ndjson")
+            with _open(args.input, "rb") as f:
+                print(_summary(import_table(db, args.table, f, fmt, args.on_conflict)))
+    except (DatabaseError, ValueError) as e:
+        print(f"Bulk {args.command} failed: {e}")
+        return 1
+    finally:
+        try:
+            db.close()
+        except Exception:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# chat_archive.py
+"""
+Partition maintenance for chat_messages (see migrations/0004_partition_chat_messages.sql).
+
+One run:
+1. creates the monthly partitions for the next CHAT_PARTITIONS_AHEAD months
+   (ensure_chat_partitions), so inserts never fall into the DEFAULT partition;
+2. moves months older than CHAT_HOT_MONTHS out of chat_messages into
+   chat_messages_archive (DETACH and ATTACH in one transaction, so a month is
+   always in exactly one of them), then optionally SET TABLESPACE to
+   CHAT_ARCHIVE_TABLESPACE (a cheaper or compressed volume). The hot table and
+   its indexes stay small; lookups by id still find archived rows through the
+   chat_messages_all view;
+3. fills message_reports.message_created_at for reports written without it.
+
+DETACH briefly locks chat_messages (CONCURRENTLY is not allowed while the
+DEFAULT partition exists), so it runs under CHAT_ARCHIVE_LOCK_TIMEOUT and a
+month that cannot get the lock is retried by the next run. A month left
+standalone (detached by hand) is attached to the archive as well. An advisory
+lock keeps concurrent runs (cron overlap) apart.
+
+Usage:
+    python chat_archive.py                 # run from cron / a Kubernetes CronJob, e.g. daily
+    python chat_archive.py --dry-run
+    python chat_archive.py --hot-months 3 --ahead 2
+"""
+import argparse
+import os
+import re
+import sys
+from datetime import date
+
+from psycopg2 import Error as DatabaseError
+from psycopg2.errors import LockNotAvailable
+
+from database import get_db_connection
+
+
+CHAT_HOT_MONTHS = int(os.getenv("CHAT_HOT_MONTHS", "6"))
+CHAT_PARTITIONS_AHEAD = int(os.getenv("CHAT_PARTITIONS_AHEAD", "3"))
+CHAT_ARCHIVE_TABLESPACE = os.getenv("CHAT_ARCHIVE_TABLESPACE", "")
+CHAT_ARCHIVE_LOCK_TIMEOUT = os.getenv("CHAT_ARCHIVE_LOCK_TIMEOUT", "5s")
+ARCHIVE_LOCK_KEY = 4231771904  # pg_advisory_lock key, next to migrate.py's
+
+_PARTITION_RE = re.compile(r"^chat_messages_(\d{4})_(\d{2})$")
+
+
+def _month_bounds(name):
+    match = _PARTITION_RE.match(name)
+    if not match:
+        return None
+    start = date(int(match.group(1)), int(match.group(2)), 1)
+    end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start, end
+
+
+def archive_cutoff(today, hot_months):
+    """First day of the oldest month that stays hot."""
+    months = today.year * 12 + today.month - 1 - hot_months
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def month_tables(cursor):
+    """{name: parent or None} for every chat_messages_YYYY_MM table."""
+    cursor.execute("""
+        SELECT c.relname, parent.relname
+        FROM pg_class c
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+        LEFT JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+          AND c.relname ~ '^chat_messages_[0-9]{4}_[0-9]{2}$'
+    """)
+    return dict(cursor.fetchall())
+
+
+def _archive_partition(db, cursor, name, attached_to_hot):
+    """Move one month to the archive; False when chat_messages could not be locked in time."""
+    start, end = _month_bounds(name)
+    try:
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)", (CHAT_ARCHIVE_LOCK_TIMEOUT,))
+        if attached_to_hot:
+            cursor.execute(f"ALTER TABLE chat_messages DETACH PARTITION {name}")
+        cursor.execute(
+            f"ALTER TABLE chat_messages_archive ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+            (start, end),
+        )
+        db.commit()
+    except LockNotAvailable:
+        db.rollback()
+        print(f"{name}: chat_messages is busy, retrying on the next run")
+        return False
+    if CHAT_ARCHIVE_TABLESPACE:
+        # rewrites the month; only the (now archived) partition is locked
+        cursor.execute(f'ALTER TABLE {name} SET TABLESPACE "{CHAT_ARCHIVE_TABLESPACE}"')
+        db.commit()
+    return True
+
+
+def run(hot_months=CHAT_HOT_MONTHS, ahead=CHAT_PARTITIONS_AHEAD, dry_run=False):
+    """One maintenance pass; returns the names of the archived partitions."""
+    db = get_db_connection()
+    if db is None:
+        raise RuntimeError("Database connection failed")
+    cutoff = archive_cutoff(date.today(), hot_months)
+    archived = []
+    cursor = db.cursor()
+    try:
+        db.set_autocommit(True)
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (ARCHIVE_LOCK_KEY,))
+        locked = cursor.fetchone()[0]
+        db.set_autocommit(False)
+        if not locked:
+            print("Another chat_archive run holds the lock; skipping.")
+            return archived
+        try:
+            if dry_run:
+                print(f"Would ensure partitions through {ahead} months ahead")
+            else:
+                cursor.execute("SELECT ensure_chat_partitions(CURRENT_DATE, %s)", (ahead,))
+                created = cursor.fetchone()[0]
+                db.commit()
+                if created:
+                    print(f"Created {created} chat_messages partition(s)")
+
+            tables = month_tables(cursor)
+            db.commit()
+            for name in sorted(tables):
+                parent = tables[name]
+                if parent == "chat_messages_archive" or _month_bounds(name)[1] > cutoff:
+                    continue
+                if dry_run:
+                    print(f"Would archive {name}")
+                    archived.append(name)
+                    continue
+                print(f"Archiving {name}...")
+                if _archive_partition(db, cursor, name, attached_to_hot=parent == "chat_messages"):
+                    archived.append(name)
+
+            if not dry_run:
+                cursor.execute("""
+                    UPDATE message_reports r SET message_created_at = m.created_at
+                    FROM chat_messages_all m
+                    WHERE r.message_created_at IS NULL AND m.id = r.message_id
+                """)
+                if cursor.rowcount:
+                    print(f"Backfilled message_created_at on {cursor.rowcount} report(s)")
+                db.commit()
+        except DatabaseError:
+            db.rollback()
+            raise
+        finally:
+            db.rollback()
+            db.set_autocommit(True)
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (ARCHIVE_LOCK_KEY,))
+            db.set_autocommit(False)
+    finally:
+        cursor.close()
+        try:
+            db.close()
+        except Exception:
+            pass
+    return archived
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create upcoming chat_messages partitions and archive old ones.")
+    parser.add_argument("--hot-months", type=int, default=CHAT_HOT_MONTHS,
+                        help="months (before the current one) kept in chat_messages")
+    parser.add_argument("--ahead", type=int, default=CHAT_PARTITIONS_AHEAD,
+                        help="months of partitions to create in advance")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    try:
+        archived = run(args.hot_months, args.ahead, args.dry_run)
+    except (DatabaseError, RuntimeError) as e:
+        print(f"Chat archive failed: {e}")
+        return 1
+    if not archived:
+        print("Nothing to archive.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+# chat_writer.py
+"""
+Group commit for chat message inserts.
+
+send_message hands its rows (the user's message, plus Dana's reply when
+chatting with the bot) to a single writer thread instead of committing on its
+own connection. The writer waits up to CHAT_WRITER_MAX_WAIT_MS after the first
+queued row for more to arrive, or until CHAT_WRITER_MAX_BATCH rows are queued,
+then writes them all with one multi-row INSERT_MESSAGES_SQL in one
+transaction on its own connection. Each caller gets back the (id, created_at)
+of its own rows once that transaction has committed.
+
+Failure isolation: when the batch statement fails (e.g. a sender was deleted
+meanwhile and the foreign key rejects the row), the batch is rolled back and
+replayed one caller at a time, so only the offending caller sees the error.
+A caller's rows always go into the same transaction.
+
+INSERT_MESSAGES_SQL also maintains conversations (migrations/0005): rows are
+folded per user pair first, because one statement cannot upsert the same
+conversations row twice. With CHAT_WRITER_ENABLED=0, write_messages() runs
+the same statement on the caller's connection.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from psycopg2 import Error as DatabaseError
+from psycopg2.extras import Json, execute_values
+
+from database import get_db_connection
+from telemetry import CHAT_WRITER_BATCH, CHAT_WRITER_FLUSHES
+
+
+CHAT_WRITER_ENABLED = os.getenv("CHAT_WRITER_ENABLED", "1") == "1"
+CHAT_WRITER_MAX_BATCH = int(os.getenv("CHAT_WRITER_MAX_BATCH", "200"))
+CHAT_WRITER_MAX_WAIT_MS = float(os.getenv("CHAT_WRITER_MAX_WAIT_MS", "3"))
+CHAT_WRITER_TIMEOUT = float(os.getenv("CHAT_WRITER_TIMEOUT", "10"))
+INBOX_PREVIEW_CHARS = 120
+
+# Ids are drawn in the `new_rows` CTE (materialized: it is read twice and calls
+# nextval), so RETURNING rows can be matched back to their input position.
+# A message that commits late with an older created_at still counts as unread
+# but does not replace a newer last message.
+INSERT_MESSAGES_SQL = f"""
+    WITH new_rows AS (
+        SELECT nextval('chat_messages_id_seq')::int AS id, v.*
+        FROM (VALUES %s) AS v(ord, sender_id, receiver_id, text, status, label_scores)
+    ), msg AS (
+        INSERT INTO chat_messages (id, sender_id, receiver_id, text, status, label_scores)
+        SELECT id, sender_id, receiver_id, text, status, label_scores FROM new_rows ORDER BY ord
+        RETURNING id, sender_id, receiver_id, text, created_at
+    ), pairs AS (
+        SELECT LEAST(sender_id, receiver_id) AS user_low, GREATEST(sender_id, receiver_id) AS user_high,
+               (array_agg(id ORDER BY created_at DESC, id DESC))[1] AS last_message_id,
+               (array_agg(sender_id ORDER BY created_at DESC, id DESC))[1] AS last_sender_id,
+               (array_agg(left(text, {INBOX_PREVIEW_CHARS}) ORDER BY created_at DESC, id DESC))[1] AS last_preview,
+               MAX(created_at) AS last_activity,
+               COUNT(*) FILTER (WHERE receiver_id < sender_id)::int AS unread_low,
+               COUNT(*) FILTER (WHERE receiver_id > sender_id)::int AS unread_high
+        FROM msg
+        WHERE sender_id <> receiver_id
+        GROUP BY 1, 2
+    ), conv AS (
+        INSERT INTO conversations AS c (
+            user_low, user_high, last_message_id, last_sender_id, last_preview, last_activity,
+            unread_low, unread_high
+        )
+        SELECT user_low, user_high, last_message_id, last_sender_id, last_preview, last_activity,
+               unread_low, unread_high
+        FROM pairs
+        ON CONFLICT (user_low, user_high) DO UPDATE SET
+            last_message_id = CASE WHEN EXCLUDED.last_activity >= c.last_activity
+                                   THEN EXCLUDED.last_message_id ELSE c.last_message_id END,
+            last_sender_id = CASE WHEN EXCLUDED.last_activity >= c.last_activity
+                                  THEN EXCLUDED.last_sender_id ELSE c.last_sender_id END,
+            last_preview = CASE WHEN EXCLUDED.last_activity >= c.last_activity
+                                THEN EXCLUDED.last_preview ELSE c.last_preview END,
+            last_activity = GREATEST(c.last_activity, EXCLUDED.last_activity),
+            unread_low = c.unread_low + EXCLUDED.unread_low,
+            unread_high = c.unread_high + EXCLUDED.unread_high
+    )
+    SELECT new_rows.ord, msg.id, msg.created_at
+    FROM msg JOIN new_rows ON new_rows.id = msg.id
+    ORDER BY new_rows.ord
+"""
+_VALUES_TEMPLATE = "(%s::int, %s::int, %s::int, %s::text, %s::varchar, %s::jsonb)"
+
+
+def insert_chat_messages(cursor, rows):
+    """
+    Insert rows of (sender_id, receiver_id, text, status, label_scores) in one
+    statement; returns [(id, created_at)] in input order. Does not commit.
+    """
+    values = [
+        (ord_, sender_id, receiver_id, text, status, Json(label_scores) if label_scores else None)
+        for ord_, (sender_id, receiver_id, text, status, label_scores) in enumerate(rows)
+    ]
+    result = execute_values(cursor, INSERT_MESSAGES_SQL, values, template=_VALUES_TEMPLATE,
+                            page_size=len(values), fetch=True)
+    return [(row[1], row[2]) for row in result]
+
+
+class _Request:
+    __slots__ = ("rows", "future")
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.future = Future()
+
+
+class ChatWriter:
+    def __init__(self, max_batch=CHAT_WRITER_MAX_BATCH, max_wait_ms=CHAT_WRITER_MAX_WAIT_MS):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = []
+        self._queued_rows = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._db = None
+
+    def submit(self, rows):
+        """Queue one caller's rows; the Future resolves to their [(id, created_at)]."""
+        request = _Request(list(rows))
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("chat writer is stopped")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                self._thread.start()
+            self._queue.append(request)
+            self._queued_rows += len(request.rows)
+            self._cond.notify()
+        return request.future
+
+    def write(self, rows, timeout=CHAT_WRITER_TIMEOUT):
+        return self.submit(rows).result(timeout)
+
+    def stop(self):
+        """Flush what is queued, then end the writer thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=CHAT_WRITER_TIMEOUT)
+        if self._db is not None:
+            try:
+                self._db.close()
+            except Exception:
+                pass
+            self._db = None
+
+    def _take_batch(self):
+        """Wait for work, then for the batch to fill or max_wait to pass; pops whole requests."""
+        with self._cond:
+            while not self._queue and not self._stopping:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = time.monotonic() + self.max_wait
+            while self._queued_rows < self.max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, n_rows = [], 0
+            while self._queue and (not batch or n_rows + len(self._queue[0].rows) <= self.max_batch):
+                request = self._queue.pop(0)
+                batch.append(request)
+                n_rows += len(request.rows)
+            self._queued_rows -= n_rows
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self._flush(batch)
+            except Exception as e:  # never let the writer thread die with callers waiting
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _connection(self):
+        if self._db is None:
+            self._db = get_db_connection()
+            if self._db is None:
+                raise DatabaseError("Database connection failed")
+        return self._db
+
+    def _drop_connection(self):
+        if self._db is not None:
+            try:
+                self._db.close()
+            except Exception:
+                pass
+            self._db = None
+
+    def _flush(self, batch):
+        rows = [row for request in batch for row in request.rows]
+        CHAT_WRITER_BATCH.observe(len(rows))
+        try:
+            db = self._connection()
+        except DatabaseError as e:
+            CHAT_WRITER_FLUSHES.inc("failed")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        cursor = db.cursor()
+        try:
+            results = insert_chat_messages(cursor, rows)
+            db.commit()
+        except DatabaseError as e:
+            try:
+                db.rollback()
+            except Exception:
+                self._drop_connection()
+            print(f"Chat writer: batch of {len(rows)} failed ({e}); retrying per caller")
+            self._flush_one_by_one(batch)
+            return
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+        CHAT_WRITER_FLUSHES.inc("ok")
+        position = 0
+        for request in batch:
+            request.future.set_result(results[position:position + len(request.rows)])
+            position += len(request.rows)
+
+    def _flush_one_by_one(self, batch):
+        CHAT_WRITER_FLUSHES.inc("isolated")
+        for request in batch:
+            cursor = None
+            try:
+                db = self._connection()
+                cursor = db.cursor()
+                results = insert_chat_messages(cursor, request.rows)
+                db.commit()
+                request.future.set_result(results)
+            except DatabaseError as e:
+                if self._db is not None:
+                    try:
+                        self._db.rollback()
+                    except Exception:
+                        self._drop_connection()
+                request.future.set_exception(e)
+            finally:
+                if cursor is not None:
+                    try:
+                        cursor.close()
+                    except Exception:
+                        pass
+
+
+writer = ChatWriter()
+
+
+def write_messages(rows, db):
+    """
+    Insert and commit rows of (sender_id, receiver_id, text, status,
+    label_scores) as one unit; returns [(id, created_at)]. Goes through the
+    group-commit writer unless CHAT_WRITER_ENABLED=0, in which case db is used.
+    """
+    if CHAT_WRITER_ENABLED:
+        return writer.write(rows)
+    cursor = db.cursor()
+    try:
+        results = insert_chat_messages(cursor, rows)
+        db.commit()
+        return results
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
@@ -0,0 +1,657 @@
+# classifier.py
+"""
+The moderation pipeline behind classify_text: script / language detection,
+Hindi/Hinglish keyword check (romanized and Devanagari), OpenRouter LLM, local
+TF-IDF model (binary score plus per-label heads).
+
+classify() takes the sender's trust route (trust.route_for) rather than a
+username, so the same code runs in a web worker and in the classifier service
+(classifier_service.py), which owns the models for every worker. Callers that
+have already scored a text (the service scores a whole batch with one
+transform) pass the (prob, label_scores) pair as `score`; otherwise the
+local model is run when a tier needs it.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import joblib
+import numpy as np
+import requests
+
+from ratelimit import LLM_SLOTS
+from telemetry import CLASSIFY_RESULTS, CLASSIFY_TIER_LATENCY, LLM_FALLBACKS, LLM_REQUESTS, LLM_SHED, CLASSIFY_SCRIPTS
+
+
+# --- ML model paths & lazy loader ---
+VECT_PATH = os.path.join("models", "vectorizer.joblib")
+MODEL_PATH = os.path.join("models", "model.joblib")
+HEADS_PATH = os.path.join("models", "heads.joblib")
+vectorizer = None
+model = None
+
+# Fused scoring matrix: the binary model's weights (when it is linear) plus one
+# column per label head, so a single sparse x dense product scores everything.
+label_names = []
+score_weights = None
+score_bias = None
+binary_fused = False
+_load_lock = threading.Lock()
+
+# Decision threshold for the local model, written by `python evaluate.py`
+THRESHOLD_REPORT_PATH = os.getenv("THRESHOLD_REPORT_PATH", os.path.join("models", "threshold.json"))
+THRESHOLD_REPORT_VERSION = 1
+DEFAULT_TOXIC_THRESHOLD = 0.7
+toxic_threshold = DEFAULT_TOXIC_THRESHOLD
+# Local-model threshold for repeat offenders (see trust.py); stricter than toxic_threshold
+OFFENDER_TOXIC_THRESHOLD = float(os.getenv("TRUST_OFFENDER_THRESHOLD", "0.5"))
+
+
+def load_decision_threshold():
+    """
+    Read the threshold chosen by evaluate.py. The report is only trusted when its
+    version is supported and it was computed for the model file being served;
+    otherwise the default threshold is kept.
+    """
+    if not os.path.exists(THRESHOLD_REPORT_PATH):
+        return DEFAULT_TOXIC_THRESHOLD
+    try:
+        with open(THRESHOLD_REPORT_PATH) as f:
+            report = json.load(f)
+        if report.get("version") != THRESHOLD_REPORT_VERSION:
+            print(f"Unsupported threshold report version {report.get('version')}; using {DEFAULT_TOXIC_THRESHOLD}.")
+            return DEFAULT_TOXIC_THRESHOLD
+        expected_sha = report.get("artifacts", {}).get("model", {}).get("sha256")
+        if expected_sha:
+            h = hashlib.sha256()
+            with open(MODEL_PATH, "rb") as model_file:
+                for chunk in iter(lambda: model_file.read(1 << 20), b""):
+                    h.update(chunk)
+            if h.hexdigest() != expected_sha:
+                print(f"Threshold report was computed for a different model; using {DEFAULT_TOXIC_THRESHOLD}.")
+                return DEFAULT_TOXIC_THRESHOLD
+        threshold = float(report["threshold"])
+        if not 0.0 < threshold < 1.0:
+            raise ValueError(f"threshold {threshold} out of range")
+        print(f"Loaded decision threshold {threshold:.4f} ({report.get('objective', {}).get('type')}) from {THRESHOLD_REPORT_PATH}.")
+        return threshold
+    except Exception as e:
+        print(f"Failed to load threshold report: {e}. Using {DEFAULT_TOXIC_THRESHOLD}.")
+        return DEFAULT_TOXIC_THRESHOLD
+
+
+def ensure_model_loaded():
+    """
+    Try to load vectorizer/model once. If files missing or load fails,
+    vectorizer/model remain None and classify_text will treat messages as clean.
+    """
+    global vectorizer, model, toxic_threshold
+    if vectorizer is not None and model is not None:
+        return
+    with _load_lock:
+        if vectorizer is None or model is None:
+            _load_models()
+
+
+def _load_models():
+    global vectorizer, model, toxic_threshold
+    try:
+        if os.path.exists(VECT_PATH) and os.path.exists(MODEL_PATH):
+            vectorizer = joblib.load(VECT_PATH)
+            model = joblib.load(MODEL_PATH)
+            toxic_threshold = load_decision_threshold()
+            build_score_matrix()
+            print("Models loaded successfully.")
+        else:
+            print(f"Model files not found at {VECT_PATH} or {MODEL_PATH}. Running without ML (all text treated as clean).")
+            vectorizer = None
+            model = None
+    except Exception as e:
+        print(f"Failed to load models: {e}. Running without ML (all text treated as clean).")
+        vectorizer = None
+        model = None
+
+
+def build_score_matrix():
+    """Stack the binary model and the label heads (models/heads.joblib) into one weight matrix."""
+    global label_names, score_weights, score_bias, binary_fused
+    columns, biases = [], []
+    binary_fused = (
+        hasattr(model, "coef_") and model.coef_.shape[0] == 1 and list(getattr(model, "classes_", [])) == [0, 1]
+    )
+    if binary_fused:
+        columns.append(np.asarray(model.coef_, dtype=np.float64).T)
+        biases.append(np.asarray(model.intercept_, dtype=np.float64))
+
+    label_names = []
+    if os.path.exists(HEADS_PATH):
+        try:
+            heads = joblib.load(HEADS_PATH)
+            coef = np.asarray(heads["coef"], dtype=np.float64)
+            if coef.shape[0] != len(vectorizer.vocabulary_):
+                raise ValueError(f"heads expect {coef.shape[0]} features, vectorizer has {len(vectorizer.vocabulary_)}")
+            columns.append(coef)
+            biases.append(np.asarray(heads["intercept"], dtype=np.float64))
+            label_names = list(heads["labels"])
+            print(f"Loaded label heads: {', '.join(label_names)}")
+        except Exception as e:
+            print(f"Failed to load label heads: {e}. Serving the binary score only.")
+
+    if columns:
+        score_weights = np.ascontiguousarray(np.hstack(columns))
+        score_bias = np.concatenate(biases)
+    else:
+        score_weights = score_bias = None
+
+
+def score_text(text: str):
+    """
+    One TF-IDF transform and one sparse x dense product yielding the binary
+    toxicity probability and every label head's probability.
+    Returns (prob, label_scores); label_scores is None without heads.
+    """
+    return score_texts([text])[0]
+
+
+def score_texts(texts):
+    """score_text for a batch: one transform and one product for all of texts."""
+    vect_texts = vectorizer.transform(texts)
+    if score_weights is None:
+        return [(float(p), None) for p in model.predict_proba(vect_texts)[:, 1]]
+    logits = np.asarray(vect_texts @ score_weights) + score_bias
+    probs = 1.0 / (1.0 + np.exp(-logits))
+    if binary_fused:
+        binary, head_probs = probs[:, 0], probs[:, 1:]
+    else:
+        binary, head_probs = model.predict_proba(vect_texts)[:, 1], probs
+    return [
+        (float(prob), {name: round(float(p), 4) for name, p in zip(label_names, heads)} or None)
+        for prob, heads in zip(binary, head_probs)
+    ]
+
+
+def label_scores_for(text: str, score=None, label: str = "toxic"):
+    """
+    Per-label severity for verdicts decided by the keyword or LLM tiers: from
+    score when given, else scored here for toxic verdicts only (the blocked
+    messages and pending posts moderators triage), which costs one TF-IDF
+    transform (~0.85 ms); clean ones get None.
+    """
+    if score is not None:
+        return score[1]
+    if label != "toxic":
+        return None
+    ensure_model_loaded()
+    if vectorizer is None or not label_names:
+        return None
+    try:
+        return score_text(text)[1]
+    except Exception as e:
+        print(f"Error scoring labels: {e}")
+        return None
+
+# OpenRouter endpoint; overridable so load tests can point at a local stub
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "meta-llama/llama-3.1-8b-instruct")
+
+def parse_openrouter_content(content: str):
+    """
+    Extract (label, confidence, reason) from the LLM reply.
+    Returns None if the reply holds no JSON object.
+    """
+    content = content.strip()
+    # Clean up response in case model adds extra text
+    if "{" not in content or "}" not in content:
+        return None
+    json_str = content[content.index("{"):content.rindex("}")+1]
+    result = json.loads(json_str)
+    label = result.get("label", "clean").lower()
+    confidence = float(result.get("confidence", 0.5))
+    reason = result.get("reason", "")
+    if label not in ("toxic", "clean"):
+        label = "clean"
+    return label, confidence, reason
+
+
+def classify_text_with_openrouter(text: str):
+    """
+    Use OpenRouter LLM to classify text as toxic or clean.
+    Returns (label, prob)
+    """
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        return None, None
+
+    start = time.perf_counter()
+    label, confidence = _call_openrouter(api_key, text)
+    CLASSIFY_TIER_LATENCY.observe(time.perf_counter() - start, "openrouter")
+    LLM_REQUESTS.inc("ok" if label is not None else "failed")
+    return label, confidence
+
+
+def _call_openrouter(api_key: str, text: str):
+
+    prompt = f"""You are a content moderation AI. Analyze the following message and determine if it is toxic, bullying, harassment, or harmful.
+
+Message: "{text}"
+
+Respond with ONLY a JSON object in this exact format:
+{{"label": "toxic" or "clean", "confidence": 0.0 to 1.0, "reason": "brief reason"}}
+
+Do not include anything else in your response."""
+
+    try:
+        response = requests.post(
+            OPENROUTER_URL,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "model": OPENROUTER_MODEL,
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                "max_tokens": 100,
+                "temperature": 0.1,
+            },
+            timeout=10,
+        )
+
+        if response.status_code == 200:
+            content = response.json()["choices"][0]["message"]["content"]
+            parsed = parse_openrouter_content(content)
+            if parsed is not None:
+                label, confidence, reason = parsed
+                print(f"OpenRouter classified '{text[:30]}...' as '{label}' (confidence: {confidence}) - {reason}")
+                return label, confidence
+        else:
+            print(f"OpenRouter API error: {response.status_code} - {response.text}")
+            return None, None
+
+    except Exception as e:
+        print(f"OpenRouter API failed: {e}")
+        return None, None
+
+    print("OpenRouter reply had no JSON verdict")
+    return None, None
+
+
+# --- Obfuscation normalizer ---
+# Users dodge the keyword lists with case, accents, homoglyphs ('сhutiya' with
+# a Cyrillic с), zero-width characters, leetspeak ('ch00tiya', '1d10t'),
+# stretched letters ('chuuutiya') and spacing ('m.c', 'c h u t i y a').
+# canonicalize() undoes all of that in one str.translate pass and one
+# compiled-regex pass. The lexicons, Hinglish detection and the classifier
+# service's verdict cache all work on the canonical form; the LLM and the
+# local model still see the text as typed.
+
+# Lookalikes of Latin letters (escaped: in source they are indistinguishable from a-z).
+# Capitals map to the same letter unless listed in HOMOGLYPHS_UPPER.
+HOMOGLYPHS = {
+    # Cyrillic, Armenian, IPA
+    '\u0430': 'a', '\u0432': 'b', '\u0435': 'e', '\u0451': 'e', '\u043a': 'k', '\u043c': 'm', '\u043d': 'h',
+    '\u043e': 'o', '\u0440': 'p', '\u0441': 'c', '\u0442': 't', '\u0443': 'y', '\u0445': 'x', '\u0456': 'i',
+    '\u0457': 'i', '\u0458': 'j', '\u0455': 's', '\u0501': 'd', '\u051b': 'q', '\u051d': 'w', '\u0261': 'g',
+    '\u0578': 'n', '\u057d': 'u',
+    # Greek
+    '\u03b1': 'a', '\u03b2': 'b', '\u03b5': 'e', '\u03b7': 'n', '\u03b9': 'i', '\u03ba': 'k', '\u03bd': 'v',
+    '\u03bf': 'o', '\u03c1': 'p', '\u03c4': 't', '\u03c5': 'u', '\u03c7': 'x', '\u03c9': 'w', '\u03b6': 'z',
+}
+HOMOGLYPHS_UPPER = {'\u0397': 'h', '\u039d': 'n', '\u03a5': 'y', '\u039c': 'm'}  # Greek Eta, Nu, Upsilon, Mu
+ZERO_WIDTH = '\u00ad\u200b\u200c\u200d\u2060\ufeff'  # soft hyphen, ZW space / non-joiner / joiner, word joiner, BOM
+# Digits and symbols read as letters, but only inside or next to a word: "1d10t"
+# is "idiot", "100" and "2024" stay as they are ('!' and '|' need letters on both sides)
+LEET = {'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g', '!': 'i', '|': 'i'}
+# A stretched vowel is folded the way Hinglish spells it: 'oo' -> 'u', 'ee' -> 'i'
+_RUN_FOLD = {'o': 'u', 'e': 'i'}
+
+
+def _build_canon_table():
+    table = {}
+    # Accented Latin, enclosed / fullwidth / mathematical letters and digits -> ASCII
+    for start, end in ((0x00C0, 0x0250), (0x1D00, 0x1D80), (0x24B6, 0x24EA), (0xFF10, 0xFF5B),
+                       (0x1D400, 0x1D800)):
+        for cp in range(start, end):
+            base = unicodedata.normalize("NFKD", chr(cp))[:1]
+            if base.isascii() and base.isalnum():
+                table[cp] = base.lower()
+    for ch in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+        table[ord(ch)] = ch.lower()
+    for ch, latin in HOMOGLYPHS.items():
+        table[ord(ch)] = latin
+        if ch.upper() != ch and len(ch.upper()) == 1:
+            table[ord(ch.upper())] = latin
+    for ch, latin in HOMOGLYPHS_UPPER.items():
+        table[ord(ch)] = latin
+    for ch in ZERO_WIDTH:
+        table[ord(ch)] = None
+    table[ord('@')] = 'a'
+    table[ord('$')] = 's'
+    return table
+
+
+_CANON_TABLE = _build_canon_table()
+_CANON_RE = re.compile(
+    r"([a-z0-9])\1+"                                        # a stretched letter (or digit run)
+    r"|(?<![a-z0-9])([a-z])[\s.\-_*]+(?=[a-z](?![a-z0-9]))"  # a single letter spaced from the next one
+    r"|[013457890!|]"                                       # leetspeak candidates
+)
+
+
+def _touches_letter(m, both):
+    s, start, end = m.string, m.start(), m.end()
+    before = start > 0 and "a" <= s[start - 1] <= "z"
+    after = end < len(s) and "a" <= s[end] <= "z"
+    return (before and after) if both else (before or after)
+
+
+def _canon_match(m):
+    ch = m.group(1)
+    if ch is not None:
+        if ch.isdigit():
+            if ch not in LEET or not _touches_letter(m, False):
+                return m.group()
+            ch = LEET[ch]
+        return _RUN_FOLD.get(ch, ch)
+    ch = m.group(2)
+    if ch is not None:
+        # 'u l l u' squeezes like 'ullu'
+        return "" if m.string[m.end()] == ch else ch
+    ch = m.group()
+    return LEET[ch] if _touches_letter(m, ch in "!|") else ch
+
+
+def canonicalize(text: str):
+    """Lower-cased, de-obfuscated form of text for keyword matching and cache keys."""
+    return _CANON_RE.sub(_canon_match, text.translate(_CANON_TABLE))
+
+
+HINDI_ABUSIVE = [
+    'randi', 'madarchod', 'bhenchod', 'chutiya', 'chutiye', 'mc', 'bc',
+    'bsdk', 'gaandu', 'gandu', 'harami', 'saala', 'saali', 'kamina',
+    'kutte', 'behenchod', 'maderchod', 'lodu', 'lund', 'bakchod',
+    'bhadwa', 'rande', 'rand', 'sala', 'bhosdike', 'bhosdika',
+    'madarchod', 'teri maa', 'teri behen', 'haramzada', 'haramzadi',
+    'chinal', 'chikna', 'chakka', 'hijra', 'kutiya', 'kamine',
+    'ullu', 'gadha', 'suwar', 'suar'
+]
+
+
+# canonical form -> term; several terms share a canonical form ('gaandu' / 'gandu')
+_HINDI_CANONICAL = {canonicalize(word): word for word in HINDI_ABUSIVE}
+# Canonical forms are short ('ullu' -> 'ulu', 'teri maa' -> 'teri ma'), so they
+# are never matched inside a word, and most only as whole words ('ulu' is in
+# 'calculus', 'teri ma' in 'teri marzi', 'chaka' in 'chakkar'). Terms of 5 or
+# more letters that canonicalize leaves as they are also match as word
+# prefixes ('chutiyapa', 'bhenchodd').
+_HINDI_PREFIXES = {word for word in HINDI_ABUSIVE if " " not in word and len(word) >= 5 and canonicalize(word) == word}
+_HINDI_RE = re.compile(r"\b(?:" + "|".join(
+    re.escape(form) + ("" if form in _HINDI_PREFIXES else r"\b")
+    for form in sorted(_HINDI_CANONICAL, key=len, reverse=True)
+) + ")")
+
+
+# Two-letter terms are also English shorthand ('bc' for because, 'b.c. era',
+# 'm.c. escher'): they only count in a Hinglish context (a HINGLISH_MARKERS
+# word) or in a message of at most two words ('mc', 'bc mc')
+_CONTEXT_FORMS = frozenset(form for form in _HINDI_CANONICAL if len(form) <= 2)
+
+
+def find_hindi_abusive(text: str, canonical=None):
+    """Return the first Hindi/Hinglish abusive term found in text, or None. Matches canonical forms."""
+    if canonical is None:
+        canonical = canonicalize(text)
+    context = None
+    for m in _HINDI_RE.finditer(canonical):
+        form = m.group()
+        if form in _CONTEXT_FORMS:
+            if context is None:
+                tokens = _LATIN_TOKEN_RE.findall(canonical)
+                context = len(tokens) <= 2 or any(token in HINGLISH_MARKERS for token in tokens)
+            if not context:
+                continue
+        return _HINDI_CANONICAL[form]
+    return None
+
+
+# The same terms in Devanagari, NFC-normalized (so ड़ matches whether it was typed
+# precomposed or with a nukta). Matched as whole words: 'साला' is part of 'मसाला'.
+DEVANAGARI_ABUSIVE = [unicodedata.normalize("NFC", word) for word in [
+    'रंडी', 'रण्डी', 'मादरचोद', 'मादरचोत', 'भेनचोद', 'बहनचोद', 'बहनचोत', 'भेनचोत', 'चूतिया', 'चुतिया',
+    'चूतिये', 'चुतिये', 'चूतियों', 'गांडू', 'गाण्डू', 'गांड', 'हरामी', 'हरामज़ादा', 'हरामजादा',
+    'हरामज़ादी', 'हरामजादी', 'कमीना', 'कमीने', 'कमीनी', 'कुत्ते', 'कुत्ता', 'कुतिया', 'लौड़ा',
+    'लोडू', 'लौड़े', 'लंड', 'लण्ड', 'बकचोद', 'भड़वा', 'भड़वे', 'भोसड़ीके', 'भोसड़ीका', 'भोसड़ी',
+    'छिनाल', 'छक्का', 'हिजड़ा', 'उल्लू', 'गधा', 'गधे', 'सूअर', 'सुअर', 'साला', 'साली', 'साले',
+    'तेरी माँ', 'तेरी मां', 'तेरी बहन', 'तेरी माँ की', 'तेरी मां की',
+]]
+_DEVANAGARI_WORDS = frozenset(word for word in DEVANAGARI_ABUSIVE if " " not in word)
+_DEVANAGARI_PHRASES = [word for word in DEVANAGARI_ABUSIVE if " " in word]
+# Letters and vowel signs; danda (।, ॥) separates words like punctuation
+_DEVANAGARI_WORD_RE = re.compile(r"[\u0900-\u0963\u0966-\u097F\uA8E0-\uA8FF]+")
+
+
+def find_devanagari_abusive(text: str):
+    """Return the first Devanagari abusive term found in text, or None."""
+    text = unicodedata.normalize("NFC", text)
+    for word in _DEVANAGARI_WORD_RE.findall(text):
+        if word in _DEVANAGARI_WORDS:
+            return word
+    spaced = " ".join(text.split())
+    for phrase in _DEVANAGARI_PHRASES:
+        if phrase in spaced:
+            return phrase
+    return None
+
+
+# --- Script / language routing ---
+# Which tiers can read a message depends on its script: clean_text in
+# train_model.py keeps [a-z0-9] only, so the local model sees nothing of a
+# Devanagari message, and HINDI_ABUSIVE only knows romanized terms.
+#   english    - Latin, no Hinglish markers: local model / LLM, no lexicon
+#   hinglish   - romanized Hindi: lexicon, then local model / LLM
+#   devanagari - Hindi script: Devanagari lexicon, then the LLM
+#   mixed      - both scripts: both lexicons, then local model / LLM
+#   other      - other scripts or no letters: the LLM only
+SCRIPT_ROUTES = ("english", "hinglish", "devanagari", "mixed", "other")
+# Routes whose text the TF-IDF model has features for
+LOCAL_MODEL_SCRIPTS = ("english", "hinglish", "mixed")
+
+# Frequent romanized Hindi words that are not also common English words, in
+# canonical form ('yaar' -> 'yar', 'theek' -> 'thik'). 'tu' and 'aap' are left
+# out: their canonical forms are those of 'too' and 'app'.
+HINGLISH_MARKERS = frozenset(canonicalize(word) for word in [
+    'hai', 'hain', 'nahi', 'nahin', 'nhi', 'kya', 'kyu', 'kyun', 'kyon', 'tum', 'tera', 'teri', 'tere',
+    'mera', 'meri', 'mere', 'apna', 'apni', 'yaar', 'bhai', 'behen', 'karo', 'karna', 'raha', 'rahi',
+    'rahe', 'kuch', 'kuchh', 'acha', 'accha', 'achha', 'theek', 'thik', 'kaise', 'kaisa', 'kab', 'kahan',
+    'kaun', 'mujhe', 'tujhe', 'abhi', 'bahut', 'bohot', 'bohat', 'wala', 'wali', 'haan', 'hoon', 'gaya',
+    'gayi', 'chal', 'chalo', 'dekh', 'dekho', 'bol', 'bolo', 'pagal', 'bakwas', 'aur', 'bhi', 'toh', 'maa',
+    'kal', 'milte', 'kaam', 'sach', 'matlab', 'samjha', 'chup',
+])
+_LATIN_TOKEN_RE = re.compile(r"[a-z]+")
+_LETTERS_RE = re.compile(r"[^\W\d_]+")
+_LATIN_RE = re.compile(r"[A-Za-z\u00C0-\u024F]")
+_DEVANAGARI_RE = re.compile(r"[\u0900-\u0963\u0970-\u097F\uA8E0-\uA8FF]")
+# Word characters that are neither digits, '_', Latin nor Devanagari
+_OTHER_LETTER_RE = re.compile(r"[^\W\d_A-Za-z\u00C0-\u024F\u0900-\u097F\uA8E0-\uA8FF]")
+
+
+def detect_script(text: str, canonical=None):
+    """
+    One of SCRIPT_ROUTES for text; regex scans only, no per-character Python
+    loop for ASCII text. Words are read from the canonical form (canonicalize),
+    so obfuscated terms still count. Lookalike letters count as Latin when
+    their whole word canonicalizes to Latin ('ѕааla' -> 'sala'); a word with
+    any other letter ('Привет' -> 'Пpиbet') counts as other script.
+    """
+    if canonical is None:
+        canonical = canonicalize(text)
+    if text.isascii():
+        latin, devanagari, other = (1 if _LATIN_RE.search(text) else 0), 0, 0
+    else:
+        devanagari = len(_DEVANAGARI_RE.findall(text))
+        latin = other = 0
+        for word in _LETTERS_RE.findall(canonical):
+            if word.isascii():
+                latin += len(word)
+            elif _OTHER_LETTER_RE.search(word):
+                other += len(word)
+            else:
+                latin += len(_LATIN_RE.findall(word))
+    if devanagari:
+        return "mixed" if latin else "devanagari"
+    if not latin or other > latin:
+        return "other"
+    lower = canonical
+    if find_hindi_abusive(text, lower) is not None:
+        return "hinglish"
+    tokens = _LATIN_TOKEN_RE.findall(lower)
+    markers = sum(token in HINGLISH_MARKERS for token in tokens)
+    if markers >= 2 or (markers and len(tokens) <= 4):
+        return "hinglish"
+    return "english"
+
+
+def find_abusive(text: str, script: str, canonical: str):
+    """
+    Step 1: (tier, term) for the first lexicon term in the lists that can
+    read text, or None. The romanized list runs on every route whose
+    canonical text has Latin letters ('ѕааla' inside Cyrillic text) except
+    english, where detect_script already found none.
+    """
+    if script != "english" and _LATIN_TOKEN_RE.search(canonical):
+        word = find_hindi_abusive(text, canonical)
+        if word is not None:
+            return "keyword", word
+    if script in ("devanagari", "mixed"):
+        word = find_devanagari_abusive(canonical)
+        if word is not None:
+            return "keyword-devanagari", word
+    return None
+
+
+def classify_local(text: str, threshold: float, tier: str = "local", score=None):
+    """Local TF-IDF model verdict at the given threshold: (label, prob, label_scores)."""
+    ensure_model_loaded()
+    try:
+        if vectorizer is None or model is None:
+            CLASSIFY_RESULTS.inc("none", "clean")
+            return "clean", 0.0, None
+        if score is not None:
+            prob, label_scores = score
+        else:
+            with CLASSIFY_TIER_LATENCY.time("local"):
+                prob, label_scores = score_text(text)
+        label = "toxic" if prob >= threshold else "clean"
+        CLASSIFY_RESULTS.inc(tier, label)
+        return label, prob, label_scores
+    except Exception as e:
+        print(f"Error in local classify_text: {e}. Treating as clean.")
+        CLASSIFY_RESULTS.inc(tier, "error")
+        return "clean", 0.0, None
+
+
+def classify(text: str, route: str = "normal", score=None, llm: bool = True, script=None):
+    """
+    0. Script / language detection (detect_script), which picks the tiers below
+       that can read the text
+    1. Hindi/Hinglish keyword check (romanized and/or Devanagari), on the
+       canonical form of the text (canonicalize: leetspeak, lookalike letters,
+       stretched and spaced-out letters undone)
+    2. OpenRouter LLM
+    3. Local ML model fallback
+    The sender's trust route (trust.route_for) adjusts 2-3: trusted users go
+    straight to the local model and only reach the LLM to confirm a toxic
+    verdict; repeat offenders are checked by the LLM and also blocked when the
+    local model clears OFFENDER_TOXIC_THRESHOLD. llm=False skips step 2.
+    Text the local model has no features for (Devanagari, other scripts) is
+    escalated to the LLM for every sender, trusted ones included; it is only
+    let through unchecked when the LLM gives no verdict (failed, or shed
+    because every LLM slot was busy), as the local model would have.
+    Returns (label, prob, label_scores); label_scores maps each toxicity label
+    (severe_toxic, threat, ...) to a probability, or is None without label heads.
+    """
+    return classify_settled(text, route, score, llm, script)[0]
+
+
+def _ask_llm(text: str, llm: bool):
+    """Step 2: (label, prob, settled); label is None when the LLM gave no verdict."""
+    if not llm:
+        return None, None, False
+    if not LLM_SLOTS.try_acquire():
+        LLM_SHED.inc()
+        return None, None, False
+    try:
+        label, prob = classify_text_with_openrouter(text)
+    finally:
+        LLM_SLOTS.release()
+    if label is None and os.getenv("OPENROUTER_API_KEY"):
+        LLM_FALLBACKS.inc()
+        return None, None, False
+    return label, prob, True
+
+
+def classify_settled(text: str, route: str = "normal", score=None, llm: bool = True, script=None,
+                     canonical=None):
+    """
+    classify() plus whether the verdict is settled: False when the LLM was
+    wanted but failed, was shed or skipped, so the local verdict stood in for
+    it. Only settled verdicts are worth caching. script and canonical are
+    detect_script(text) and canonicalize(text) when the caller already has them.
+    """
+    if canonical is None:
+        with CLASSIFY_TIER_LATENCY.time("canonicalize"):
+            canonical = canonicalize(text)
+    if script is None:
+        with CLASSIFY_TIER_LATENCY.time("script"):
+            script = detect_script(text, canonical)
+    CLASSIFY_SCRIPTS.inc(script)
+    scored = script in LOCAL_MODEL_SCRIPTS
+
+    # Step 1 - Hindi/Hinglish abusive word check, in the script(s) the text uses
+    with CLASSIFY_TIER_LATENCY.time("keyword"):
+        found = find_abusive(text, script, canonical)
+    if found is not None:
+        tier, word = found
+        print(f"{'Devanagari' if tier == 'keyword-devanagari' else 'Hindi'} abusive word detected: {word}")
+        CLASSIFY_RESULTS.inc(tier, "toxic")
+        return ("toxic", 0.95, label_scores_for(text, score) if scored else None), True
+
+    if not scored:
+        # Only the LLM can read this text, whatever the sender's trust route:
+        # trust earned on English text says nothing about other scripts
+        label, prob, settled = _ask_llm(text, llm)
+        if label is not None:
+            CLASSIFY_RESULTS.inc("openrouter", label)
+            return (label, prob, None), True
+        CLASSIFY_RESULTS.inc("unscored", "clean")
+        return ("clean", 0.0, None), settled
+
+    local_verdict = None
+    if route == "trusted":
+        local_verdict = classify_local(text, toxic_threshold, "local-trusted", score)
+        if local_verdict[0] != "toxic":
+            return local_verdict, True
+
+    # Step 2 - OpenRouter LLM, unless every LLM slot is busy: then shed to the local model
+    label, prob, settled = _ask_llm(text, llm)
+    if label is not None:
+        CLASSIFY_RESULTS.inc("openrouter", label)
+        if route == "offender" and label == "clean":
+            strict = classify_local(text, OFFENDER_TOXIC_THRESHOLD, "local-strict", score)
+            if strict[0] == "toxic":
+                return strict, True
+            return (label, prob, strict[2]), True
+        return (label, prob, local_verdict[2] if local_verdict else label_scores_for(text, score, label)), True
+    if local_verdict is not None:
+        return local_verdict, settled
+
+    # Step 3 - Local ML model fallback
+    print("Falling back to local ML model...")
+    if route == "offender":
+        return classify_local(text, OFFENDER_TOXIC_THRESHOLD, "local-strict", score), settled
+    return classify_local(text, toxic_threshold, score=score), settled
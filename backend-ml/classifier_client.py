@@ -0,0 +1,157 @@
+# classifier_client.py
+"""
+Thin client for the classifier service (classifier_service.py).
+
+With CLASSIFIER_SOCKET set, classify() sends the text and the sender's trust
+route to the service over that Unix socket (one newline-delimited JSON request
+per line, on a persistent connection per thread) and returns its verdict.
+Without it, or whenever the service cannot answer, the pipeline runs in this
+process (classifier.classify), loading the models on first use:
+
+- the service is unreachable or returns an error: the full pipeline runs here,
+  and the service is left alone for CLASSIFIER_RETRY_SECONDS before the next
+  attempt, so a dead service costs one failed connect, not one per message;
+- the service took longer than CLASSIFIER_TIMEOUT: it is alive but busy (or
+  stuck on the LLM), so only the keyword and local model tiers run here rather
+  than waiting on a second LLM call;
+- the service answered this one request with an error (e.g. the text made
+  scoring fail), or the text is longer than CLASSIFIER_MAX_TEXT_CHARS and would
+  not fit in a request line: that text alone is classified here, and the
+  service stays in use for the next one.
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+import classifier
+from telemetry import CLASSIFIER_CLIENT
+
+
+CLASSIFIER_SOCKET = os.getenv("CLASSIFIER_SOCKET", "")
+# Covers one OpenRouter call (10s timeout) plus batching and queueing
+CLASSIFIER_TIMEOUT = float(os.getenv("CLASSIFIER_TIMEOUT", "12"))
+CLASSIFIER_CONNECT_TIMEOUT = float(os.getenv("CLASSIFIER_CONNECT_TIMEOUT", "0.5"))
+CLASSIFIER_RETRY_SECONDS = float(os.getenv("CLASSIFIER_RETRY_SECONDS", "5"))
+# JSON escapes a character as at most 12 bytes, so this stays well under the
+# service's MAX_REQUEST_BYTES (1 MiB) per request line
+CLASSIFIER_MAX_TEXT_CHARS = int(os.getenv("CLASSIFIER_MAX_TEXT_CHARS", "20000"))
+
+
+class ClassifierUnavailable(Exception):
+    """The service could not be reached or its reply could not be read."""
+
+
+class ClassifierRejected(Exception):
+    """The service is up but answered this request with an error."""
+
+
+_local = threading.local()
+_retry_at = 0.0  # time.monotonic() before which the service is not tried
+
+
+def _close():
+    conn = getattr(_local, "conn", None)
+    _local.conn = _local.reader = None
+    if conn is not None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _connection():
+    if getattr(_local, "conn", None) is None:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(CLASSIFIER_CONNECT_TIMEOUT)
+        try:
+            conn.connect(CLASSIFIER_SOCKET)
+        except OSError:
+            conn.close()
+            raise
+        _local.conn = conn
+        _local.reader = conn.makefile("rb")
+    return _local.conn, _local.reader
+
+
+def call(request, timeout=None):
+    """
+    Send one request dict to the service and return its reply dict. Raises
+    socket.timeout when no reply came within timeout (CLASSIFIER_TIMEOUT by
+    default), ClassifierRejected for an error reply, ClassifierUnavailable for
+    anything else.
+    """
+    if not CLASSIFIER_SOCKET:
+        raise ClassifierUnavailable("CLASSIFIER_SOCKET is not set")
+    payload = json.dumps(request).encode() + b"\n"
+    for attempt in (1, 2):
+        try:
+            conn, reader = _connection()
+        except OSError as e:
+            raise ClassifierUnavailable(f"connect to {CLASSIFIER_SOCKET} failed: {e}")
+        try:
+            conn.settimeout(timeout or CLASSIFIER_TIMEOUT)
+            conn.sendall(payload)
+            line = reader.readline()
+        except socket.timeout:
+            _close()  # the late reply would be read as the answer to the next request
+            raise
+        except OSError as e:
+            _close()
+            if attempt == 1:
+                continue  # the service restarted since this connection was opened
+            raise ClassifierUnavailable(f"request failed: {e}")
+        if line:
+            break
+        _close()
+        if attempt == 2:
+            raise ClassifierUnavailable("connection closed by the service")
+    try:
+        reply = json.loads(line)
+    except ValueError:
+        _close()
+        raise ClassifierUnavailable("malformed reply")
+    if "error" in reply:
+        raise ClassifierRejected(reply["error"])
+    return reply
+
+
+def classify(text, route="normal"):
+    """(label, prob, label_scores) from the service, or from this process as described above."""
+    global _retry_at
+    if not CLASSIFIER_SOCKET:
+        return classifier.classify(text, route)
+    if time.monotonic() < _retry_at:
+        CLASSIFIER_CLIENT.inc("skipped")
+        return classifier.classify(text, route)
+    if len(text) > CLASSIFIER_MAX_TEXT_CHARS:
+        CLASSIFIER_CLIENT.inc("too_long")
+        return classifier.classify(text, route)
+    try:
+        reply = call({"op": "classify", "text": text, "route": route})
+    except socket.timeout:
+        print(f"Classifier service timed out after {CLASSIFIER_TIMEOUT}s; classifying locally without the LLM")
+        CLASSIFIER_CLIENT.inc("timeout")
+        return classifier.classify(text, route, llm=False)
+    except ClassifierRejected as e:
+        print(f"Classifier service could not classify this text ({e}); classifying it in process")
+        CLASSIFIER_CLIENT.inc("rejected")
+        return classifier.classify(text, route)
+    except ClassifierUnavailable as e:
+        print(f"Classifier service unavailable ({e}); classifying in process")
+        CLASSIFIER_CLIENT.inc("unavailable")
+        _retry_at = time.monotonic() + CLASSIFIER_RETRY_SECONDS
+        return classifier.classify(text, route)
+    CLASSIFIER_CLIENT.inc("cached" if reply.get("cached") else "service")
+    return reply["label"], reply["prob"], reply.get("label_scores")
+
+
+def status():
+    """The service's stats, or why they are unavailable, for /health/classifier."""
+    if not CLASSIFIER_SOCKET:
+        return {"mode": "in_process"}
+    try:
+        return {"mode": "service", "socket": CLASSIFIER_SOCKET, **call({"op": "stats"}, timeout=2.0)}
+    except (socket.timeout, ClassifierRejected, ClassifierUnavailable) as e:
+        return {"mode": "service", "socket": CLASSIFIER_SOCKET, "status": "unavailable", "error": str(e) or "timeout"}
@@ -0,0 +1,354 @@
+# classifier_service.py
+"""
+Classifier service: one process that owns the moderation models for every web
+worker on the host.
+
+    python classifier_service.py [--socket /tmp/safechat-classifier.sock]
+
+Web workers reach it through classifier_client.py over a Unix domain socket,
+so the vectorizer, model and label heads are loaded once per host instead of
+once per uvicorn worker, and LLM_MAX_CONCURRENCY caps OpenRouter calls across
+all workers together. The protocol is one JSON object per line each way:
+
+    {"op": "classify", "text": "...", "route": "normal"}
+        -> {"label": "clean", "prob": 0.03, "label_scores": {...}, "cached": false}
+    {"op": "health"} -> {"status": "ok", "model_loaded": true, ...}
+    {"op": "stats"}  -> health plus cache, batch and verdict counts
+
+- Batching: texts from all connections are scored together. The batcher waits
+  up to CLASSIFIER_MAX_WAIT_MS after the first text for more, or until
+  CLASSIFIER_MAX_BATCH texts are queued, then runs one TF-IDF transform and one
+  product for all of them (classifier.score_texts). Texts in a script the
+  model has no features for (classifier.detect_script) are not queued. Each
+  request then finishes its own path through the tiers (keyword check, LLM)
+  on its connection thread.
+- Verdict cache: settled verdicts are kept per (route, canonical text) for
+  CLASSIFIER_CACHE_SECONDS, at most CLASSIFIER_CACHE_ENTRIES (LRU), so repeated
+  texts ("hi", "ok", forwarded spam) skip the model and the LLM. The key is
+  classifier.canonicalize(text), so "HIII", "hiii" and "h i" share one entry,
+  as do the variants of a spam text run through leetspeak or lookalike
+  letters. Verdicts where the local model stood in for a failed or shed LLM
+  call are not cached.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import classifier
+from ratelimit import LLM_MAX_CONCURRENCY
+from telemetry import (
+    CLASSIFIER_BATCH, CLASSIFIER_CACHE, CLASSIFY_RESULTS, CLASSIFY_SCRIPTS, LLM_FALLBACKS, LLM_REQUESTS, LLM_SHED,
+)
+
+
+DEFAULT_SOCKET = "/tmp/safechat-classifier.sock"
+CLASSIFIER_MAX_BATCH = int(os.getenv("CLASSIFIER_MAX_BATCH", "32"))
+CLASSIFIER_MAX_WAIT_MS = float(os.getenv("CLASSIFIER_MAX_WAIT_MS", "2"))
+CLASSIFIER_CACHE_ENTRIES = int(os.getenv("CLASSIFIER_CACHE_ENTRIES", "50000"))
+CLASSIFIER_CACHE_SECONDS = float(os.getenv("CLASSIFIER_CACHE_SECONDS", "600"))
+# Longest request line accepted; longer ones are answered with an error
+MAX_REQUEST_BYTES = 1 << 20
+SCORE_TIMEOUT = 5.0
+ROUTES = ("trusted", "normal", "offender")
+
+
+# --- Verdict cache ---
+class VerdictCache:
+    def __init__(self, max_entries=CLASSIFIER_CACHE_ENTRIES, ttl=CLASSIFIER_CACHE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (route, canonical text) -> (time.monotonic() expiry, verdict)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                CLASSIFIER_CACHE.inc("miss")
+                return None
+            self._entries.move_to_end(key)
+        CLASSIFIER_CACHE.inc("hit")
+        return entry[1]
+
+    def put(self, key, verdict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# --- Batched scoring ---
+class _Request:
+    __slots__ = ("text", "future")
+
+    def __init__(self, text):
+        self.text = text
+        self.future = Future()
+
+
+class ScoreBatcher:
+    """Same shape as chat_writer.ChatWriter: callers queue texts, one thread scores them in batches."""
+
+    def __init__(self, max_batch=CLASSIFIER_MAX_BATCH, max_wait_ms=CLASSIFIER_MAX_WAIT_MS):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.batches = 0
+        self.texts = 0
+
+    def score(self, text, timeout=SCORE_TIMEOUT):
+        """
+        (prob, label_scores) for text, or None when the model is not loaded or
+        scoring failed; classifier.classify then scores (or skips) on its own.
+        """
+        if classifier.vectorizer is None or classifier.model is None:
+            return None
+        request = _Request(text)
+        with self._cond:
+            if self._stopping:
+                return None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="classifier-batcher", daemon=True)
+                self._thread.start()
+            self._queue.append(request)
+            self._cond.notify()
+        return request.future.result(timeout)
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=SCORE_TIMEOUT)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._stopping:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch and not self._stopping:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            CLASSIFIER_BATCH.observe(len(batch))
+            self.batches += 1
+            self.texts += len(batch)
+            try:
+                scores = classifier.score_texts([request.text for request in batch])
+            except Exception as e:
+                print(f"Classifier service: scoring a batch of {len(batch)} failed: {e}")
+                scores = [None] * len(batch)
+            for request, score in zip(batch, scores):
+                request.future.set_result(score)
+
+
+# --- Service ---
+class ClassifierService:
+    def __init__(self):
+        self.cache = VerdictCache()
+        self.batcher = ScoreBatcher()
+        self.started_at = time.time()
+        self.requests = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def handle(self, request):
+        op = request.get("op")
+        if op == "classify":
+            return self.classify(request)
+        if op == "health":
+            return self.health()
+        if op == "stats":
+            return self.stats()
+        return {"error": f"unknown op {op!r}"}
+
+    def classify(self, request):
+        text, route = request.get("text"), request.get("route", "normal")
+        if not isinstance(text, str):
+            return {"error": "text must be a string"}
+        if route not in ROUTES:
+            return {"error": f"unknown route {route!r}"}
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+        try:
+            canonical = classifier.canonicalize(text)
+            key = (route, canonical)
+            verdict = self.cache.get(key)
+            if verdict is not None:
+                return {"label": verdict[0], "prob": verdict[1], "label_scores": verdict[2], "cached": True}
+            script = classifier.detect_script(text, canonical)
+            score = None
+            if script in classifier.LOCAL_MODEL_SCRIPTS:
+                try:
+                    score = self.batcher.score(text)
+                except Exception as e:
+                    print(f"Classifier service: no batch score ({e}); scoring alone")
+            verdict, settled = classifier.classify_settled(text, route, score, script=script, canonical=canonical)
+            if settled:
+                self.cache.put(key, verdict)
+            return {"label": verdict[0], "prob": verdict[1], "label_scores": verdict[2], "cached": False}
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def health(self):
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "model_loaded": classifier.vectorizer is not None and classifier.model is not None,
+            "labels": classifier.label_names,
+            "threshold": classifier.toxic_threshold,
+        }
+
+    def stats(self):
+        batches = self.batcher.batches
+        return {
+            **self.health(),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "cache": {
+                "entries": len(self.cache),
+                "max_entries": self.cache.max_entries,
+                **{result: int(n) for (result,), n in CLASSIFIER_CACHE.totals().items()},
+            },
+            "batches": batches,
+            "avg_batch": round(self.batcher.texts / batches, 2) if batches else 0.0,
+            "llm_max_concurrency": LLM_MAX_CONCURRENCY,
+            "llm_requests": {outcome: int(n) for (outcome,), n in LLM_REQUESTS.totals().items()},
+            "llm_fallbacks": int(sum(LLM_FALLBACKS.totals().values())),
+            "llm_shed": int(sum(LLM_SHED.totals().values())),
+            "scripts": {script: int(n) for (script,), n in CLASSIFY_SCRIPTS.totals().items()},
+            "verdicts": {f"{tier}/{label}": int(n) for (tier, label), n in sorted(CLASSIFY_RESULTS.totals().items())},
+        }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST_BYTES:
+                self._reply({"error": "request too large"})
+                return  # the rest of the line is still unread: drop the connection
+            try:
+                request = json.loads(line)
+                reply = self.server.service.handle(request) if isinstance(request, dict) else {"error": "bad request"}
+            except ValueError:
+                reply = {"error": "bad request"}
+            except Exception as e:  # never leave the client waiting for a reply
+                print(f"Classifier service: request failed: {e}")
+                reply = {"error": str(e)}
+            if not self._reply(reply):
+                return
+
+    def _reply(self, reply):
+        try:
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # every worker thread opens its own connection; a short backlog refuses some of a burst
+    request_queue_size = 256
+
+    def __init__(self, path, service):
+        self.service = service
+        super().__init__(path, _Handler)
+
+
+def _claim_socket(path):
+    """Remove a stale socket file left by a crashed service; refuse if one is still serving."""
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise RuntimeError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"another classifier service is listening on {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve SafeChat classification to local web workers over a Unix socket.")
+    parser.add_argument("--socket", default=os.getenv("CLASSIFIER_SOCKET") or DEFAULT_SOCKET,
+                        help="path of the Unix socket to listen on")
+    args = parser.parse_args(argv)
+
+    try:
+        _claim_socket(args.socket)
+    except (OSError, RuntimeError) as e:
+        print(f"Classifier service: {e}")
+        return 1
+    classifier.ensure_model_loaded()
+    service = ClassifierService()
+    server = _Server(args.socket, service)
+    os.chmod(args.socket, 0o660)  # web workers share the service's group, nobody else
+
+    def _stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    print(f"Classifier service listening on {args.socket} (batch {CLASSIFIER_MAX_BATCH}, "
+          f"wait {CLASSIFIER_MAX_WAIT_MS}ms, cache {CLASSIFIER_CACHE_ENTRIES})")
+    try:
+        server.serve_forever()
+    finally:
+        service.batcher.stop()
+        server.server_close()
+        try:
+            os.unlink(args.socket)
+        except OSError:
+            pass
+    print("Classifier service stopped.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
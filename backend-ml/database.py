@@ -1,54 +1,691 @@
+import json
 import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
 
 import psycopg2
 from psycopg2 import Error as PostgresError
+from psycopg2.errors import InvalidSqlStatementName
+from psycopg2.extensions import (
+    TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN, connection as PlainConnection, cursor as PlainCursor,
+)
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+from telemetry import (
+    DB_ACQUIRE_ERRORS, DB_ACQUIRE_LATENCY, DB_FLAGGED_REQUESTS, DB_POOL_EVENTS, DB_PREPARES, DB_QUERY_LATENCY,
+    DB_READ_ROUTES, REPLICA_LAG, REPLICA_UP,
+)
+
 
 load_dotenv()
 
+# --- Query profiling (off unless DB_PROFILE=1) ---
+DB_PROFILE = os.getenv("DB_PROFILE", "0") == "1"
+DB_PROFILE_MAX_QUERIES = int(os.getenv("DB_PROFILE_MAX_QUERIES", "8"))
+DB_PROFILE_MAX_MS = float(os.getenv("DB_PROFILE_MAX_MS", "100"))
+DB_PROFILE_SLOW_MS = float(os.getenv("DB_PROFILE_SLOW_MS", "50"))
+DB_PROFILE_NPLUS1 = int(os.getenv("DB_PROFILE_NPLUS1", "3"))
+DB_PROFILE_LOG = os.getenv("DB_PROFILE_LOG", os.path.join("logs", "db_profile.log"))
+
+_request_profile = ContextVar("request_profile", default=None)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"\(\s*%s(?:\s*,\s*%s)+\s*\)")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def _statement_kind(query):
+    """SELECT / INSERT / UPDATE / ... — a bounded label for the query histogram."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    if not isinstance(query, str):
+        return "OTHER"
+    head = query.lstrip().split(None, 1)
+    return head[0].upper() if head else "OTHER"
+
+
+def normalize_sql(query):
+    """Collapse whitespace, literals and IN-lists so repeated statements group together."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)
+    query = _STRING_RE.sub("?", query)
+    query = _NUMBER_RE.sub("?", query)
+    query = _IN_LIST_RE.sub("(...)", query)
+    return _WHITESPACE_RE.sub(" ", query).strip()
+
+
+class RequestProfile:
+    """Statements issued while serving one request."""
+
+    def __init__(self):
+        self.route = None
+        self.queries = []
+        self.plans = []
+
+    @property
+    def total_ms(self):
+        return sum(q["ms"] for q in self.queries)
+
+    def record(self, query, elapsed_ms, rowcount):
+        self.queries.append({"sql": normalize_sql(query), "ms": round(elapsed_ms, 3), "rows": rowcount})
+
+    def repeated_statements(self):
+        counts = Counter(q["sql"] for q in self.queries)
+        return {sql: n for sql, n in counts.items() if n >= DB_PROFILE_NPLUS1}
+
+    def flags(self):
+        flags = []
+        if len(self.queries) > DB_PROFILE_MAX_QUERIES:
+            flags.append("query-budget")
+        if self.total_ms > DB_PROFILE_MAX_MS:
+            flags.append("time-budget")
+        if self.repeated_statements():
+            flags.append("n+1")
+        if self.plans:
+            flags.append("slow-query")
+        return flags
+
+    def summary_header(self):
+        flags = self.flags()
+        return f"queries={len(self.queries)}; time_ms={self.total_ms:.1f}; flags={','.join(flags) or 'none'}"
+
+    def plans_header(self, limit=2000):
+        text = " || ".join(f"[{p['ms']:.1f} ms] {p['sql']} :: {' | '.join(p['plan'])}" for p in self.plans)
+        return text[:limit]
+
+    def to_log_record(self):
+        statements = {}
+        for q in self.queries:
+            entry = statements.setdefault(q["sql"], {"count": 0, "ms": 0.0, "rows": 0})
+            entry["count"] += 1
+            entry["ms"] = round(entry["ms"] + q["ms"], 3)
+            entry["rows"] += max(q["rows"] or 0, 0)
+        return {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "route": self.route,
+            "queries": len(self.queries),
+            "total_ms": round(self.total_ms, 3),
+            "flags": self.flags(),
+            "statements": statements,
+            "plans": self.plans,
+        }
+
+
+def start_request_profile():
+    return _request_profile.set(RequestProfile())
+
+
+def finish_request_profile(token, route):
+    """Close the current request's profile, log it if it broke a budget and return it."""
+    profile = _request_profile.get()
+    _request_profile.reset(token)
+    if profile is None:
+        return None
+    profile.route = route
+    flags = profile.flags()
+    if flags:
+        for flag in flags:
+            DB_FLAGGED_REQUESTS.inc(route, flag)
+        print(f"[db-profile] {route}: {profile.summary_header()}")
+        try:
+            os.makedirs(os.path.dirname(DB_PROFILE_LOG) or ".", exist_ok=True)
+            with open(DB_PROFILE_LOG, "a") as f:
+                f.write(json.dumps(profile.to_log_record(), default=str) + "\n")
+        except OSError as e:
+            print(f"[db-profile] could not write {DB_PROFILE_LOG}: {e}")
+    return profile
+
+
+def _explain(connection, query, vars):
+    """
+    Plan of a slow statement. Read-only statements get EXPLAIN ANALYZE (they are
+    executed again); writes only get the estimated plan. Runs inside a savepoint
+    so a failing EXPLAIN cannot abort the request's transaction.
+    """
+    text = _statement_text(query)
+    read_only = _statement_kind(query) in ("SELECT", "WITH") and not _WRITE_RE.search(text)
+    options = "ANALYZE, BUFFERS" if read_only else "COSTS"
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT db_profile_explain")
+        try:
+            cursor.execute(f"EXPLAIN ({options}) {text}", vars)
+            plan = [row[0] for row in cursor.fetchall()]
+            cursor.execute("RELEASE SAVEPOINT db_profile_explain")
+            return plan
+        except PostgresError as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT db_profile_explain")
+            return [f"EXPLAIN failed: {e}".strip()]
+    except PostgresError as e:
+        # e.g. autocommit connections, where savepoints are not allowed
+        return [f"EXPLAIN skipped: {e}".strip()]
+    finally:
+        cursor.close()
+
+
+def _statement_text(query):
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    return query if isinstance(query, str) else str(query)
+
+
+class _TimedExecuteMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = super().execute(query, vars)
+            ok = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_QUERY_LATENCY.observe(elapsed, _statement_kind(query))
+            profile = _request_profile.get()
+            if profile is not None:
+                profile.record(query, elapsed * 1000.0, self.rowcount)
+                # a failed statement has aborted the transaction; nothing to explain
+                if ok and elapsed * 1000.0 >= DB_PROFILE_SLOW_MS:
+                    profile.plans.append({
+                        "sql": normalize_sql(query),
+                        "ms": round(elapsed * 1000.0, 3),
+                        "plan": _explain(self.connection, query, vars),
+                    })
+
+    def execute_prepared(self, name, vars=None):
+        """
+        Run the registered statement `name` (see register_statement) with vars
+        shaped as for execute(). It is PREPAREd the first time this connection
+        runs it and EXECUTEd by name from then on.
+        """
+        statement = _statements[name]
+        prepared = getattr(self.connection, "prepared", None)
+        if not DB_PREPARED_STATEMENTS or prepared is None:
+            return self.execute(statement.sql, vars)
+        args = statement.args(vars)
+        fresh = self.connection.info.transaction_status == TRANSACTION_STATUS_IDLE
+        try:
+            if name not in prepared:
+                self._prepare(statement, prepared)
+            return self.execute(statement.execute_sql, args)
+        except InvalidSqlStatementName:
+            # the session lost its statements (DISCARD ALL, a pooler switching backends);
+            # replay only when nothing else ran in the transaction that just aborted
+            prepared.clear()
+            if not fresh:
+                raise
+            self.connection.rollback()
+            self._prepare(statement, prepared)
+            return self.execute(statement.execute_sql, args)
+
+    def _prepare(self, statement, prepared):
+        self.execute(statement.prepare_sql)
+        prepared.add(statement.name)
+        DB_PREPARES.inc(statement.name)
+
+
+class TimedCursor(_TimedExecuteMixin, PlainCursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedExecuteMixin, RealDictCursor):
+    pass
+
+
+# --- Prepared statements ---
+# Hot statements are registered once at import (register_statement) and run with
+# cursor.execute_prepared(name, vars). Each connection PREPAREs a statement the
+# first time it runs it, so Postgres parses and plans it once per connection
+# (switching to a cached generic plan when that is no worse) instead of on every
+# call. Pooled connections keep their statements across requests; a new
+# connection (after a reconnect, a recycle, a replica switch) starts with none and
+# prepares again on first use. DB_PREPARED_STATEMENTS=0 runs the same SQL ad hoc,
+# e.g. behind a transaction-mode pooler that does not keep sessions.
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1") == "1"
+
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+_STATEMENT_NAME_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+class PreparedStatement:
+    """psycopg2-style SQL (%(name)s or %s placeholders) rewritten for PREPARE / EXECUTE."""
+
+    def __init__(self, name, sql):
+        if not _STATEMENT_NAME_RE.match(name):
+            raise ValueError(f"Invalid prepared statement name: {name!r}")
+        self.name = name
+        self.sql = sql
+        self.params = []  # placeholder names (or positions) in $n order
+        self.positional = False
+
+        def placeholder(match):
+            if match.group(0) == "%%":
+                return "%"
+            if match.group(1) is None:
+                self.positional = True
+                self.params.append(len(self.params))
+            elif match.group(1) not in self.params:
+                self.params.append(match.group(1))
+            key = len(self.params) - 1 if match.group(1) is None else self.params.index(match.group(1))
+            return f"${key + 1}"
+
+        body = _PARAM_RE.sub(placeholder, sql)
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+        self.execute_sql = f"EXECUTE {name}"
+        if self.params:
+            self.execute_sql += "(" + ", ".join(["%s"] * len(self.params)) + ")"
+
+    def args(self, vars):
+        if not self.params:
+            return None
+        if self.positional:
+            return list(vars)
+        return [vars[key] for key in self.params]
+
+
+_statements = {}
+
+
+def register_statement(name, sql):
+    """Register sql under name for cursor.execute_prepared; returns name."""
+    existing = _statements.get(name)
+    if existing is not None and existing.sql != sql:
+        raise ValueError(f"Prepared statement {name!r} is already registered with different SQL")
+    _statements[name] = PreparedStatement(name, sql)
+    return name
+
+
+class _Connection(PlainConnection):
+    """psycopg2 connection that remembers what is prepared on it and its age."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.opened_at = time.monotonic()
+        self.idle_since = None
+
 
 class DBConnectionWrapper:
-    def __init__(self, connection):
+    def __init__(self, connection, pin_username=None, target="primary", pool=None):
         self._connection = connection
+        self._pin_username = pin_username
+        self._pool = pool
+        self.target = target
 
     def cursor(self, dictionary=False):
         if dictionary:
-            return self._connection.cursor(cursor_factory=RealDictCursor)
-        return self._connection.cursor()
+            return self._connection.cursor(cursor_factory=TimedRealDictCursor)
+        return self._connection.cursor(cursor_factory=TimedCursor)
 
     def commit(self):
-        return self._connection.commit()
+        result = self._connection.commit()
+        if self._pin_username:
+            pin_to_primary(self._pin_username)
+        return result
 
     def rollback(self):
         return self._connection.rollback()
 
+    def set_autocommit(self, value):
+        self._connection.autocommit = value
+
+    def discard(self):
+        """Close instead of pooling, for a session left in an unknown state (e.g. an aborted COPY)."""
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
     def close(self):
-        return self._connection.close()
+        if self._pool is None:
+            return self._connection.close()
+        # back to the pool; later use of this wrapper fails instead of sharing the session
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            self._pool.release(connection)
+
+
+def _connect(database_url=None, **kwargs):
+    kwargs.setdefault("connection_factory", _Connection)
+    if database_url:
+        return psycopg2.connect(database_url, sslmode=os.getenv("DB_SSLMODE", "require"), **kwargs)
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "5432")),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", "postgres"),
+        dbname=os.getenv("DB_NAME", "safechat_db"),
+        sslmode=os.getenv("DB_SSLMODE", "prefer"),
+        **kwargs,
+    )
+
+
+# --- Connection pool ---
+# Up to DB_POOL_SIZE idle connections per server are kept for reuse (newest
+# first), so requests skip the connect/TLS handshake and find their prepared
+# statements already in place. It is not a cap: when none is idle a new one is
+# opened, as before, and connections returned to a full pool are closed.
+# Returned connections are rolled back and put back in transaction mode; one
+# idle for DB_POOL_PING_SECONDS is pinged before reuse, one older than
+# DB_POOL_RECYCLE_SECONDS is closed, and a connection that comes back broken
+# empties the pool. DB_POOL_SIZE=0 closes every connection.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_PING_SECONDS = float(os.getenv("DB_POOL_PING_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = float(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+
+class ConnectionPool:
+    def __init__(self, name, dsn=None, size=DB_POOL_SIZE, readonly=False, **connect_kwargs):
+        self.name = name
+        self.dsn = dsn
+        self.size = size
+        self.readonly = readonly
+        self.connect_kwargs = connect_kwargs
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                break
+            if self._usable(connection):
+                DB_POOL_EVENTS.inc(self.name, "reused")
+                return connection
+            self._discard(connection)
+        connection = _connect(self.dsn, **self.connect_kwargs)
+        if self.readonly:
+            connection.set_session(readonly=True)
+        DB_POOL_EVENTS.inc(self.name, "opened")
+        return connection
+
+    def release(self, connection):
+        now = time.monotonic()
+        if connection.closed:
+            # lost mid-request (server restart, failover): the idle ones most likely went too
+            self._discard(connection)
+            self.clear()
+            return
+        if now - connection.opened_at > DB_POOL_RECYCLE_SECONDS:
+            self._discard(connection)
+            return
+        try:
+            status = connection.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                self._discard(connection)
+                return
+            if status != TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            if connection.autocommit:
+                connection.autocommit = False
+        except PostgresError:
+            self._discard(connection)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                connection.idle_since = now
+                self._idle.append(connection)
+                DB_POOL_EVENTS.inc(self.name, "returned")
+                return
+        self._discard(connection)
+
+    def clear(self):
+        """Close every idle connection (shutdown, or a server that stopped answering)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+    def _usable(self, connection):
+        if connection.closed or time.monotonic() - connection.opened_at > DB_POOL_RECYCLE_SECONDS:
+            return False
+        if time.monotonic() - connection.idle_since < DB_POOL_PING_SECONDS:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except PostgresError:
+            return False
+
+    def _discard(self, connection):
+        DB_POOL_EVENTS.inc(self.name, "discarded")
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_primary_pool = ConnectionPool("primary", os.getenv("DATABASE_URL"))
+
+
+# --- Read/write routing ---
+# Read-only endpoints ask for get_db_connection(read_only=True, username=...) and
+# get a replica from DATABASE_REPLICA_URLS when one is healthy; everything else
+# goes to the primary. A primary connection opened for a user pins that user to
+# the primary for READ_YOUR_WRITES_SECONDS after each commit, so they read their
+# own writes. Pins are per process: another worker may still serve that user from
+# a replica, which is why replicas lagging more than REPLICA_MAX_LAG_SECONDS
+# (kept below the pin window) are taken out of rotation by the probe thread.
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_PROBE_SECONDS = float(os.getenv("REPLICA_PROBE_SECONDS", "2"))
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+
+# Lag is 0 when everything received has been replayed (an idle primary sends no
+# new transactions, so "now - last replay" alone would keep growing); a server
+# that is not a standby reports 0 too.
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class Replica:
+    def __init__(self, name, dsn):
+        self.name = name
+        self.dsn = dsn
+        self.lag = None
+        self.healthy = False
+        self.checked_at = None
+        self.error = None
+        self.pool = ConnectionPool(name, dsn, readonly=True, connect_timeout=3)
+        self._probe_conn = None
+
+    def probe(self):
+        try:
+            if self._probe_conn is None or self._probe_conn.closed:
+                self._probe_conn = _connect(self.dsn, connect_timeout=3)
+                self._probe_conn.autocommit = True
+            with self._probe_conn.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                self.lag = float(cursor.fetchone()[0])
+            self.error = None
+            self.healthy = self.lag <= REPLICA_MAX_LAG_SECONDS
+        except PostgresError as e:
+            self.error = str(e).strip()
+            self.healthy = False
+            self.pool.clear()
+            if self._probe_conn is not None:
+                try:
+                    self._probe_conn.close()
+                except Exception:
+                    pass
+            self._probe_conn = None
+        self.checked_at = time.time()
+        REPLICA_UP.set(1 if self.healthy else 0, self.name)
+        if self.lag is not None:
+            REPLICA_LAG.set(self.lag, self.name)
+
+    def status(self):
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "checked_at": self.checked_at,
+            "error": self.error,
+        }
+
+
+_replicas = [Replica(f"replica{i}", dsn) for i, dsn in enumerate(DATABASE_REPLICA_URLS)]
+_pins = {}  # username -> time.monotonic() until which reads go to the primary
+_pins_lock = threading.Lock()
+_probe_thread = None
+_probe_stop = threading.Event()
+
 
+def pin_to_primary(username, seconds=READ_YOUR_WRITES_SECONDS):
+    if not username or not _replicas:
+        return
+    with _pins_lock:
+        _pins[username] = time.monotonic() + seconds
+        if len(_pins) > 10000:
+            now = time.monotonic()
+            for key in [k for k, until in _pins.items() if until <= now]:
+                del _pins[key]
 
-def get_db_connection():
-    """Creates and returns a PostgreSQL connection compatible with Supabase."""
-    database_url = os.getenv("DATABASE_URL")
+
+def is_pinned(username):
+    if not username:
+        return False
+    until = _pins.get(username)
+    return until is not None and until > time.monotonic()
+
+
+def replica_status():
+    """Routing state for the health endpoint."""
+    return {
+        "replicas": [replica.status() for replica in _replicas],
+        "max_lag_seconds": REPLICA_MAX_LAG_SECONDS,
+        "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+    }
+
+
+def probe_replicas():
+    for replica in _replicas:
+        replica.probe()
+
+
+def _probe_loop():
+    while not _probe_stop.wait(REPLICA_PROBE_SECONDS):
+        probe_replicas()
+
+
+def start_replica_probe():
+    """Probe once now, then every REPLICA_PROBE_SECONDS (no-op without replicas)."""
+    global _probe_thread
+    if not _replicas or _probe_thread is not None:
+        return
+    probe_replicas()
+    _probe_stop.clear()
+    _probe_thread = threading.Thread(target=_probe_loop, name="replica-probe", daemon=True)
+    _probe_thread.start()
+
+
+def stop_replica_probe():
+    global _probe_thread
+    _probe_stop.set()
+    if _probe_thread is not None:
+        _probe_thread.join(timeout=5)
+        _probe_thread = None
+
+
+def close_pools():
+    _primary_pool.clear()
+    for replica in _replicas:
+        replica.pool.clear()
+
+
+def _read_target(username):
+    if not _replicas:
+        return None, "no_replica"
+    if is_pinned(username):
+        return None, "pinned"
+    healthy = [replica for replica in _replicas if replica.healthy]
+    if not healthy:
+        return None, "fallback"
+    return random.choice(healthy), "replica"
+
+
+def get_db_connection(read_only=False, username=None):
+    """
+    Returns a PostgreSQL connection compatible with Supabase, reused from the
+    pool when one is idle; close() hands it back (see Connection pool).
+
+    read_only=True may return a replica connection (see Read/write routing);
+    otherwise the primary, and username (if given) is pinned to the primary
+    after each commit on it.
+    """
+    start = time.perf_counter()
+    if read_only:
+        replica, route = _read_target(username)
+        if replica is not None:
+            try:
+                connection = replica.pool.acquire()
+                DB_ACQUIRE_LATENCY.observe(time.perf_counter() - start)
+                DB_READ_ROUTES.inc("replica")
+                return DBConnectionWrapper(connection, target=replica.name, pool=replica.pool)
+            except PostgresError as e:
+                print(f"Replica {replica.name} unavailable, reading from the primary: {e}")
+                replica.healthy = False
+                route = "fallback"
+        DB_READ_ROUTES.inc(route)
 
     try:
-        if database_url:
-            connection = psycopg2.connect(
-                database_url,
-                sslmode=os.getenv("DB_SSLMODE", "require"),
-            )
-        else:
-            connection = psycopg2.connect(
-                host=os.getenv("DB_HOST", "localhost"),
-                port=int(os.getenv("DB_PORT", "5432")),
-                user=os.getenv("DB_USER", "postgres"),
-                password=os.getenv("DB_PASSWORD", "postgres"),
-                dbname=os.getenv("DB_NAME", "safechat_db"),
-                sslmode=os.getenv("DB_SSLMODE", "prefer"),
-            )
-
-        return DBConnectionWrapper(connection)
+        connection = _primary_pool.acquire()
+        DB_ACQUIRE_LATENCY.observe(time.perf_counter() - start)
+        return DBConnectionWrapper(connection, pin_username=None if read_only else username, pool=_primary_pool)
     except PostgresError as e:
+        DB_ACQUIRE_ERRORS.inc()
         print(f"Error connecting to PostgreSQL database: {e}")
         return None
+
+
+class QueryProfileMiddleware:
+    """
+    ASGI middleware that attributes statements to the request being served and
+    reports them in X-DB-Profile / X-DB-Slow-Plans response headers.
+    Only installed when DB_PROFILE=1.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = start_request_profile()
+        profile = _request_profile.get()
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-profile", profile.summary_header().encode("latin-1", "replace")))
+                if profile.plans:
+                    headers.append((b"x-db-slow-plans", profile.plans_header().encode("latin-1", "replace")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            finish_request_profile(token, route)
@@ -1,10 +1,11 @@
 # evaluate_model.py
-import os, json, traceback
+import os, json, traceback, argparse, hashlib, time
+from datetime import datetime, timezone
 import pandas as pd
 import joblib
 import re
 import numpy as np
-from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, precision_recall_fscore_support
+from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, precision_recall_curve, roc_curve
 
 def clean_text(s):
     s = str(s).lower()
@@ -19,17 +20,32 @@ MODEL_PATH = os.path.join("models", "model.joblib")
 TEST_CSV = os.path.join("data", "test.csv")
 TRAIN_SPLIT_CSV = os.path.join("data", "train_split.csv")
 
-print("Starting evaluation script...")
+# Threshold report consumed by app.load_decision_threshold()
+REPORT_PATH = os.path.join("models", "threshold.json")
+REPORT_VERSION = 1
+DEFAULT_THRESHOLD = 0.7
+# Max points of each curve kept in the report (plots don't need every distinct score)
+CURVE_POINTS = 500
 
-try:
-    # load artifacts
-    vect = joblib.load(VECT_PATH)
-    model = joblib.load(MODEL_PATH)
-    print(f"Loaded vectorizer and model from {VECT_PATH}, {MODEL_PATH}")
-except Exception:
-    print("ERROR loading model/vectorizer:")
-    traceback.print_exc()
-    raise SystemExit(1)
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_artifacts(vect_path=VECT_PATH, model_path=MODEL_PATH):
+    try:
+        vect = joblib.load(vect_path)
+        model = joblib.load(model_path)
+        print(f"Loaded vectorizer and model from {vect_path}, {model_path}")
+        return vect, model
+    except Exception:
+        print("ERROR loading model/vectorizer:")
+        traceback.print_exc()
+        raise SystemExit(1)
 
 def load_and_prepare(path):
     df = pd.read_csv(path)
@@ -45,7 +61,7 @@ def load_and_prepare(path):
     df["text_clean"] = df["comment_text"].map(clean_text)
     return df
 
-def evaluate_on_df(df, name="TEST"):
+def evaluate_on_df(vect, model, df, name="TEST"):
     X = df["text_clean"].values
     y = df["label"].values
     X_t = vect.transform(X)
@@ -63,26 +79,254 @@ def evaluate_on_df(df, name="TEST"):
             print("ROC AUC error:", e)
     return y, y_pred, y_proba
 
-# Evaluate on train_split if exists
-if os.path.exists(TRAIN_SPLIT_CSV):
-    print("Evaluating on train split:", TRAIN_SPLIT_CSV)
-    df_train = load_and_prepare(TRAIN_SPLIT_CSV)
-    y_train, y_train_pred, y_train_proba = evaluate_on_df(df_train, name="TRAIN_SPLIT")
-else:
-    print("train_split.csv not found; skipping train split evaluation")
-
-# Evaluate on test.csv (required)
-if os.path.exists(TEST_CSV):
-    print("Evaluating on test set:", TEST_CSV)
-    df_test = load_and_prepare(TEST_CSV)
-    y_test, y_test_pred, y_test_proba = evaluate_on_df(df_test, name="TEST")
-else:
-    raise SystemExit("ERROR: data/test.csv not found. Run create_test.py or provide test.csv")
-
-# Threshold analysis for TEST if probabilities available
-if 'y_test_proba' in locals() and y_test_proba is not None:
+
+# --- Threshold optimisation ---
+def threshold_curve(y_true, y_proba):
+    """
+    Precision / recall / F1 at every distinct score, computed in one vectorized
+    pass (sort + cumulative sums inside precision_recall_curve).
+    Arrays are aligned and ordered by increasing threshold.
+    """
+    precision, recall, thresholds = precision_recall_curve(y_true, y_proba)
+    # precision_recall_curve appends a (p=1, r=0) point with no threshold
+    precision, recall = precision[:-1], recall[:-1]
+    denom = precision + recall
+    f1 = np.divide(2 * precision * recall, denom, out=np.zeros_like(denom), where=denom > 0)
+    return {"thresholds": thresholds, "precision": precision, "recall": recall, "f1": f1}
+
+
+def pick_threshold(curve, target_precision=None, target_recall=None):
+    """
+    Choose an operating point from a threshold_curve().
+    - target_precision: lowest threshold reaching the precision target (keeps the most recall)
+    - target_recall: highest threshold still reaching the recall target (keeps the most precision)
+    - neither: the threshold that maximises F1
+    Returns (index, objective) or (None, objective) when the target is unreachable.
+    """
+    if target_precision is not None:
+        objective = {"type": "precision", "target": target_precision}
+        hits = np.flatnonzero(curve["precision"] >= target_precision)
+        return (int(hits[0]) if hits.size else None), objective
+    if target_recall is not None:
+        objective = {"type": "recall", "target": target_recall}
+        hits = np.flatnonzero(curve["recall"] >= target_recall)
+        return (int(hits[-1]) if hits.size else None), objective
+    return int(np.argmax(curve["f1"])), {"type": "f1", "target": None}
+
+
+def _downsample(arrays, n_points=CURVE_POINTS):
+    size = len(next(iter(arrays.values())))
+    if size <= n_points:
+        idx = np.arange(size)
+    else:
+        idx = np.unique(np.linspace(0, size - 1, n_points).round().astype(int))
+    return {k: [round(float(v), 6) for v in np.asarray(a)[idx]] for k, a in arrays.items()}
+
+
+# --- Serving cost ---
+def _percentiles_ms(samples):
+    arr = np.asarray(samples) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 4),
+        "p95_ms": round(float(np.percentile(arr, 95)), 4),
+        "p99_ms": round(float(np.percentile(arr, 99)), 4),
+        "mean_ms": round(float(arr.mean()), 4),
+    }
+
+
+def profile_latency(vect, model, texts, n_single=500, batch_sizes=(32, 256, 1024), repeats=3,
+                    vect_path=VECT_PATH, model_path=MODEL_PATH):
+    """
+    Serving cost of each artifact: load time and size, per-message latency
+    (how classify_text calls it today) and batched throughput.
+    """
+    texts = list(texts)
+    if not texts:
+        return {}
+    rng = np.random.default_rng(42)
+    singles = [texts[i] for i in rng.integers(0, len(texts), size=n_single)]
+
+    artifacts = {}
+    for name, path in (("vectorizer", vect_path), ("model", model_path)):
+        start = time.perf_counter()
+        joblib.load(path)
+        artifacts[name] = {
+            "path": path,
+            "size_bytes": os.path.getsize(path),
+            "load_ms": round((time.perf_counter() - start) * 1000.0, 2),
+        }
+
+    transform_t, proba_t, total_t = [], [], []
+    for text in singles:
+        t0 = time.perf_counter()
+        X = vect.transform([text])
+        t1 = time.perf_counter()
+        model.predict_proba(X)
+        t2 = time.perf_counter()
+        transform_t.append(t1 - t0)
+        proba_t.append(t2 - t1)
+        total_t.append(t2 - t0)
+    artifacts["vectorizer"]["per_message"] = _percentiles_ms(transform_t)
+    artifacts["model"]["per_message"] = _percentiles_ms(proba_t)
+
+    batched = []
+    for size in batch_sizes:
+        batch = [texts[i] for i in rng.integers(0, len(texts), size=size)]
+        best_transform = best_proba = float("inf")
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            X = vect.transform(batch)
+            t1 = time.perf_counter()
+            model.predict_proba(X)
+            t2 = time.perf_counter()
+            best_transform = min(best_transform, t1 - t0)
+            best_proba = min(best_proba, t2 - t1)
+        total = best_transform + best_proba
+        batched.append({
+            "batch_size": size,
+            "transform_ms": round(best_transform * 1000.0, 4),
+            "predict_proba_ms": round(best_proba * 1000.0, 4),
+            "messages_per_s": round(size / total, 1) if total > 0 else None,
+        })
+
+    single_total = float(np.sum(total_t))
+    return {
+        "artifacts": artifacts,
+        "per_message": _percentiles_ms(total_t),
+        "per_message_throughput_per_s": round(len(singles) / single_total, 1) if single_total > 0 else None,
+        "batched": batched,
+    }
+
+
+def print_latency(latency):
+    if not latency:
+        return
+    print("\nServing cost:")
+    for name, info in latency["artifacts"].items():
+        pm = info["per_message"]
+        print(f" {name:<10} {info['size_bytes'] / 1024:8.1f} KiB  load {info['load_ms']:7.1f} ms  "
+              f"per-message p50 {pm['p50_ms']:.3f} ms  p99 {pm['p99_ms']:.3f} ms")
+    pm = latency["per_message"]
+    print(f" end-to-end per-message p50 {pm['p50_ms']:.3f} ms  p95 {pm['p95_ms']:.3f} ms  "
+          f"p99 {pm['p99_ms']:.3f} ms  ({latency['per_message_throughput_per_s']} msg/s)")
+    for row in latency["batched"]:
+        print(f" batch {row['batch_size']:>5}: transform {row['transform_ms']:.2f} ms, "
+              f"predict_proba {row['predict_proba_ms']:.2f} ms -> {row['messages_per_s']} msg/s")
+
+
+def build_report(y_true, y_proba, dataset_path, target_precision=None, target_recall=None,
+                 latency=None, vect_path=VECT_PATH, model_path=MODEL_PATH):
+    curve = threshold_curve(y_true, y_proba)
+    idx, objective = pick_threshold(curve, target_precision, target_recall)
+    if idx is None:
+        print(f"WARNING: {objective['type']} target {objective['target']} is unreachable; "
+              f"falling back to best F1")
+        objective["reached"] = False
+        idx = int(np.argmax(curve["f1"]))
+    else:
+        objective["reached"] = True
+
+    threshold = float(curve["thresholds"][idx])
+    y_hat = (y_proba >= threshold).astype(int)
+    fpr, tpr, roc_thresholds = roc_curve(y_true, y_proba)
+
+    return {
+        "version": REPORT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "artifacts": {
+            "vectorizer": {"path": vect_path, "sha256": file_sha256(vect_path)},
+            "model": {"path": model_path, "sha256": file_sha256(model_path)},
+        },
+        "dataset": {
+            "path": dataset_path,
+            "rows": int(len(y_true)),
+            "positives": int(np.sum(y_true)),
+        },
+        "objective": objective,
+        "threshold": round(threshold, 6),
+        "metrics_at_threshold": {
+            "precision": round(float(curve["precision"][idx]), 6),
+            "recall": round(float(curve["recall"][idx]), 6),
+            "f1": round(float(curve["f1"][idx]), 6),
+        },
+        "roc_auc": round(float(roc_auc_score(y_true, y_proba)), 6),
+        "confusion_matrix": confusion_matrix(y_true, y_hat).tolist(),
+        "pr_curve": _downsample(curve),
+        "roc_curve": _downsample({"fpr": fpr, "tpr": tpr, "thresholds": np.clip(roc_thresholds, 0.0, 1.0)}),
+        "latency": latency or {},
+    }
+
+
+def write_report(report, path=REPORT_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    # atomic swap so a running server never reads a half-written report
+    os.replace(tmp_path, path)
+    print(f"Wrote threshold report v{report['version']} to {path} (threshold {report['threshold']:.4f})")
+
+
+def print_curve_summary(curve, points=(0.5, 0.6, 0.7, 0.8, 0.9)):
     print("\nThreshold tuning (TEST set):")
-    for t in [0.5, 0.6, 0.7, 0.8, 0.9]:
-        y_hat = (y_test_proba >= t).astype(int)
-        p, r, f, _ = precision_recall_fscore_support(y_test, y_hat, average='binary')
-        print(f" threshold {t:.2f} -> precision {p:.3f}, recall {r:.3f}, f1 {f:.3f}")
+    for t in points:
+        i = min(int(np.searchsorted(curve["thresholds"], t)), len(curve["thresholds"]) - 1)
+        print(f" threshold {t:.2f} -> precision {curve['precision'][i]:.3f}, "
+              f"recall {curve['recall'][i]:.3f}, f1 {curve['f1'][i]:.3f}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Evaluate the local model and pick its decision threshold.")
+    parser.add_argument("--test-csv", default=TEST_CSV)
+    parser.add_argument("--train-split-csv", default=TRAIN_SPLIT_CSV)
+    parser.add_argument("--report", default=REPORT_PATH, help="where to write the threshold report")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--target-precision", type=float, help="pick the lowest threshold reaching this precision")
+    target.add_argument("--target-recall", type=float, help="pick the highest threshold reaching this recall")
+    parser.add_argument("--no-latency", action="store_true", help="skip the serving cost profile")
+    parser.add_argument("--no-write", action="store_true", help="print results without writing the report")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print("Starting evaluation script...")
+    vect, model = load_artifacts()
+
+    # Evaluate on train_split if exists
+    if os.path.exists(args.train_split_csv):
+        print("Evaluating on train split:", args.train_split_csv)
+        df_train = load_and_prepare(args.train_split_csv)
+        evaluate_on_df(vect, model, df_train, name="TRAIN_SPLIT")
+    else:
+        print("train_split.csv not found; skipping train split evaluation")
+
+    # Evaluate on test.csv (required)
+    if not os.path.exists(args.test_csv):
+        raise SystemExit("ERROR: data/test.csv not found. Run create_test.py or provide test.csv")
+    print("Evaluating on test set:", args.test_csv)
+    df_test = load_and_prepare(args.test_csv)
+    y_test, _, y_test_proba = evaluate_on_df(vect, model, df_test, name="TEST")
+    if y_test_proba is None:
+        raise SystemExit("Model has no predict_proba; cannot tune a threshold")
+
+    print_curve_summary(threshold_curve(y_test, y_test_proba))
+
+    latency = None
+    if not args.no_latency:
+        latency = profile_latency(vect, model, df_test["text_clean"].values)
+        print_latency(latency)
+
+    report = build_report(y_test, y_test_proba, args.test_csv,
+                          target_precision=args.target_precision,
+                          target_recall=args.target_recall,
+                          latency=latency)
+    m = report["metrics_at_threshold"]
+    print(f"\nSelected threshold {report['threshold']:.4f} ({report['objective']['type']}): "
+          f"precision {m['precision']:.3f}, recall {m['recall']:.3f}, f1 {m['f1']:.3f}")
+    if not args.no_write:
+        write_report(report, args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# fast_response.py
+"""
+Cheaper JSON responses for the list endpoints.
+
+- dumps() serializes straight from DB rows (RealDictRow is a dict) with
+  orjson: datetimes, dicts from JSONB and pydantic models are handled without
+  a jsonable_encoder pass. The output matches FastAPI's JSONResponse (compact,
+  UTF-8, ISO datetimes).
+- FastJSONResponse is the app's default response class, so every endpoint
+  renders with orjson. An endpoint whose rows already have the shape of its
+  response_model returns one directly, which also skips FastAPI's per-row
+  validation and re-encoding of List[...] responses.
+- CompressionMiddleware compresses JSON / text bodies of COMPRESS_MIN_BYTES or
+  more with brotli (when the `brotli` package is installed) or gzip, whichever
+  the client prefers in Accept-Encoding. Streaming responses are compressed
+  chunk by chunk, each chunk flushed so clients see rows as they are produced.
+"""
+import os
+import zlib
+from decimal import Decimal
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from telemetry import RESPONSE_BYTES
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# 4-5 is the usual sweet spot for dynamic content; 11 is for static assets
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def _default(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, Decimal):
+        return float(value)
+    return jsonable_encoder(value)
+
+
+def dumps(content):
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+# --- Compression ---
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header (q-values honoured, br wins ties)."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in (("br", "gzip") if brotli is not None else ("gzip",)):
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._gz = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def chunk(self, data):
+        """Compressed bytes for data, flushed so the client can decode them now."""
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.flush()
+        return self._gz.compress(data) + self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data=b""):
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.finish()
+        return self._gz.compress(data) + self._gz.flush()
+
+
+class CompressionMiddleware:
+    """Plain ASGI middleware (same shape as MetricsMiddleware)."""
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None  # set once we decided to compress
+        passthrough = False
+        raw_bytes = sent_bytes = 0
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough, raw_bytes, sent_bytes
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start["headers"])
+                content_type = headers.get("content-type", "")
+                if (start["status"] in (204, 304) or "content-encoding" in headers
+                        or not content_type.startswith(COMPRESSIBLE_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    if content_type.startswith(COMPRESSIBLE_TYPES):
+                        headers.add_vary_header("Accept-Encoding")
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    data = compressor.finish(body)
+                    headers["Content-Length"] = str(len(data))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": data})
+                    RESPONSE_BYTES.inc(encoding, "raw", amount=len(body))
+                    RESPONSE_BYTES.inc(encoding, "sent", amount=len(data))
+                    return
+                del headers["Content-Length"]
+                await send(start)
+
+            raw_bytes += len(body)
+            data = compressor.chunk(body) if more_body else compressor.finish(body)
+            sent_bytes += len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+            if not more_body:
+                RESPONSE_BYTES.inc(encoding, "raw", amount=raw_bytes)
+                RESPONSE_BYTES.inc(encoding, "sent", amount=sent_bytes)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,324 @@
+# index_advisor.py
+"""
+Index advisor for the hot queries in app.py.
+
+CATALOGUE lists the SQL the API serves on its busy paths (taken from app.py's
+module-level query constants, so the advisor never drifts from the code).
+Each statement is EXPLAIN ANALYZEd against a seeded local database; plan
+nodes are flagged when they
+
+- sequentially scan at least --row-threshold rows (rows returned plus rows
+  removed by the filter), or
+- sort at least --row-threshold input rows.
+
+For a flagged query, the catalogue's candidate indexes that do not exist yet
+are tried one at a time inside a transaction that is rolled back, and a
+candidate is recommended only if the re-planned query loses a flag or gets
+clearly cheaper. --write-migration turns the recommendations into the next
+migrations/NNNN_index_advisor.sql (CREATE INDEX CONCURRENTLY, applied by
+migrate.py outside a transaction).
+
+Some queries read whole tables by design (admin aggregates, the unpaged post
+feed); their entries carry a note instead of candidates so the report says why
+nothing is recommended.
+
+Usage:
+    python index_advisor.py --db-url postgresql://localhost/safechat_bench
+    python index_advisor.py --db-url ... --write-migration
+    python microbench.py run --db-url ...        # runs the advisor too
+
+Point --db-url at a throwaway database: it is seeded with mb_* rows, and
+candidate indexes are built (then rolled back) on it.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROW_THRESHOLD = 1000
+IMPROVEMENT_RATIO = 0.8  # a candidate that only lowers cost must cut it by >= 20%
+
+_INDEX_NAME_RE = re.compile(r"CREATE\s+INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+
+
+def build_catalogue(app):
+    """
+    [(name, source, sql, candidates, note)]. `sql` uses %(name)s parameters
+    filled by sample_params(); candidates are CREATE INDEX statements.
+    """
+    return [
+        ("user_id_lookup", "get_user_id",
+         "SELECT id FROM users WHERE username = %(username)s", [], None),
+        ("chat_feed", "get_feed_internal", app.FEED_SQL, [], None),
+        ("chat_notifications", "get_incoming_chat_notifications", app.NOTIFICATIONS_SQL,
+         ["CREATE INDEX idx_chat_receiver_created ON chat_messages(receiver_id, created_at)"], None),
+        ("inbox", "get_inbox", app.INBOX_SQL, [], None),
+        ("user_post_history", "get_user_post_history", app.USER_POST_HISTORY_SQL,
+         ["CREATE INDEX idx_posts_user_created ON posts(user_id, created_at DESC)"], None),
+        ("posts_feed", "get_posts", app.POSTS_SQL, [],
+         "returns every post and comment; needs paging, not an index"),
+        ("moderation_stats", "get_moderation_stats", app.MODERATION_STATS_SQL, [],
+         "counts every post by status in one pass"),
+        ("reported_posts", "get_reported_posts",
+         "SELECT p.id, p.parent_id AS post_id, p.text, p.created_at, u.username "
+         "FROM posts p JOIN users u ON p.user_id = u.id WHERE p.status = 'pending' "
+         "ORDER BY p.created_at DESC, p.id DESC LIMIT 100",
+         ["CREATE INDEX idx_posts_pending_queue ON posts(created_at, id) WHERE status = 'pending'"], None),
+        ("review_queue_posts", "get_review_queue",
+         app.REVIEW_POSTS_SQL.format(filters=app.UNCLAIMED_FILTER.format(alias="p")),
+         ["CREATE INDEX idx_posts_pending_queue ON posts(created_at, id) WHERE status = 'pending'"], None),
+        ("review_queue_reports", "get_review_queue",
+         app.REVIEW_REPORTS_SQL.format(filters=app.UNCLAIMED_FILTER.format(alias="r")),
+         ["CREATE INDEX idx_message_reports_pending_queue "
+          "ON message_reports(created_at, id) WHERE status = 'pending'"], None),
+        ("pending_reports", "list_pending_message_reports", app.PENDING_REPORTS_SQL,
+         ["CREATE INDEX idx_message_reports_pending_queue "
+          "ON message_reports(created_at, id) WHERE status = 'pending'"], None),
+        ("online_users", "get_online_users", app.ONLINE_USERS_SQL, [],
+         "an index on last_seen would make every heartbeat upsert a non-HOT update"),
+    ]
+
+
+def sample_params(db):
+    """Parameters that hit the heaviest rows: the busiest receiver and poster."""
+    cursor = db.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT receiver_id, sender_id, COUNT(*) AS n FROM chat_messages
+            GROUP BY receiver_id, sender_id ORDER BY n DESC LIMIT 1
+        """)
+        pair = cursor.fetchone() or {"receiver_id": 0, "sender_id": 0}
+        cursor.execute("""
+            SELECT receiver_id FROM chat_messages GROUP BY receiver_id ORDER BY COUNT(*) DESC LIMIT 1
+        """)
+        receiver = cursor.fetchone() or {"receiver_id": 0}
+        cursor.execute("SELECT user_id FROM posts GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        poster = cursor.fetchone() or {"user_id": 0}
+        cursor.execute("SELECT username FROM users WHERE id = %s", (poster["user_id"],))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    # the pair/poster params serve the feed and post history; notifications use the top receiver
+    return {
+        "pair": {"user_id": pair["receiver_id"], "other_id": pair["sender_id"]},
+        # since/lookback wide enough to cover the whole seeded history, the worst case
+        "receiver": {"user_id": receiver["receiver_id"], "since": None, "lookback": 24 * 365 * 100},
+        "poster": {"user_id": poster["user_id"], "username": row["username"] if row else ""},
+        "queue": {"limit": 50, "moderator": "mb_moderator"},
+    }
+
+
+def params_for(name, samples):
+    if name == "chat_feed":
+        return samples["pair"]
+    if name.startswith("chat_notifications"):
+        return samples["receiver"]
+    if name == "inbox":
+        return {"user_id": samples["receiver"]["user_id"], "limit": 50}
+    if name.startswith("review_queue") or name == "pending_reports":
+        return samples["queue"]
+    return samples["poster"]
+
+
+# --- Plan inspection ---
+def explain(cursor, sql, params):
+    cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def _walk(node, parent=None):
+    yield node, parent
+    for child in node.get("Plans", ()):
+        yield from _walk(child, node)
+
+
+def flag_plan(plan, row_threshold):
+    """Flags as short strings, e.g. 'Seq Scan on posts (20000 rows)'."""
+    flags = []
+    for node, parent in _walk(plan):
+        loops = node.get("Actual Loops", 1) or 1
+        if node["Node Type"] == "Seq Scan":
+            removed = node.get("Rows Removed by Filter", 0) * loops
+            rows = node.get("Actual Rows", 0) * loops + removed
+            # an unfiltered scan building a hash join's table is the planner's choice, not a missing index
+            if parent is not None and parent["Node Type"] == "Hash" and not removed:
+                continue
+            if rows >= row_threshold:
+                flags.append(f"Seq Scan on {node['Relation Name']} ({rows:.0f} rows)")
+        elif node["Node Type"] in ("Sort", "Incremental Sort"):
+            child = (node.get("Plans") or [node])[0]
+            rows = child.get("Actual Rows", 0) * (child.get("Actual Loops", 1) or 1)
+            if rows >= row_threshold:
+                flags.append(f"Sort on {', '.join(node.get('Sort Key', []))} ({rows:.0f} rows)")
+    return flags
+
+
+def _kind(flag):
+    # "Seq Scan on posts (20000 rows)" -> "Seq Scan on posts": row counts change once indexed
+    return flag.rsplit(" (", 1)[0]
+
+
+def existing_indexes(cursor):
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def try_candidate(db, statement, sql, params, baseline_flags, baseline_cost, row_threshold):
+    """Build one candidate in a rolled-back transaction; return the new plan summary."""
+    cursor = db.cursor()
+    try:
+        cursor.execute(statement)
+        cursor.execute("ANALYZE " + statement.split(" ON ", 1)[1].split("(", 1)[0].strip())
+        plan = explain(cursor, sql, params)
+    finally:
+        db.rollback()
+        cursor.close()
+    flags = flag_plan(plan, row_threshold)
+    removed = {_kind(f) for f in baseline_flags} - {_kind(f) for f in flags}
+    cost = plan["Total Cost"]
+    return {
+        "flags": flags,
+        "cost": cost,
+        "ms": plan.get("Actual Total Time"),
+        "helps": bool(removed) or cost <= baseline_cost * IMPROVEMENT_RATIO,
+    }
+
+
+def advise(db, catalogue, row_threshold=DEFAULT_ROW_THRESHOLD):
+    """EXPLAIN every catalogued query; returns (findings, recommended CREATE INDEX statements)."""
+    samples = sample_params(db)
+    cursor = db.cursor()
+    try:
+        present = existing_indexes(cursor)
+    finally:
+        cursor.close()
+    db.commit()
+
+    findings = []
+    recommended = []
+    for name, source, sql, candidates, note in catalogue:
+        params = params_for(name, samples)
+        cursor = db.cursor()
+        try:
+            plan = explain(cursor, sql, params)
+        finally:
+            db.rollback()
+            cursor.close()
+        flags = flag_plan(plan, row_threshold)
+        finding = {
+            "query": name,
+            "source": source,
+            "cost": plan["Total Cost"],
+            "ms": plan.get("Actual Total Time"),
+            "flags": flags,
+            "note": note,
+            "recommended": [],
+        }
+        if flags:
+            for statement in candidates:
+                index_name = _INDEX_NAME_RE.match(statement).group(1)
+                if index_name in present:
+                    continue
+                result = try_candidate(db, statement, sql, params, flags, plan["Total Cost"], row_threshold)
+                if result["helps"]:
+                    finding["recommended"].append({"index": statement, **result})
+                    if statement not in recommended:
+                        recommended.append(statement)
+        findings.append(finding)
+    return findings, recommended
+
+
+def print_report(findings):
+    for f in findings:
+        status = "ok" if not f["flags"] else ("fix" if f["recommended"] else "flagged")
+        print(f"{f['query']:<26} {status:<8} cost {f['cost']:>10.1f}  {f['ms'] or 0:>8.2f} ms  ({f['source']})")
+        for flag in f["flags"]:
+            print(f"    - {flag}")
+        for r in f["recommended"]:
+            print(f"    + {r['index']}  -> cost {r['cost']:.1f}, {r['ms'] or 0:.2f} ms")
+        if f["flags"] and not f["recommended"] and f["note"]:
+            print(f"    ({f['note']})")
+
+
+# --- Migration output ---
+def write_migration(recommended, findings, directory=None):
+    """Write the next NNNN_index_advisor.sql; returns its path, or None when nothing is recommended."""
+    import migrate
+
+    if not recommended:
+        return None
+    directory = directory or migrate.MIGRATIONS_DIR
+    version = max([m.version for m in migrate.discover(directory)] + [0]) + 1
+    path = os.path.join(directory, f"{version:04d}_index_advisor.sql")
+    lines = [
+        migrate.NO_TRANSACTION_MARKER,
+        "-- Generated by index_advisor.py: indexes that removed a seq scan or sort",
+        "-- from the plans of the queries below.",
+        "",
+    ]
+    for statement in recommended:
+        queries = [f["query"] for f in findings if any(r["index"] == statement for r in f["recommended"])]
+        lines.append(f"-- {', '.join(queries)}")
+        lines.append(re.sub(r"^CREATE INDEX ", "CREATE INDEX CONCURRENTLY IF NOT EXISTS ", statement) + ";")
+        lines.append("")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return path
+
+
+def run_advisor(app, db, row_threshold=DEFAULT_ROW_THRESHOLD):
+    """Entry point shared with microbench.py."""
+    findings, recommended = advise(db, build_catalogue(app), row_threshold)
+    print_report(findings)
+    return findings, recommended
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN the app's hot queries and suggest indexes.")
+    parser.add_argument("--db-url", required=True, help="local Postgres DSN (seeded with mb_* rows)")
+    parser.add_argument("--row-threshold", type=int, default=DEFAULT_ROW_THRESHOLD)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--db-users", type=int, default=1000)
+    parser.add_argument("--db-messages", type=int, default=100000)
+    parser.add_argument("--db-posts", type=int, default=20000)
+    parser.add_argument("--write-migration", action="store_true", help="write migrations/NNNN_index_advisor.sql")
+    parser.add_argument("--json", help="also write the findings to this file")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.db_url
+    os.environ.setdefault("DB_SSLMODE", "disable")
+    os.environ.setdefault("SCHEMA_AUTO_MIGRATE", "1")
+    sys.path.insert(0, BASE_DIR)
+    os.chdir(BASE_DIR)
+    import app
+    from microbench import seed_database
+
+    db = app.get_db_connection()
+    if db is None:
+        print("Database connection failed")
+        return 1
+    try:
+        seed_database(db, args.db_users, args.db_messages, args.seed, args.db_posts)
+        findings, recommended = run_advisor(app, db, args.row_threshold)
+    finally:
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(findings, f, indent=2)
+    if args.write_migration:
+        path = write_migration(recommended, findings)
+        print(f"\nWrote {path}" if path else "\nNothing to recommend; no migration written.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
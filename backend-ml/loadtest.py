@@ -0,0 +1,430 @@
+# loadtest.py
+"""
+End-to-end load test for the FastAPI backend.
+
+Starts a stub OpenRouter server with configurable latency, launches app.py
+under uvicorn against the local Postgres configured in the environment
+(DATABASE_URL or DB_*), seeds users, then replays a weighted mix of chat
+sends, feed polls, heartbeats, notifications, post creation and admin
+listings. Reports p50/p95/p99 latency and requests/s per endpoint.
+
+    python loadtest.py --duration 60 --concurrency 16
+    python loadtest.py --save-baseline      # record benchmarks/loadtest_baseline.json
+    python loadtest.py --compare            # exit 1 if slower than the baseline
+    python loadtest.py --dataset dataset/   # users and history from `bulk_io.py export all`
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from bisect import bisect
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import accumulate
+
+import numpy as np
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "benchmarks", "loadtest_baseline.json")
+BASELINE_VERSION = 1
+
+# Messages containing this marker are labelled toxic by the stub LLM
+TOXIC_MARKER = "lt_toxic_marker"
+WORDS = [
+    "hey", "how", "are", "you", "doing", "today", "see", "later", "thanks", "great",
+    "movie", "lunch", "weekend", "project", "meeting", "tomorrow", "cool", "nice",
+    "game", "music", "class", "exam", "coffee", "plan", "idea", "photo", "trip",
+]
+
+
+# --- Stub OpenRouter ---
+class StubOpenRouterHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        prompt = body.get("messages", [{}])[0].get("content", "")
+
+        server = self.server
+        with server.rng_lock:
+            delay_ms = max(0.0, server.rng.gauss(server.latency_ms, server.jitter_ms))
+        time.sleep(delay_ms / 1000.0)
+
+        toxic = TOXIC_MARKER in prompt
+        verdict = {
+            "label": "toxic" if toxic else "clean",
+            "confidence": 0.92 if toxic else 0.88,
+            "reason": "load-test stub",
+        }
+        payload = json.dumps({"choices": [{"message": {"content": json.dumps(verdict)}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_openrouter(latency_ms, jitter_ms, seed, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubOpenRouterHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.rng = random.Random(seed)
+    server.rng_lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v1/chat/completions"
+    print(f"Stub OpenRouter listening on {url} (latency {latency_ms}±{jitter_ms} ms)")
+    return server, url
+
+
+# --- App under test ---
+def start_app(port, workers, stub_url, database_url=None, log_path=None):
+    env = os.environ.copy()
+    env.update({
+        "OPENROUTER_API_KEY": "loadtest",
+        "OPENROUTER_URL": stub_url,
+        "PYTHONUNBUFFERED": "1",
+    })
+    # every virtual user shares 127.0.0.1; measure throughput, not the limiter
+    env.setdefault("RATE_LIMIT_ENABLED", "0")
+    env.setdefault("SCHEMA_AUTO_MIGRATE", "1")
+    if database_url:
+        env["DATABASE_URL"] = database_url
+        env.setdefault("DB_SSLMODE", "disable")
+
+    log_file = open(log_path, "w") if log_path else subprocess.DEVNULL
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BASE_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT,
+    )
+    return proc
+
+
+def wait_until_ready(base_url, proc=None, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit(f"App exited during startup with code {proc.returncode}")
+        try:
+            if requests.get(f"{base_url}/docs", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"App at {base_url} not ready after {timeout}s")
+
+
+# --- Dataset ---
+def random_text(rng, n_min=3, n_max=12):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(n_min, n_max)))
+
+
+def seed_dataset(base_url, n_users, seed):
+    """Create the load-test users and a little history. Safe to re-run."""
+    rng = random.Random(seed)
+    session = requests.Session()
+    users = [f"lt_user_{i:04d}" for i in range(n_users)]
+    for username in users:
+        resp = session.post(f"{base_url}/signup", json={
+            "username": username, "email": f"{username}@loadtest.local", "password": "loadtest",
+        })
+        if resp.status_code not in (200, 400):
+            raise SystemExit(f"Seeding failed for {username}: {resp.status_code} {resp.text}")
+    for _ in range(n_users):
+        sender, receiver = rng.sample(users, 2)
+        session.post(f"{base_url}/send_message", json={
+            "user": sender, "receiver_username": receiver, "text": random_text(rng),
+        })
+    for _ in range(max(1, n_users // 5)):
+        session.post(f"{base_url}/create_post", json={"user": rng.choice(users), "text": random_text(rng)})
+    print(f"Seeded {n_users} users")
+    return users
+
+
+def import_dataset(directory, database_url, n_users):
+    """
+    Load a `python bulk_io.py export all --dir DIR` snapshot with COPY instead of
+    seeding over HTTP (fast for large datasets; re-imports are no-ops).
+    """
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, BASE_DIR)
+    import bulk_io
+    from database import get_db_connection
+
+    db = get_db_connection()
+    if db is None:
+        raise SystemExit("Dataset import failed: database connection failed")
+    try:
+        bulk_io.import_all(db, directory)
+        cursor = db.cursor()
+        cursor.execute("SELECT username FROM users WHERE username LIKE 'lt\\_user\\_%%' ORDER BY username LIMIT %s",
+                       (n_users,))
+        users = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    finally:
+        db.close()
+    if len(users) < 2:
+        raise SystemExit(f"Dataset {directory} has fewer than 2 lt_user_* users")
+    print(f"Imported dataset {directory}: {len(users)} users")
+    return users
+
+
+# --- Traffic mix ---
+def _send_message(rng, users):
+    sender, receiver = rng.sample(users, 2)
+    text = random_text(rng)
+    if rng.random() < 0.05:
+        text = f"{text} {TOXIC_MARKER}"
+    return "POST", "/send_message", {"user": sender, "receiver_username": receiver, "text": text}
+
+
+def _get_feed(rng, users):
+    user, other = rng.sample(users, 2)
+    return "GET", f"/get_feed/{user}?other_username={other}", None
+
+
+def _heartbeat(rng, users):
+    return "POST", "/heartbeat", {"username": rng.choice(users)}
+
+
+def _chat_notifications(rng, users):
+    return "GET", f"/chat_notifications/{rng.choice(users)}", None
+
+
+def _online_users(rng, users):
+    return "GET", "/online_users", None
+
+
+def _create_post(rng, users):
+    text = random_text(rng, 5, 25)
+    if rng.random() < 0.05:
+        text = f"{text} {TOXIC_MARKER}"
+    return "POST", "/create_post", {"user": rng.choice(users), "text": text}
+
+
+def _get_posts(rng, users):
+    return "GET", "/get_posts", None
+
+
+def _pending_reports(rng, users):
+    return "GET", "/message_reports/pending", None
+
+
+def _admin_users(rng, users):
+    return "GET", "/get_users", None
+
+
+def _moderation_stats(rng, users):
+    return "GET", "/moderation_stats", None
+
+
+# (weight, endpoint label, request builder) — roughly what the React client produces:
+# ChatPanel polls the feed every 3 s, heartbeats every 10 s, AdminPanel refreshes every 10 s.
+TRAFFIC_MIX = [
+    (12, "POST /send_message", _send_message),
+    (30, "GET /get_feed/{username}", _get_feed),
+    (18, "POST /heartbeat", _heartbeat),
+    (14, "GET /chat_notifications/{username}", _chat_notifications),
+    (6, "GET /online_users", _online_users),
+    (4, "POST /create_post", _create_post),
+    (8, "GET /get_posts", _get_posts),
+    (3, "GET /message_reports/pending", _pending_reports),
+    (3, "GET /get_users", _admin_users),
+    (2, "GET /moderation_stats", _moderation_stats),
+]
+
+
+def run_worker(base_url, users, seed, start_at, warmup_until, stop_at, results):
+    rng = random.Random(seed)
+    cumulative = list(accumulate(w for w, _, _ in TRAFFIC_MIX))
+    session = requests.Session()
+    samples = []
+    while time.time() < start_at:
+        time.sleep(0.001)
+    while True:
+        now = time.time()
+        if now >= stop_at:
+            break
+        _, label, builder = TRAFFIC_MIX[bisect(cumulative, rng.random() * cumulative[-1])]
+        method, path, body = builder(rng, users)
+        t0 = time.perf_counter()
+        try:
+            resp = session.request(method, f"{base_url}{path}", json=body, timeout=30)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - t0
+        if now >= warmup_until:
+            samples.append((label, elapsed, ok))
+    results.extend(samples)
+
+
+def run_load(base_url, users, concurrency, duration, warmup, seed):
+    results = []
+    start_at = time.time() + 0.5
+    warmup_until = start_at + warmup
+    stop_at = warmup_until + duration
+    per_worker = [[] for _ in range(concurrency)]
+    threads = [
+        threading.Thread(target=run_worker,
+                         args=(base_url, users, seed + i, start_at, warmup_until, stop_at, per_worker[i]))
+        for i in range(concurrency)
+    ]
+    print(f"Running {concurrency} workers for {warmup}s warmup + {duration}s measurement...")
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for samples in per_worker:
+        results.extend(samples)
+    return results
+
+
+def summarize(samples, duration):
+    by_endpoint = {}
+    for label, elapsed, ok in samples:
+        by_endpoint.setdefault(label, ([], [0]))
+        by_endpoint[label][0].append(elapsed)
+        if not ok:
+            by_endpoint[label][1][0] += 1
+
+    def stats(latencies, errors):
+        arr = np.asarray(latencies) * 1000.0
+        return {
+            "count": int(arr.size),
+            "errors": int(errors),
+            "rps": round(arr.size / duration, 2),
+            "p50_ms": round(float(np.percentile(arr, 50)), 2),
+            "p95_ms": round(float(np.percentile(arr, 95)), 2),
+            "p99_ms": round(float(np.percentile(arr, 99)), 2),
+        }
+
+    endpoints = {label: stats(lat, err[0]) for label, (lat, err) in sorted(by_endpoint.items())}
+    all_latencies = [elapsed for _, elapsed, _ in samples]
+    total = stats(all_latencies, sum(1 for _, _, ok in samples if not ok)) if samples else {}
+    return {"endpoints": endpoints, "total": total}
+
+
+def print_summary(summary):
+    header = f"{'endpoint':<38} {'count':>7} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print("\n" + header)
+    print("-" * len(header))
+    rows = list(summary["endpoints"].items()) + [("TOTAL", summary["total"])]
+    for label, s in rows:
+        if not s:
+            continue
+        print(f"{label:<38} {s['count']:>7} {s['errors']:>5} {s['rps']:>8.1f} "
+              f"{s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}")
+
+
+def compare_to_baseline(summary, baseline, tolerance):
+    """Flag endpoints whose p95 grew or whose throughput dropped by more than `tolerance`."""
+    regressions = []
+    print(f"\nComparison with baseline from {baseline.get('created_at')} (tolerance {tolerance:.0%}):")
+    for label, base in baseline.get("endpoints", {}).items():
+        current = summary["endpoints"].get(label)
+        if current is None:
+            continue
+        p95_change = (current["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        rps_change = (current["rps"] - base["rps"]) / base["rps"] if base["rps"] else 0.0
+        failed = p95_change > tolerance or rps_change < -tolerance
+        flag = "REGRESSION" if failed else "ok"
+        print(f" {label:<38} p95 {base['p95_ms']:>8.2f} -> {current['p95_ms']:>8.2f} ({p95_change:+.0%})  "
+              f"req/s {base['rps']:>7.1f} -> {current['rps']:>7.1f} ({rps_change:+.0%})  {flag}")
+        if failed:
+            regressions.append(label)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay mixed traffic against a local SafeChat backend.")
+    parser.add_argument("--target", help="base URL of an already running app (skips starting uvicorn)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--app-workers", type=int, default=2, help="uvicorn --workers for the app under test")
+    parser.add_argument("--database-url", help="Postgres DSN for the app (defaults to the environment)")
+    parser.add_argument("--app-log", help="write the app's stdout/stderr to this file")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--dataset", help="import this bulk_io.py export directory instead of seeding over HTTP")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--output", help="write the full result JSON here")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stub, stub_url = start_stub_openrouter(args.llm_latency_ms, args.llm_jitter_ms, args.seed)
+    proc = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            base_url = f"http://127.0.0.1:{args.port}"
+            proc = start_app(args.port, args.app_workers, stub_url, args.database_url, args.app_log)
+        wait_until_ready(base_url, proc)
+
+        if args.dataset:
+            users = import_dataset(args.dataset, args.database_url, args.users)
+        else:
+            users = seed_dataset(base_url, args.users, args.seed)
+        samples = run_load(base_url, users, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        stub.shutdown()
+
+    summary = summarize(samples, args.duration)
+    print_summary(summary)
+
+    result = {
+        "version": BASELINE_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+            "users": args.users, "dataset": args.dataset, "seed": args.seed, "app_workers": args.app_workers,
+            "llm_latency_ms": args.llm_latency_ms, "llm_jitter_ms": args.llm_jitter_ms,
+        },
+        **summary,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Wrote results to {path}")
+
+    if args.compare:
+        if not os.path.exists(args.compare):
+            raise SystemExit(f"Baseline {args.compare} not found; run with --save-baseline first")
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != result["config"]:
+            print("WARNING: baseline was recorded with a different configuration")
+        regressions = compare_to_baseline(summary, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} endpoint(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,8 @@ begin;
 
 create table if not exists message_reports (
   id              bigserial primary key,
-  message_id      bigint       not null references chat_messages(id) on delete cascade,
+  message_id      bigint       not null,  -- chat_messages is partitioned: no FK on id alone
+  message_created_at timestamptz null,
   reporter_id     bigint       not null references users(id) on delete cascade,
   reported_user_id bigint      not null references users(id) on delete cascade,
   reason          varchar(50)  not null,
@@ -39,7 +40,7 @@ select
 from message_reports r
 join users rep   on rep.id   = r.reporter_id
 join users rep2  on rep2.id  = r.reported_user_id
-left join chat_messages m on m.id = r.message_id
+left join chat_messages_all m on m.id = r.message_id and m.created_at = r.message_created_at
 where r.status = 'pending'
 order by r.created_at desc;
 
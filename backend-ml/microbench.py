@@ -0,0 +1,722 @@
+# microbench.py
+"""
+Microbenchmarks for the classify_text tiers, the DB helpers in app.py (and its
+hot statements, ad hoc vs prepared) and the JSON / compression cost of the
+list endpoints.
+
+Every case runs over a synthetic, seeded corpus so numbers are comparable
+between runs. Results are written as JSON under benchmarks/results/, named
+after the git commit, and two runs can be diffed:
+
+    python microbench.py run                                 # pure-Python cases only
+    python microbench.py run --db-url postgresql://localhost/safechat_bench
+    python microbench.py compare HEAD~1 HEAD                 # commits or result files
+
+Postgres-backed cases only run when --db-url is given; point it at a local
+(throwaway) database, never at production — the cases seed their own rows.
+Those runs also EXPLAIN the app's hot queries (index_advisor.py) and store the
+flagged plans under "index_advisor" in the result.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+RESULTS_VERSION = 1
+
+CLEAN_WORDS = [
+    "hey", "how", "are", "you", "doing", "today", "see", "later", "thanks", "great",
+    "movie", "lunch", "weekend", "project", "meeting", "tomorrow", "cool", "nice",
+    "game", "music", "class", "exam", "coffee", "plan", "idea", "photo", "trip",
+    "awesome", "friend", "party", "book", "train", "weather", "dinner", "call",
+]
+TOXIC_WORDS = ["idiot", "stupid", "loser", "hate", "dumb", "moron", "ugly", "shut", "up"]
+HINGLISH_WORDS = ["yaar", "kya", "hai", "bhai", "accha", "nahi", "kal", "milte", "chalo"]
+# Everyday Hinglish that sits close to the abusive lexicon once canonicalized
+# ('teri marzi', 'calculus', 'Honolulu', 'salary'); none of it is abusive
+HINGLISH_CLEAN = [
+    "jo teri marzi yaar", "teri madad karunga bhai", "teri mammi ne bola ghar aa jao", "calculus ka exam kal hai",
+    "Honolulu trip kab hai bhai", "meri salary kab aayegi yaar", "random baat mat kar", "abc wala chapter padh liya",
+    "teri behan ki shaadi kab hai", "masala chai pilao bhai", "salad kha lo pehle", "kamaal ka kaam kiya tumne",
+    "mcdonalds chalein kya", "bhai saalgirah mubarak ho", "tere mama ji aaye hain", "kal lunch pe milte hain",
+    "ulta pulta mat bolo yaar", "chakkar mat kaat bhai", "gaadi kahan park ki", "suraj ugne se pehle uthna hai",
+    "mera laptop hang ho gaya", "landmark ke paas milte hain", "kamra saaf kar diya", "bhai match dekha kya",
+    "hum log randomly mile the", "chalo movie dekhte hain", "accha theek hai kal baat karte hain",
+    "tumhari maa ki tabiyat kaisi hai", "teri maaf karna yaar", "gandhi jayanti pe chutti hai",
+]
+# English that the lexicon's two-letter terms and spaced-letter folding could
+# misread ('b.c.', 'bc' for because, 'm.c.'); none of it is abusive
+ENGLISH_CLEAN = [
+    "b.c. era history", "the temple dates from 300 b.c.", "bc I was late again", "skipped gym bc of the rain",
+    "m.c. escher prints are cool", "the mc at the party was great", "a b c d practice", "c.v. attached for review",
+    "random salary question", "calculus exam tomorrow", "Honolulu trip next week", "a.m. or p.m. works",
+]
+CYRILLIC_WORDS = ["привет", "как", "дела", "сегодня", "завтра", "спасибо", "хорошо", "встреча", "друг", "кино"]
+DEVANAGARI_WORDS = ["क्या", "है", "भाई", "कल", "मिलते", "हैं", "ठीक", "नहीं", "यार", "चलो", "खाना", "घर"]
+
+
+# --- Synthetic data ---
+def make_corpus(size, seed, toxic_ratio=0.1, hinglish_ratio=0.1, hindi_abusive=()):
+    """Chat-like messages: mostly clean, some insults, some Hinglish (some of it abusive)."""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(CLEAN_WORDS) for _ in range(rng.randint(3, 20))]
+        roll = rng.random()
+        if roll < toxic_ratio:
+            words[rng.randrange(len(words))] = rng.choice(TOXIC_WORDS)
+        elif roll < toxic_ratio + hinglish_ratio:
+            words += [rng.choice(HINGLISH_WORDS) for _ in range(rng.randint(1, 4))]
+            if hindi_abusive and rng.random() < 0.5:
+                words.append(rng.choice(hindi_abusive))
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def make_script_corpus(corpus, seed, devanagari_ratio=0.1):
+    """corpus with a share of its messages rewritten in Devanagari, for detect_script."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(DEVANAGARI_WORDS) for _ in range(rng.randint(3, 20)))
+        if rng.random() < devanagari_ratio else text
+        for text in corpus
+    ]
+
+
+OBFUSCATIONS = ("leet", "stretch", "spaced", "homoglyph", "cyrillic", "upper", "zero_width")
+_LEET_OUT = {"o": "0", "i": "1", "e": "3", "a": "4", "s": "5", "t": "7"}
+
+
+def obfuscate(word, how, rng):
+    """word disguised the way users dodge keyword lists: 'ch00tiya', 'chuuutiya', 'c.h.u.t.i.y.a', ..."""
+    if how == "leet":
+        return "".join(_LEET_OUT.get(ch, ch) if rng.random() < 0.6 else ch for ch in word)
+    if how == "stretch":
+        i = rng.randrange(len(word))
+        return word[:i] + word[i] * rng.randint(2, 4) + word[i:]
+    if how == "spaced":
+        return rng.choice([" ", ".", "-", "*"]).join(word)
+    if how in ("homoglyph", "cyrillic"):
+        import classifier
+
+        lookalikes = {}
+        for ch, latin in classifier.HOMOGLYPHS.items():
+            lookalikes.setdefault(latin, ch)  # Cyrillic first
+        if how == "cyrillic":  # every letter that has a Cyrillic lookalike: 'ѕааla'
+            return "".join(lookalikes[ch] if "\u0400" <= lookalikes.get(ch, "a") <= "\u052f" else ch for ch in word)
+        return "".join(lookalikes.get(ch, ch) if rng.random() < 0.5 else ch for ch in word)
+    if how == "upper":
+        return "".join(ch.upper() if rng.random() < 0.7 else ch for ch in word)
+    i = rng.randrange(1, len(word)) if len(word) > 1 else 1
+    return word[:i] + rng.choice("\u200b\u200c\u200d\u2060\u00ad") + word[i:]
+
+
+def make_obfuscated_corpus(size, seed, terms, ratio=0.3):
+    """
+    (text, term, obfuscation) triples: Hinglish/English chat where a share of
+    the messages carries one of terms disguised by obfuscate(); term and
+    obfuscation are None for the rest, which hold no abusive term at all (a
+    share of them from HINGLISH_CLEAN and ENGLISH_CLEAN). Terms in Cyrillic
+    lookalikes come alone or inside Russian chat, where they are a minority of
+    the letters.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for text in make_corpus(size, seed, hinglish_ratio=0.3):
+        if rng.random() >= ratio:
+            roll = rng.random()
+            if roll < 0.2:
+                text = rng.choice(HINGLISH_CLEAN)
+            elif roll < 0.3:
+                text = rng.choice(ENGLISH_CLEAN)
+            corpus.append((text, None, None))
+            continue
+        term, how = rng.choice(terms), rng.choice(OBFUSCATIONS)
+        words = text.split()
+        if how == "cyrillic":
+            words = [rng.choice(CYRILLIC_WORDS) for _ in range(rng.choice((0, 0, 3, 8)))]
+        words.insert(rng.randrange(len(words) + 1), obfuscate(term, how, rng))
+        corpus.append((" ".join(words), term, how))
+    return corpus
+
+
+def make_openrouter_replies(size, seed):
+    """LLM replies in the shapes we see in practice: bare JSON, chatty prefix, code fences."""
+    rng = random.Random(seed)
+    replies = []
+    for _ in range(size):
+        verdict = json.dumps({
+            "label": rng.choice(["toxic", "clean"]),
+            "confidence": round(rng.random(), 2),
+            "reason": " ".join(rng.choice(CLEAN_WORDS) for _ in range(rng.randint(2, 10))),
+        })
+        shape = rng.randrange(3)
+        if shape == 1:
+            verdict = f"Sure! Here is my analysis:\n{verdict}\nLet me know if you need more."
+        elif shape == 2:
+            verdict = f"```json\n{verdict}\n```"
+        replies.append(verdict)
+    return replies
+
+
+def make_post_rows(n_posts, comments_per_post, seed):
+    """Rows shaped like the get_posts query result, newest first."""
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    rows = []
+    next_id = 1
+    post_ids = []
+    for _ in range(n_posts):
+        post_ids.append(next_id)
+        rows.append({"id": next_id, "text": " ".join(rng.choices(CLEAN_WORDS, k=12)), "status": "approved",
+                     "created_at": now + timedelta(seconds=next_id), "parent_id": None,
+                     "username": f"user_{rng.randrange(500)}"})
+        next_id += 1
+    for _ in range(n_posts * comments_per_post):
+        rows.append({"id": next_id, "text": " ".join(rng.choices(CLEAN_WORDS, k=6)), "status": "approved",
+                     "created_at": now + timedelta(seconds=next_id), "parent_id": rng.choice(post_ids),
+                     "username": f"user_{rng.randrange(500)}"})
+        next_id += 1
+    rows.sort(key=lambda r: r["created_at"], reverse=True)
+    return rows
+
+
+def make_report_rows(n_reports, seed):
+    """Rows shaped like the /message_reports/pending query result."""
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    return [{
+        "report_id": i, "message_id": 1000 + i, "reporter_id": rng.randrange(500),
+        "reporter_username": f"user_{rng.randrange(500)}", "reported_user_id": rng.randrange(500),
+        "reported_username": f"user_{rng.randrange(500)}",
+        "message_text": " ".join(rng.choices(CLEAN_WORDS + TOXIC_WORDS, k=10)),
+        "message_label_scores": {"toxic": round(rng.random(), 4), "insult": round(rng.random(), 4)},
+        "reason": rng.choice(["spam", "harassment", "hate_speech"]), "description": None, "status": "pending",
+        "created_at": now + timedelta(seconds=i), "reviewed_by": None, "reviewed_at": None, "version": 1,
+    } for i in range(1, n_reports + 1)]
+
+
+def make_user_rows(n_users, seed):
+    """Rows shaped like the admin /get_users query result."""
+    rng = random.Random(seed)
+    now = datetime(2024, 1, 1)
+    return [{"id": i, "username": f"user_{i:05d}", "email": f"user_{i:05d}@example.com",
+             "created_at": now + timedelta(minutes=i), "post_count": rng.randrange(50),
+             "flag_count": rng.randrange(3)} for i in range(1, n_users + 1)]
+
+
+# --- Timing ---
+def measure(fn, items=1, repeats=5):
+    """Median/min/mean/stdev per item in microseconds, using timeit's auto-calibrated loop count."""
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    runs = [t / loops / items * 1e6 for t in timer.repeat(repeat=repeats, number=loops)]
+    median = statistics.median(runs)
+    return {
+        "unit": "us/item",
+        "median": round(median, 4),
+        "min": round(min(runs), 4),
+        "mean": round(statistics.fmean(runs), 4),
+        "stdev": round(statistics.stdev(runs), 4) if len(runs) > 1 else 0.0,
+        "items_per_s": round(1e6 / median, 1) if median > 0 else None,
+        "items": items,
+        "loops": loops,
+    }
+
+
+# --- Cases ---
+def pure_cases(app, args):
+    """Cases that need no database. Each entry is name -> (fn, items per call)."""
+    import classifier
+
+    corpus = make_corpus(args.corpus_size, args.seed, hindi_abusive=classifier.HINDI_ABUSIVE)
+    cases = {"keyword_stage": (lambda: [classifier.find_hindi_abusive(t) for t in corpus], len(corpus))}
+    scripts = make_script_corpus(corpus, args.seed)
+    cases["script_detect"] = (lambda: [classifier.detect_script(t) for t in scripts], len(scripts))
+    obfuscated = [text for text, _, _ in make_obfuscated_corpus(args.corpus_size, args.seed, classifier.HINDI_ABUSIVE)]
+    cases["canonicalize"] = (lambda: [classifier.canonicalize(t) for t in obfuscated], len(obfuscated))
+    # what classify_settled runs before any model: canonicalize, route, lexicon
+    cases["keyword_stage_obfuscated"] = (lambda: [lexicon_stage(classifier, t) for t in obfuscated], len(obfuscated))
+
+    classifier.ensure_model_loaded()
+    if classifier.vectorizer is not None and classifier.model is not None:
+        vect, model = classifier.vectorizer, classifier.model
+        single = corpus[: min(len(corpus), 200)]
+        single_rows = [vect.transform([t]) for t in single]
+        batch_matrix = vect.transform(corpus)
+        cases["tfidf_transform_single"] = (lambda: [vect.transform([t]) for t in single], len(single))
+        cases["tfidf_transform_batch"] = (lambda: vect.transform(corpus), len(corpus))
+        cases["predict_proba_single"] = (lambda: [model.predict_proba(x) for x in single_rows], len(single_rows))
+        cases["predict_proba_batch"] = (lambda: model.predict_proba(batch_matrix), len(corpus))
+        # binary probability plus every label head from one transform + one product
+        cases["score_text_fused"] = (lambda: [classifier.score_text(t) for t in single], len(single))
+        # the classifier service's batches: the same for CLASSIFIER_MAX_BATCH texts at a time
+        batches = [single[i:i + 32] for i in range(0, len(single), 32)]
+        cases["score_texts_batch32"] = (lambda: [classifier.score_texts(b) for b in batches], len(single))
+
+    replies = make_openrouter_replies(args.corpus_size, args.seed)
+    cases["openrouter_parse"] = (lambda: [classifier.parse_openrouter_content(r) for r in replies], len(replies))
+
+    rows = make_post_rows(args.posts, args.comments_per_post, args.seed)
+    cases["get_posts_tree"] = (lambda: app.build_post_tree(rows), len(rows))
+    cases.update(response_cases(app, args, rows))
+    return cases
+
+
+def lexicon_stage(classifier, text):
+    """The term classify_settled's keyword step blocks text on, or None (on to the models / LLM)."""
+    canonical = classifier.canonicalize(text)
+    found = classifier.find_abusive(text, classifier.detect_script(text, canonical), canonical)
+    return found[1] if found else None
+
+
+def obfuscation_report(args):
+    """
+    Obfuscated abusive terms caught by the keyword step with and without
+    canonicalize; every one missed is escalated to the LLM (normal route).
+    Also the keyword step's false positives on the clean messages and on each
+    HINGLISH_CLEAN / ENGLISH_CLEAN sentence as typed, and how many verdict
+    cache keys lightly disguised repeats of the same texts need.
+    """
+    import classifier
+
+    def raw_match(text):  # the keyword step before canonicalize: substring of the lower-cased text
+        lower = text.lower()
+        return next((word for word in classifier.HINDI_ABUSIVE if word in lower), None)
+
+    corpus = make_obfuscated_corpus(args.corpus_size, args.seed, classifier.HINDI_ABUSIVE)
+    abusive = [(text, how) for text, term, how in corpus if term is not None]
+    clean = [text for text, term, _ in corpus if term is None]
+    report = {"messages": len(corpus), "obfuscated_abusive": len(abusive)}
+    for name, match in (("raw", raw_match), ("canonical", lambda t: lexicon_stage(classifier, t))):
+        caught = {}
+        for text, how in abusive:
+            caught[how] = caught.get(how, 0) + (match(text) is not None)
+        report[name] = {
+            "caught": sum(caught.values()),
+            "llm_escalations": len(abusive) - sum(caught.values()),
+            "caught_by_obfuscation": {how: f"{caught.get(how, 0)}/{sum(h == how for _, h in abusive)}"
+                                      for how in OBFUSCATIONS},
+            "clean_false_positives": sum(match(t) is not None for t in clean),
+            "hinglish_false_positives": sorted(t for t in HINGLISH_CLEAN if match(t) is not None),
+            "english_false_positives": sorted(t for t in ENGLISH_CLEAN if match(t) is not None),
+        }
+
+    rng = random.Random(args.seed)
+    base = make_corpus(min(args.corpus_size, 500), args.seed)
+    repeats = [" ".join(obfuscate(word, rng.choice(("upper", "stretch", "zero_width")), rng)
+                        if rng.random() < 0.3 else word for word in text.split())
+               for text in base for _ in range(4)]
+    report["cache_keys"] = {
+        "texts": len(repeats),
+        "raw": len(set(repeats)),
+        "canonical": len({classifier.canonicalize(t) for t in repeats}),
+    }
+    return report
+
+
+def response_payloads(app, args, post_rows):
+    """endpoint -> (response_model type, content) for the list endpoints."""
+    from typing import List
+
+    return {
+        "posts": (List[dict], app.build_post_tree(post_rows)),
+        "reports": (List[app.MessageReportItem], make_report_rows(app.MAX_REVIEW_PAGE, args.seed)),
+        "users": (List[app.UserSummary], make_user_rows(args.users, args.seed)),
+    }
+
+
+def response_cases(app, args, post_rows):
+    """
+    Per list endpoint: FastAPI's generic path (validate against response_model,
+    encode, json.dumps) vs fast_response.dumps straight from the rows, and the
+    cost of compressing the body.
+    """
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+
+    import fast_response
+
+    cases = {}
+    for endpoint, (model, content) in response_payloads(app, args, post_rows).items():
+        adapter = TypeAdapter(model)
+
+        def generic(adapter=adapter, content=content):
+            return JSONResponse(adapter.dump_python(adapter.validate_python(content), mode="json")).body
+
+        body = fast_response.dumps(content)
+        cases[f"json_{endpoint}_fastapi"] = (generic, len(content))
+        cases[f"json_{endpoint}_fast"] = (lambda content=content: fast_response.dumps(content), len(content))
+        cases[f"gzip_{endpoint}"] = (lambda body=body: fast_response._Compressor("gzip").finish(body), len(content))
+        if fast_response.brotli is not None:
+            cases[f"br_{endpoint}"] = (lambda body=body: fast_response._Compressor("br").finish(body), len(content))
+    return cases
+
+
+def payload_sizes(app, args):
+    """Body bytes per list endpoint: identity, gzip and (if installed) brotli."""
+    import fast_response
+
+    sizes = {}
+    rows = make_post_rows(args.posts, args.comments_per_post, args.seed)
+    for endpoint, (_, content) in response_payloads(app, args, rows).items():
+        body = fast_response.dumps(content)
+        sizes[endpoint] = {"identity": len(body), "gzip": len(fast_response._Compressor("gzip").finish(body))}
+        if fast_response.brotli is not None:
+            sizes[endpoint]["br"] = len(fast_response._Compressor("br").finish(body))
+    return sizes
+
+
+def seed_database(db, n_users, n_messages, seed, n_posts=0):
+    """
+    Insert mb_* users, chat history, posts / comments and presence rows once;
+    re-running with the same sizes is a no-op. Also used by index_advisor.py.
+    """
+    from psycopg2.extras import execute_values
+
+    rng = random.Random(seed)
+    usernames = [f"mb_user_{i:05d}" for i in range(n_users)]
+    start = datetime(2024, 1, 1)
+    cursor = db.cursor()
+    try:
+        execute_values(
+            cursor,
+            "INSERT INTO users (username, email, password) VALUES %s ON CONFLICT DO NOTHING",
+            [(u, f"{u}@bench.local", "x") for u in usernames],
+        )
+        cursor.execute("SELECT id FROM users WHERE username LIKE 'mb\\_user\\_%%' ORDER BY username")
+        ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT COUNT(*) FROM chat_messages WHERE sender_id = ANY(%s)", (ids,))
+        existing = cursor.fetchone()[0]
+        if existing < n_messages:
+            rows = []
+            for i in range(n_messages - existing):
+                sender, receiver = rng.sample(ids, 2)
+                if sender != ids[0] and rng.random() < 0.2:
+                    receiver = ids[0]  # one popular account, like the Dana bot, gets a fifth of all messages
+                text = " ".join(rng.choices(CLEAN_WORDS, k=rng.randint(3, 15)))
+                rows.append((sender, receiver, text, "approved", start + timedelta(seconds=i * 7)))
+            execute_values(
+                cursor,
+                "INSERT INTO chat_messages (sender_id, receiver_id, text, status, created_at) VALUES %s",
+                rows, page_size=5000,
+            )
+        cursor.execute("SELECT COUNT(*) FROM posts WHERE user_id = ANY(%s)", (ids,))
+        existing = cursor.fetchone()[0]
+        if existing < n_posts:
+            # top-level posts first, then comments on them; ~5% pending, ~1% blocked
+            statuses = ["approved"] * 94 + ["pending"] * 5 + ["blocked"]
+            todo = n_posts - existing
+            top_level = max(1, todo // 3)
+            rows = [
+                (rng.choice(ids), " ".join(rng.choices(CLEAN_WORDS, k=rng.randint(3, 25))),
+                 rng.choice(statuses), start + timedelta(seconds=i * 31))
+                for i in range(top_level)
+            ]
+            post_ids = [r[0] for r in execute_values(
+                cursor,
+                "INSERT INTO posts (user_id, text, status, created_at) VALUES %s RETURNING id",
+                rows, page_size=5000, fetch=True,
+            )]
+            rows = [
+                (rng.choice(ids), " ".join(rng.choices(CLEAN_WORDS, k=rng.randint(2, 12))),
+                 rng.choice(statuses), rng.choice(post_ids), start + timedelta(seconds=i * 11 + 5))
+                for i in range(todo - top_level)
+            ]
+            execute_values(
+                cursor,
+                "INSERT INTO posts (user_id, text, status, parent_id, created_at) VALUES %s",
+                rows, page_size=5000,
+            )
+        execute_values(
+            cursor,
+            "INSERT INTO user_presence (user_id, last_seen) VALUES %s ON CONFLICT (user_id) DO NOTHING",
+            [(user_id, start + timedelta(minutes=rng.randint(0, 60 * 24 * 30))) for user_id in ids],
+            page_size=5000,
+        )
+        for table in ("users", "chat_messages", "posts", "user_presence"):
+            cursor.execute(f"ANALYZE {table}")
+        db.commit()
+    finally:
+        cursor.close()
+    return usernames
+
+
+def db_cases(app, args):
+    db = app.get_db_connection()
+    usernames = seed_database(db, args.db_users, args.db_messages, args.seed, args.db_posts)
+    rng = random.Random(args.seed)
+    lookups = [rng.choice(usernames) for _ in range(200)]
+    pairs = [tuple(rng.sample(usernames, 2)) for _ in range(100)]
+
+    def posts_query():
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute(
+                "SELECT p.id, p.text, p.status, p.created_at, p.parent_id, u.username "
+                "FROM posts p JOIN users u ON p.user_id = u.id ORDER BY p.created_at DESC"
+            )
+            return app.build_post_tree(cursor.fetchall())
+        finally:
+            app.safe_close_cursor(cursor)
+
+    cases = {
+        "db_get_user_id": (lambda: [app.get_user_id(u, db) for u in lookups], len(lookups)),
+        "db_get_feed_internal": (lambda: [app.get_feed_internal(a, db, b) for a, b in pairs], len(pairs)),
+        "db_get_posts": (posts_query, 1),
+    }
+    cases.update(statement_cases(app, db, usernames, args.seed))
+    return cases, db
+
+
+# The registered hot statements, each run ad hoc (parsed and planned per call)
+# and through its prepared statement, with the same parameters.
+STATEMENT_CASES = ("user_id", "feed", "notifications", "inbox", "presence")
+
+
+def statement_cases(app, db, usernames, seed):
+    rng = random.Random(seed)
+    cursor = db.cursor()
+    cursor.execute("SELECT username, id FROM users WHERE username = ANY(%s)", (usernames,))
+    ids = dict(cursor.fetchall())
+    cursor.close()
+    db.rollback()
+    sample = [rng.choice(usernames) for _ in range(200)]
+    pairs = [rng.sample(usernames, 2) for _ in range(100)]
+    params = {
+        "user_id": (app.USER_ID_SQL, [{"username": u} for u in sample]),
+        "feed": (app.FEED_SQL, [{"user_id": ids[a], "other_id": ids[b]} for a, b in pairs]),
+        "notifications": (app.NOTIFICATIONS_SQL, [
+            {"user_id": ids[u], "since": None, "lookback": app.NOTIFICATION_LOOKBACK_HOURS} for u in sample[:100]
+        ]),
+        "inbox": (app.INBOX_SQL, [{"user_id": ids[u], "limit": 50} for u in sample[:100]]),
+        "presence": (app.PRESENCE_SQL, [{"user_id": ids[u]} for u in sample]),
+    }
+
+    def run_statements(name, prepared):
+        sql, batch = params[name]
+        cursor = db.cursor()
+        try:
+            for vars in batch:
+                if prepared:
+                    cursor.execute_prepared(name, vars)
+                else:
+                    cursor.execute(sql, vars)
+                if cursor.description is not None:
+                    cursor.fetchall()
+        finally:
+            app.safe_close_cursor(cursor)
+            db.rollback()  # presence writes are not kept
+
+    cases = {}
+    for name in STATEMENT_CASES:
+        items = len(params[name][1])
+        cases[f"db_adhoc_{name}"] = (lambda name=name: run_statements(name, False), items)
+        cases[f"db_prepared_{name}"] = (lambda name=name: run_statements(name, True), items)
+    return cases
+
+
+# --- Results ---
+def git_commit():
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=BASE_DIR, text=True).strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+
+def resolve_results(ref):
+    """
+    Accept a results file path or any git commit-ish that has a stored result,
+    falling back to the commit's -dirty result when there is no clean one.
+    """
+    if os.path.exists(ref):
+        return ref
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", ref], cwd=BASE_DIR, text=True,
+                                      stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        raise SystemExit(f"{ref} is neither a results file nor a git commit")
+    path = os.path.join(RESULTS_DIR, f"{sha}.json")
+    if os.path.exists(path):
+        return path
+    # run() names results from a tree with uncommitted changes <sha>-dirty.json
+    dirty = os.path.join(RESULTS_DIR, f"{sha}-dirty.json")
+    if os.path.exists(dirty):
+        print(f"{ref}: no clean result for {sha[:12]}, using {os.path.basename(dirty)} (uncommitted changes)")
+        return dirty
+    raise SystemExit(f"No stored results for {ref} ({sha[:12]}); check it out and run `microbench.py run`")
+
+
+def run(args):
+    if args.db_url:
+        os.environ["DATABASE_URL"] = args.db_url
+        os.environ.setdefault("DB_SSLMODE", "disable")
+        os.environ.setdefault("SCHEMA_AUTO_MIGRATE", "1")  # a fresh bench database needs the tables
+    sys.path.insert(0, BASE_DIR)
+    os.chdir(BASE_DIR)
+    import app
+
+    cases = pure_cases(app, args)
+    skipped = {}
+    db = None
+    advisor = None
+    if args.db_url:
+        extra, db = db_cases(app, args)
+        cases.update(extra)
+    else:
+        names = ["db_get_user_id", "db_get_feed_internal", "db_get_posts"]
+        names += [f"db_{kind}_{name}" for name in STATEMENT_CASES for kind in ("adhoc", "prepared")]
+        skipped.update({name: "no --db-url" for name in names})
+
+    selected = set(args.only.split(",")) if args.only else None
+    results = {}
+    try:
+        for name, (fn, items) in cases.items():
+            if selected and name not in selected:
+                continue
+            results[name] = measure(fn, items, args.repeats)
+            r = results[name]
+            print(f"{name:<26} {r['median']:>12.3f} us/item  (min {r['min']:.3f}, stdev {r['stdev']:.3f}, "
+                  f"{r['items_per_s']:,.0f} items/s)")
+        if db is not None and not args.no_index_advisor:
+            from index_advisor import run_advisor
+
+            print("\nIndex advisor:")
+            advisor, _ = run_advisor(app, db, args.row_threshold)
+    finally:
+        if db is not None:
+            db.close()
+
+    obfuscation = obfuscation_report(args)
+    print(f"\nObfuscated abusive terms ({obfuscation['obfuscated_abusive']} of {obfuscation['messages']} messages):")
+    for name in ("raw", "canonical"):
+        r = obfuscation[name]
+        print(f"  {name:<10} caught {r['caught']:>6,}  LLM escalations {r['llm_escalations']:>6,}  "
+              f"clean false positives {r['clean_false_positives']:,}  "
+              f"Hinglish false positives {len(r['hinglish_false_positives'])}/{len(HINGLISH_CLEAN)}  "
+              f"English false positives {len(r['english_false_positives'])}/{len(ENGLISH_CLEAN)}")
+        print("    caught by obfuscation: " + ", ".join(f"{how} {n}" for how, n in r["caught_by_obfuscation"].items()))
+        for text in r["hinglish_false_positives"] + r["english_false_positives"]:
+            print(f"    {text!r}")
+    keys = obfuscation["cache_keys"]
+    print(f"  verdict cache keys for {keys['texts']:,} texts: raw {keys['raw']:,}, canonical {keys['canonical']:,}")
+
+    sizes = payload_sizes(app, args)
+    print("\nResponse bytes (identity / compressed):")
+    for endpoint, by_encoding in sizes.items():
+        ratios = ", ".join(f"{enc} {n:,} ({n / by_encoding['identity']:.0%})"
+                           for enc, n in by_encoding.items() if enc != "identity")
+        print(f"  {endpoint:<10} {by_encoding['identity']:>10,}  {ratios}")
+
+    sha, dirty = git_commit()
+    payload = {
+        "version": RESULTS_VERSION,
+        "commit": sha,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "seed": args.seed, "corpus_size": args.corpus_size, "posts": args.posts,
+            "comments_per_post": args.comments_per_post, "users": args.users, "db_users": args.db_users,
+            "db_messages": args.db_messages, "db_posts": args.db_posts, "repeats": args.repeats,
+        },
+        "cases": results,
+        "skipped": skipped,
+        "payload_bytes": sizes,
+        "obfuscation": obfuscation,
+    }
+    if advisor is not None:
+        payload["index_advisor"] = advisor
+    output = args.output
+    if output is None:
+        name = f"{sha}{'-dirty' if dirty else ''}" if sha else datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"\nWrote {output}")
+
+
+def compare(args):
+    with open(resolve_results(args.base)) as f:
+        base = json.load(f)
+    with open(resolve_results(args.head)) as f:
+        head = json.load(f)
+    if base.get("params") != head.get("params"):
+        print("WARNING: runs used different parameters; comparisons may be meaningless")
+
+    print(f"{'case':<26} {'base us':>12} {'head us':>12} {'change':>9}")
+    regressions = []
+    for name in sorted(set(base["cases"]) | set(head["cases"])):
+        b, h = base["cases"].get(name), head["cases"].get(name)
+        if b is None or h is None:
+            print(f"{name:<26} {'-' if b is None else format(b['median'], '12.3f'):>12} "
+                  f"{'-' if h is None else format(h['median'], '12.3f'):>12}")
+            continue
+        change = (h["median"] - b["median"]) / b["median"] if b["median"] else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -args.threshold:
+            flag = "  faster"
+        print(f"{name:<26} {b['median']:>12.3f} {h['median']:>12.3f} {change:>+8.1%}{flag}")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SafeChat microbenchmarks")
+    sub = parser.add_subparsers(dest="command")
+
+    run_p = sub.add_parser("run", help="run the benchmarks and store a JSON result")
+    run_p.add_argument("--seed", type=int, default=1234)
+    run_p.add_argument("--corpus-size", type=int, default=2000)
+    run_p.add_argument("--posts", type=int, default=500)
+    run_p.add_argument("--comments-per-post", type=int, default=4)
+    run_p.add_argument("--users", type=int, default=1000, help="rows in the synthetic /get_users payload")
+    run_p.add_argument("--db-url", help="local Postgres DSN for the DB-backed cases")
+    run_p.add_argument("--db-users", type=int, default=1000)
+    run_p.add_argument("--db-messages", type=int, default=100000)
+    run_p.add_argument("--db-posts", type=int, default=20000)
+    run_p.add_argument("--repeats", type=int, default=5)
+    run_p.add_argument("--row-threshold", type=int, default=1000,
+                       help="index advisor: flag seq scans / sorts over this many rows")
+    run_p.add_argument("--no-index-advisor", action="store_true", help="skip EXPLAINing the hot queries")
+    run_p.add_argument("--only", help="comma-separated case names")
+    run_p.add_argument("--output", help="result path (default benchmarks/results/<commit>.json)")
+
+    cmp_p = sub.add_parser("compare", help="diff two stored results")
+    cmp_p.add_argument("base", help="results file or git commit-ish")
+    cmp_p.add_argument("head", help="results file or git commit-ish")
+    cmp_p.add_argument("--threshold", type=float, default=0.10, help="relative change treated as significant")
+    cmp_p.add_argument("--fail-on-regression", action="store_true")
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(["run"] + sys.argv[1:])
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == "compare":
+        compare(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
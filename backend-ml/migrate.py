@@ -0,0 +1,261 @@
+# migrate.py
+"""
+Versioned schema migrations.
+
+Migrations are the numbered files in migrations/ (0001_baseline.sql, ...),
+applied in order, each in its own transaction, and recorded in schema_version
+with a checksum. A session-level advisory lock serialises concurrent runners
+(several pods / workers starting at once), so each migration runs exactly once.
+
+A file whose first line is `-- migrate: no-transaction` runs outside a
+transaction, one `;`-terminated statement at a time — needed for
+CREATE INDEX CONCURRENTLY. Keep such files idempotent (IF NOT EXISTS): if one
+fails halfway, the statements before the failure stay applied.
+
+Usage:
+    python migrate.py              # apply pending migrations
+    python migrate.py status       # show applied / pending
+    python migrate.py up --target 3 --dry-run
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+from psycopg2 import Error as DatabaseError
+
+from database import get_db_connection
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATIONS_DIR = os.path.join(BASE_DIR, "migrations")
+MIGRATION_LOCK_KEY = 4231771903  # pg_advisory_lock key shared by every runner
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+_FILENAME_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            self.sql = f.read()
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.transactional = not self.sql.lstrip().startswith(NO_TRANSACTION_MARKER)
+
+    def statements(self):
+        # only used for no-transaction files, which hold plain DDL statements
+        return [s.strip() for s in re.split(r";\s*\n", self.sql + "\n") if s.strip()
+                and not all(line.strip().startswith("--") for line in s.strip().splitlines())]
+
+
+def discover(directory=MIGRATIONS_DIR):
+    migrations = []
+    seen = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".sql"):
+            continue
+        match = _FILENAME_RE.match(filename)
+        if not match:
+            raise ValueError(f"Bad migration file name {filename!r} (expected NNNN_name.sql)")
+        version = int(match.group(1))
+        if version in seen:
+            raise ValueError(f"Migrations {seen[version]} and {filename} share version {version}")
+        seen[version] = filename
+        migrations.append(Migration(version, match.group(2), os.path.join(directory, filename)))
+    return migrations
+
+
+def latest_version():
+    migrations = discover()
+    return migrations[-1].version if migrations else 0
+
+
+def _ensure_version_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _applied(cursor):
+    cursor.execute("SELECT version, name, checksum, applied_at FROM schema_version ORDER BY version")
+    return {row[0]: row for row in cursor.fetchall()}
+
+
+def current_version(db):
+    """Highest applied version; 0 when schema_version does not exist yet."""
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+
+def _apply(db, migration):
+    cursor = db.cursor()
+    try:
+        if migration.transactional:
+            cursor.execute(migration.sql)
+        else:
+            db.set_autocommit(True)
+            try:
+                for statement in migration.statements():
+                    cursor.execute(statement)
+            finally:
+                db.set_autocommit(False)
+        cursor.execute(
+            "INSERT INTO schema_version (version, name, checksum) VALUES (%s, %s, %s)",
+            (migration.version, migration.name, migration.checksum),
+        )
+        db.commit()
+    except DatabaseError:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def migrate(target=None, dry_run=False, db=None):
+    """Apply pending migrations up to target (default: all). Returns the versions applied."""
+    migrations = discover()
+    own_connection = db is None
+    if own_connection:
+        db = get_db_connection()
+        if db is None:
+            raise RuntimeError("Database connection failed")
+
+    applied_now = []
+    cursor = db.cursor()
+    try:
+        db.set_autocommit(True)
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            print("Another migration runner holds the lock; waiting...")
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        db.set_autocommit(False)
+        try:
+            _ensure_version_table(cursor)
+            applied = _applied(cursor)
+            db.commit()
+
+            for migration in migrations:
+                row = applied.get(migration.version)
+                if row is not None:
+                    if row[2].strip() != migration.checksum:
+                        print(f"Warning: {migration.version:04d}_{migration.name} changed after it was applied")
+                    continue
+                if target is not None and migration.version > target:
+                    break
+                if dry_run:
+                    print(f"Would apply {migration.version:04d}_{migration.name}")
+                    applied_now.append(migration.version)
+                    continue
+                print(f"Applying {migration.version:04d}_{migration.name}...")
+                _apply(db, migration)
+                applied_now.append(migration.version)
+        finally:
+            db.rollback()
+            db.set_autocommit(True)
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            db.set_autocommit(False)
+    finally:
+        cursor.close()
+        if own_connection:
+            try:
+                db.close()
+            except Exception:
+                pass
+    return applied_now
+
+
+def status():
+    db = get_db_connection()
+    if db is None:
+        raise RuntimeError("Database connection failed")
+    cursor = db.cursor()
+    try:
+        cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+        applied = _applied(cursor) if cursor.fetchone()[0] else {}
+    finally:
+        cursor.close()
+        db.close()
+
+    for migration in discover():
+        row = applied.get(migration.version)
+        if row is None:
+            state = "pending"
+        elif row[2].strip() != migration.checksum:
+            state = f"applied {row[3]:%Y-%m-%d %H:%M} (file changed since)"
+        else:
+            state = f"applied {row[3]:%Y-%m-%d %H:%M}"
+        print(f"{migration.version:04d}_{migration.name:40s} {state}")
+
+
+def check_schema_version(auto_migrate=False):
+    """
+    Cheap startup check (one connection, no DDL): warn when the database is
+    behind the migrations shipped with this code, or apply them when asked.
+    """
+    expected = latest_version()
+    db = get_db_connection()
+    if db is None:
+        print("Could not connect to DB to check the schema version.")
+        return None
+    try:
+        current = current_version(db)
+        if current < expected and auto_migrate:
+            db.rollback()
+            migrate(db=db)
+            current = current_version(db)
+    except DatabaseError as e:
+        print(f"Error checking schema version: {e}")
+        return None
+    finally:
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    if current < expected:
+        print(f"Database schema is at version {current}, this build expects {expected}: run `python migrate.py`.")
+    elif current > expected:
+        print(f"Database schema version {current} is newer than this build ({expected}).")
+    return current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply SafeChat schema migrations.")
+    sub = parser.add_subparsers(dest="command")
+    up = sub.add_parser("up", help="apply pending migrations (default)")
+    up.add_argument("--target", type=int, help="stop after this version")
+    up.add_argument("--dry-run", action="store_true", help="list what would be applied")
+    sub.add_parser("status", help="list applied and pending migrations")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "status":
+            status()
+            return 0
+        applied = migrate(getattr(args, "target", None), getattr(args, "dry_run", False))
+    except (DatabaseError, RuntimeError, ValueError) as e:
+        print(f"Migration failed: {e}")
+        return 1
+    if not applied:
+        print("Schema is up to date.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+-- Baseline: the schema app.py's create_tables() used to build at import time.
+-- Everything is IF NOT EXISTS so databases created by create_tables() adopt it as-is.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(255) UNIQUE NOT NULL,
+    email VARCHAR(255) UNIQUE NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'approved' CHECK (status IN ('approved', 'pending', 'blocked')),
+    parent_id INT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (parent_id) REFERENCES posts(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS user_profiles (
+    id SERIAL PRIMARY KEY,
+    user_id INT NOT NULL UNIQUE,
+    bio TEXT,
+    profile_image_url VARCHAR(255),
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id SERIAL PRIMARY KEY,
+    sender_id INT NOT NULL,
+    receiver_id INT NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'approved' CHECK (status IN ('approved', 'pending')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS message_reports (
+    id SERIAL PRIMARY KEY,
+    message_id INT NOT NULL,
+    reporter_id INT NOT NULL,
+    reported_user_id INT NOT NULL,
+    reason VARCHAR(50) NOT NULL,
+    description TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'resolved', 'dismissed')),
+    reviewed_by INT NULL,
+    reviewed_at TIMESTAMP NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (message_id, reporter_id),
+    FOREIGN KEY (message_id) REFERENCES chat_messages(id) ON DELETE CASCADE,
+    FOREIGN KEY (reporter_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (reported_user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (reviewed_by) REFERENCES users(id) ON DELETE SET NULL
+);
+
+CREATE TABLE IF NOT EXISTS chat_typing_status (
+    id SERIAL PRIMARY KEY,
+    sender_id INT NOT NULL,
+    receiver_id INT NOT NULL,
+    is_typing BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (sender_id, receiver_id),
+    FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS user_presence (
+    user_id INT PRIMARY KEY,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Per-user trust / abuse scores, flushed from memory by trust.py
+CREATE TABLE IF NOT EXISTS user_trust_scores (
+    user_id INT PRIMARY KEY,
+    abuse_score DOUBLE PRECISION NOT NULL DEFAULT 0,
+    abuse_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    first_seen TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    clean_events INT NOT NULL DEFAULT 0,
+    blocked_sends INT NOT NULL DEFAULT 0,
+    pending_posts INT NOT NULL DEFAULT 0,
+    reports_resolved INT NOT NULL DEFAULT 0,
+    reports_dismissed INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Per-label toxicity scores from classify_text (severity signal for moderators)
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS label_scores JSONB;
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS label_scores JSONB;
+
+CREATE INDEX IF NOT EXISTS idx_message_reports_reporter ON message_reports(reporter_id);
+CREATE INDEX IF NOT EXISTS idx_message_reports_reported ON message_reports(reported_user_id);
+CREATE INDEX IF NOT EXISTS idx_message_reports_status ON message_reports(status);
+
+-- Optimistic concurrency for moderator actions, and the report a duplicate was collapsed into
+ALTER TABLE message_reports ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 1;
+ALTER TABLE message_reports ADD COLUMN IF NOT EXISTS collapsed_into INT NULL
+    REFERENCES message_reports(id) ON DELETE SET NULL;
+
+-- Review queue claims (moderator username + lease expiry) and queue-order partial indexes
+ALTER TABLE message_reports ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255);
+ALTER TABLE message_reports ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMP;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255);
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_message_reports_pending_queue
+    ON message_reports(created_at, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_posts_pending_queue
+    ON posts(created_at, id) WHERE status = 'pending';
+
+CREATE OR REPLACE VIEW v_pending_reports AS
+SELECT
+    r.id AS report_id,
+    r.message_id,
+    r.reporter_id,
+    reporter.username AS reporter_username,
+    r.reported_user_id,
+    reported.username AS reported_username,
+    m.text AS message_content,
+    r.reason,
+    r.description,
+    r.status,
+    r.created_at
+FROM message_reports r
+JOIN users reporter ON reporter.id = r.reporter_id
+JOIN users reported ON reported.id = r.reported_user_id
+LEFT JOIN chat_messages m ON m.id = r.message_id
+WHERE r.status = 'pending'
+ORDER BY r.created_at DESC;
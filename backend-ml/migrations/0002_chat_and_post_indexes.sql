@@ -0,0 +1,7 @@
+-- Indexes supabase_schema.sql always declared but create_tables() never built:
+-- conversation reads (get_feed_internal, notifications) and the post feed / comment tree.
+
+CREATE INDEX IF NOT EXISTS idx_posts_created_at ON posts(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_posts_parent_id ON posts(parent_id);
+CREATE INDEX IF NOT EXISTS idx_chat_sender_receiver_created ON chat_messages(sender_id, receiver_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_chat_receiver_sender_created ON chat_messages(receiver_id, sender_id, created_at);
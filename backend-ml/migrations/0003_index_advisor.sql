@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- Generated by index_advisor.py: indexes that removed a seq scan or sort
+-- from the plans of the queries below.
+
+-- chat_notifications, chat_notifications_since
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chat_receiver_created ON chat_messages(receiver_id, created_at);
+
+-- user_post_history
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_posts_user_created ON posts(user_id, created_at DESC);
@@ -0,0 +1,125 @@
+-- chat_messages becomes a table range-partitioned by created_at, one partition per
+-- month (chat_messages_YYYY_MM), plus a DEFAULT partition so inserts never fail when
+-- chat_archive.py has not created a month in time. Old months are moved by
+-- chat_archive.py into chat_messages_archive; chat_messages_all spans both for
+-- lookups by id (reports on old messages).
+--
+-- - The primary key becomes (id, created_at): unique keys on a partitioned table must
+--   include the partition key. Ids still come from chat_messages_id_seq.
+-- - message_reports.message_id loses its foreign key (it cannot reference id alone
+--   any more). Deleting a user still cascades to their messages and reports.
+-- - message_reports.message_created_at records the reported message's partition key,
+--   so report -> message joins touch one partition instead of probing every month.
+-- - Rows are copied in this transaction; on a large table run it in a quiet window.
+-- - On Supabase, re-run rls_policies.sql afterwards: policies live on the old table.
+
+DROP VIEW IF EXISTS v_pending_reports;
+
+ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned;
+ALTER TABLE chat_messages_unpartitioned RENAME CONSTRAINT chat_messages_pkey TO chat_messages_unpartitioned_pkey;
+DROP INDEX IF EXISTS idx_chat_sender_receiver_created;
+DROP INDEX IF EXISTS idx_chat_receiver_sender_created;
+DROP INDEX IF EXISTS idx_chat_receiver_created;
+ALTER TABLE message_reports DROP CONSTRAINT IF EXISTS message_reports_message_id_fkey;
+ALTER SEQUENCE chat_messages_id_seq OWNED BY NONE;
+
+CREATE TABLE chat_messages (
+    id INT NOT NULL DEFAULT nextval('chat_messages_id_seq'),
+    sender_id INT NOT NULL,
+    receiver_id INT NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'approved' CHECK (status IN ('approved', 'pending')),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    label_scores JSONB,
+    PRIMARY KEY (id, created_at),
+    FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (receiver_id) REFERENCES users(id) ON DELETE CASCADE
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id;
+
+CREATE TABLE chat_messages_default PARTITION OF chat_messages DEFAULT;
+
+CREATE INDEX idx_chat_sender_receiver_created ON chat_messages(sender_id, receiver_id, created_at);
+CREATE INDEX idx_chat_receiver_sender_created ON chat_messages(receiver_id, sender_id, created_at);
+CREATE INDEX idx_chat_receiver_created ON chat_messages(receiver_id, created_at);
+
+-- Same columns and partition key; holds the months chat_archive.py detached.
+CREATE TABLE chat_messages_archive (
+    id INT NOT NULL,
+    sender_id INT NOT NULL,
+    receiver_id INT NOT NULL,
+    text TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'approved',
+    created_at TIMESTAMP NOT NULL,
+    label_scores JSONB,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Create the monthly partitions from from_month through months_ahead months past the
+-- current one; returns how many were created. Rows that already landed in the DEFAULT
+-- partition for a new month are moved into it.
+CREATE OR REPLACE FUNCTION ensure_chat_partitions(from_month DATE, months_ahead INT DEFAULT 3)
+RETURNS INT LANGUAGE plpgsql AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    partition_name TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'chat_messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE chat_messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                           partition_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM chat_messages_default WHERE created_at >= %L AND created_at < %L RETURNING *)'
+                ' INSERT INTO %I SELECT * FROM moved',
+                month_start, (month_start + INTERVAL '1 month')::date, partition_name);
+            EXECUTE format('ALTER TABLE chat_messages ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, (month_start + INTERVAL '1 month')::date);
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END $$;
+
+SELECT ensure_chat_partitions(
+    COALESCE((SELECT MIN(created_at) FROM chat_messages_unpartitioned), CURRENT_TIMESTAMP)::date, 3);
+
+INSERT INTO chat_messages (id, sender_id, receiver_id, text, status, created_at, label_scores)
+SELECT id, sender_id, receiver_id, text, status, COALESCE(created_at, CURRENT_TIMESTAMP), label_scores
+FROM chat_messages_unpartitioned;
+
+ALTER TABLE message_reports ADD COLUMN IF NOT EXISTS message_created_at TIMESTAMP;
+UPDATE message_reports r SET message_created_at = m.created_at
+FROM chat_messages m
+WHERE m.id = r.message_id AND r.message_created_at IS NULL;
+
+DROP TABLE chat_messages_unpartitioned;
+ANALYZE chat_messages;
+
+CREATE VIEW chat_messages_all AS
+SELECT id, sender_id, receiver_id, text, status, created_at, label_scores FROM chat_messages
+UNION ALL
+SELECT id, sender_id, receiver_id, text, status, created_at, label_scores FROM chat_messages_archive;
+
+CREATE OR REPLACE VIEW v_pending_reports AS
+SELECT
+    r.id AS report_id,
+    r.message_id,
+    r.reporter_id,
+    reporter.username AS reporter_username,
+    r.reported_user_id,
+    reported.username AS reported_username,
+    m.text AS message_content,
+    r.reason,
+    r.description,
+    r.status,
+    r.created_at
+FROM message_reports r
+JOIN users reporter ON reporter.id = r.reporter_id
+JOIN users reported ON reported.id = r.reported_user_id
+LEFT JOIN chat_messages_all m ON m.id = r.message_id AND m.created_at = r.message_created_at
+WHERE r.status = 'pending'
+ORDER BY r.created_at DESC;
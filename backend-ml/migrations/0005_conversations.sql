@@ -0,0 +1,32 @@
+-- One row per user pair (user_low < user_high) summarising the conversation for
+-- the inbox: last message, a preview, last activity and an unread counter per side.
+-- send_message updates it in the same statement that inserts the message.
+
+CREATE TABLE IF NOT EXISTS conversations (
+    user_low INT NOT NULL,
+    user_high INT NOT NULL,
+    last_message_id INT NOT NULL,
+    last_sender_id INT NOT NULL,
+    last_preview TEXT NOT NULL,
+    last_activity TIMESTAMP NOT NULL,
+    unread_low INT NOT NULL DEFAULT 0,   -- messages user_low has not read
+    unread_high INT NOT NULL DEFAULT 0,  -- messages user_high has not read
+    PRIMARY KEY (user_low, user_high),
+    CHECK (user_low < user_high),
+    FOREIGN KEY (user_low) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_high) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- The inbox reads each side newest-first
+CREATE INDEX IF NOT EXISTS idx_conversations_low_activity ON conversations(user_low, last_activity DESC);
+CREATE INDEX IF NOT EXISTS idx_conversations_high_activity ON conversations(user_high, last_activity DESC);
+
+-- Backfill from existing history (archived months included); it all counts as read.
+INSERT INTO conversations (user_low, user_high, last_message_id, last_sender_id, last_preview, last_activity)
+SELECT DISTINCT ON (LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id))
+       LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id),
+       id, sender_id, left(text, 120), created_at
+FROM chat_messages_all
+WHERE sender_id <> receiver_id
+ORDER BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id), created_at DESC, id DESC
+ON CONFLICT (user_low, user_high) DO NOTHING;
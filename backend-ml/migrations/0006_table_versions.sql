@@ -0,0 +1,41 @@
+-- Change counters for the polled endpoints' ETags (response_cache.py). A statement-level
+-- trigger bumps a table's row once per INSERT/UPDATE/DELETE statement, so an
+-- unchanged version means an unchanged result and the endpoint can answer 304
+-- without running its query. The bump commits with the change it counts.
+--
+-- chat_messages only counts UPDATE/DELETE (status changes, cascaded deletes): new
+-- messages are already visible in conversations.last_message_id per pair, and
+-- counting every send would invalidate every open feed at once.
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO table_versions (table_name)
+VALUES ('posts'), ('message_reports'), ('chat_messages')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS trg_posts_version ON posts;
+CREATE TRIGGER trg_posts_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON posts
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS trg_message_reports_version ON message_reports;
+CREATE TRIGGER trg_message_reports_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON message_reports
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS trg_chat_messages_version ON chat_messages;
+CREATE TRIGGER trg_chat_messages_version
+AFTER UPDATE OR DELETE OR TRUNCATE ON chat_messages
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
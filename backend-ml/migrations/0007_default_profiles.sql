@@ -0,0 +1,8 @@
+-- signup now creates each user's profile row, and get_profile no longer inserts one
+-- on read. Give every existing user without a row the default profile.
+
+INSERT INTO user_profiles (user_id, bio)
+SELECT u.id, 'Welcome to my SafeChat profile!'
+FROM users u
+WHERE NOT EXISTS (SELECT 1 FROM user_profiles up WHERE up.user_id = u.id)
+ON CONFLICT (user_id) DO NOTHING;
@@ -0,0 +1,79 @@
+-- Spread each table_versions counter over 16 slot rows. With one row per table,
+-- every transaction writing posts or message_reports held that row's lock until
+-- commit, so concurrent writers queued behind each other. The trigger now bumps
+-- the slot picked by its backend (pg_backend_pid() % 16) and readers sum the
+-- slots; the bump still commits with the change it counts, so a version is never
+-- visible before its data. INSERT/UPDATE/DELETE statements that changed no rows
+-- (checked through their transition tables) no longer bump at all.
+
+ALTER TABLE table_versions ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE table_versions DROP CONSTRAINT IF EXISTS table_versions_pkey;
+ALTER TABLE table_versions ADD PRIMARY KEY (table_name, slot);
+
+INSERT INTO table_versions (table_name, slot)
+SELECT t.table_name, s.slot
+FROM (VALUES ('posts'), ('message_reports'), ('chat_messages')) AS t(table_name)
+CROSS JOIN generate_series(0, 15) AS s(slot)
+ON CONFLICT (table_name, slot) DO NOTHING;
+
+-- TRUNCATE has no transition table: always bump
+CREATE OR REPLACE FUNCTION bump_table_version()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE table_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = TG_TABLE_NAME AND slot = pg_backend_pid() % 16;
+    RETURN NULL;
+END $$;
+
+-- INSERT/UPDATE/DELETE: the trigger names its transition table "changed"
+CREATE OR REPLACE FUNCTION bump_table_version_if_changed()
+RETURNS TRIGGER LANGUAGE plpgsql AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM changed) THEN
+        RETURN NULL;
+    END IF;
+    UPDATE table_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE table_name = TG_TABLE_NAME AND slot = pg_backend_pid() % 16;
+    RETURN NULL;
+END $$;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS trg_posts_version ON posts;
+CREATE TRIGGER trg_posts_version_insert
+AFTER INSERT ON posts REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_posts_version_update
+AFTER UPDATE ON posts REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_posts_version_delete
+AFTER DELETE ON posts REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_posts_version_truncate
+AFTER TRUNCATE ON posts
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS trg_message_reports_version ON message_reports;
+CREATE TRIGGER trg_message_reports_version_insert
+AFTER INSERT ON message_reports REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_message_reports_version_update
+AFTER UPDATE ON message_reports REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_message_reports_version_delete
+AFTER DELETE ON message_reports REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_message_reports_version_truncate
+AFTER TRUNCATE ON message_reports
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+-- chat_messages still only counts UPDATE/DELETE (see 0006_table_versions.sql)
+DROP TRIGGER IF EXISTS trg_chat_messages_version ON chat_messages;
+CREATE TRIGGER trg_chat_messages_version_update
+AFTER UPDATE ON chat_messages REFERENCING NEW TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_chat_messages_version_delete
+AFTER DELETE ON chat_messages REFERENCING OLD TABLE AS changed
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version_if_changed();
+CREATE TRIGGER trg_chat_messages_version_truncate
+AFTER TRUNCATE ON chat_messages
+FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,68 @@
+# profile_cache.py
+"""
+In-process cache of profile rows (username, email, bio, profile_image_url),
+keyed by username, for get_profile and the batch /profiles endpoint.
+
+update_profile writes the fresh row through (put) and upload_image drops the
+entry (invalidate), so this worker never serves its own stale profile. Other
+workers learn about the change when their entry expires after
+PROFILE_CACHE_SECONDS, which bounds how long a bio or avatar can lag across
+workers. The cache holds at most PROFILE_CACHE_ENTRIES rows (LRU); 0 turns
+it off.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+PROFILE_CACHE_SECONDS = float(os.getenv("PROFILE_CACHE_SECONDS", "60"))
+PROFILE_CACHE_ENTRIES = int(os.getenv("PROFILE_CACHE_ENTRIES", "10000"))
+
+_entries = OrderedDict()  # username -> (time.monotonic() expiry, row dict)
+_lock = threading.Lock()
+
+
+def get(username):
+    """Cached row for username, or None."""
+    with _lock:
+        entry = _entries.get(username)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _entries[username]
+            return None
+        _entries.move_to_end(username)
+        return dict(entry[1])
+
+
+def get_many(usernames):
+    """({username: row} for the cached ones, [usernames still to load])."""
+    found, missing = {}, []
+    for username in usernames:
+        row = get(username)
+        if row is None:
+            missing.append(username)
+        else:
+            found[username] = row
+    return found, missing
+
+
+def put(username, row):
+    if PROFILE_CACHE_ENTRIES <= 0:
+        return
+    with _lock:
+        _entries[username] = (time.monotonic() + PROFILE_CACHE_SECONDS, dict(row))
+        _entries.move_to_end(username)
+        while len(_entries) > PROFILE_CACHE_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate(username):
+    with _lock:
+        _entries.pop(username, None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
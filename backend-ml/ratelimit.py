@@ -0,0 +1,235 @@
+# ratelimit.py
+"""
+Admission control for the classifier-backed and polling endpoints.
+
+- Token buckets per user and per client IP, with separate budgets for writes
+  (send_message, create_post, reports: each may reach the LLM) and polls
+  (feed, notifications, typing, presence). A request must fit in both of its
+  buckets; otherwise enforce() raises 429 with a Retry-After header.
+- LLM_SLOTS caps concurrent OpenRouter calls. It never blocks: a caller that
+  finds every slot taken is shed to the local model instead of queueing.
+
+Buckets live in process memory by default. With RATE_LIMIT_BACKEND=postgres
+they live in an UNLOGGED table shared by every worker (one upsert per check,
+on a dedicated autocommit connection); if that database is unreachable the
+limiter fails open rather than taking the API down with it.
+"""
+import math
+import os
+import threading
+import time
+
+import psycopg2
+from fastapi import HTTPException
+
+from telemetry import RATE_LIMITED
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Per-IP buckets are this many times larger than per-user ones (NAT, shared Wi-Fi)
+RATE_LIMIT_IP_FACTOR = float(os.getenv("RATE_LIMIT_IP_FACTOR", "4"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Only honour X-Real-IP / X-Forwarded-For behind a proxy that sets them; otherwise clients could pick their IP
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+
+# budget -> (tokens per second, burst capacity)
+BUDGETS = {
+    "write": (float(os.getenv("RATE_LIMIT_WRITE_PER_MIN", "30")) / 60.0,
+              float(os.getenv("RATE_LIMIT_WRITE_BURST", "10"))),
+    "poll": (float(os.getenv("RATE_LIMIT_POLL_PER_MIN", "240")) / 60.0,
+             float(os.getenv("RATE_LIMIT_POLL_BURST", "40"))),
+}
+
+SWEEP_EVERY = 10000  # checks between sweeps of idle in-memory buckets
+
+
+class LLMSlots:
+    """Non-blocking concurrency cap for the LLM tier."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._sem = threading.BoundedSemaphore(limit) if limit > 0 else None
+
+    def try_acquire(self):
+        if self._sem is None:
+            return True
+        return self._sem.acquire(blocking=False)
+
+    def release(self):
+        if self._sem is not None:
+            self._sem.release()
+
+
+LLM_SLOTS = LLMSlots(LLM_MAX_CONCURRENCY)
+
+
+class MemoryBuckets:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> [tokens, updated_at, rate, capacity]
+        self._checks = 0
+
+    def take(self, requests):
+        """
+        requests: [(key, rate, capacity)]. Takes one token from every bucket if
+        all of them have one; returns 0.0, else the seconds until they would.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._checks += 1
+            if self._checks % SWEEP_EVERY == 0:
+                self._sweep(now)
+            states = []
+            wait = 0.0
+            for key, rate, capacity in requests:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = [capacity, now, rate, capacity]
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+                if bucket[0] < 1.0:
+                    wait = max(wait, (1.0 - bucket[0]) / rate)
+                states.append(bucket)
+            if wait:
+                return wait
+            for bucket in states:
+                bucket[0] -= 1.0
+            return 0.0
+
+    def _sweep(self, now):
+        # a bucket that has refilled completely is the same as a missing one
+        idle = [key for key, (tokens, at, rate, capacity) in self._buckets.items()
+                if tokens + (now - at) * rate >= capacity]
+        for key in idle:
+            del self._buckets[key]
+
+
+class PostgresBuckets:
+    """Buckets in an UNLOGGED table so all workers share one budget."""
+
+    # All-or-nothing like MemoryBuckets.take: refill every bucket, then debit
+    # them only if each has a token. The existing rows are locked (in key order,
+    # so two requests sharing buckets cannot deadlock) before their levels are read.
+    TAKE_SQL = """
+        WITH locked AS (
+            SELECT key, tokens, updated_at FROM rate_limit_buckets
+            WHERE key = ANY(%(keys)s) ORDER BY key FOR UPDATE
+        ), calc AS (
+            SELECT k.key, k.rate, k.capacity,
+                   COALESCE(LEAST(k.capacity, l.tokens + EXTRACT(EPOCH FROM clock_timestamp() - l.updated_at) * k.rate),
+                            k.capacity) AS refilled
+            FROM unnest(%(keys)s::text[], %(rates)s::float8[], %(capacities)s::float8[]) AS k(key, rate, capacity)
+            LEFT JOIN locked l ON l.key = k.key
+        )
+        INSERT INTO rate_limit_buckets AS b (key, tokens, rate, capacity, allowed, updated_at)
+        SELECT key,
+               refilled - CASE WHEN (SELECT bool_and(refilled >= 1) FROM calc) THEN 1 ELSE 0 END,
+               rate, capacity, refilled >= 1, clock_timestamp()
+        FROM calc
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = EXCLUDED.tokens,
+            allowed = EXCLUDED.allowed,
+            rate = EXCLUDED.rate,
+            capacity = EXCLUDED.capacity,
+            updated_at = EXCLUDED.updated_at
+        RETURNING tokens, rate, allowed
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        database_url = os.getenv("RATE_LIMIT_DATABASE_URL") or os.getenv("DATABASE_URL")
+        if database_url:
+            conn = psycopg2.connect(database_url, sslmode=os.getenv("DB_SSLMODE", "require"))
+        else:
+            conn = psycopg2.connect(
+                host=os.getenv("DB_HOST", "localhost"),
+                port=int(os.getenv("DB_PORT", "5432")),
+                user=os.getenv("DB_USER", "postgres"),
+                password=os.getenv("DB_PASSWORD", "postgres"),
+                dbname=os.getenv("DB_NAME", "safechat_db"),
+                sslmode=os.getenv("DB_SSLMODE", "prefer"),
+            )
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens DOUBLE PRECISION NOT NULL,
+                    rate DOUBLE PRECISION NOT NULL,
+                    capacity DOUBLE PRECISION NOT NULL,
+                    allowed BOOLEAN NOT NULL DEFAULT TRUE,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+                )
+            """)
+        return conn
+
+    def take(self, requests):
+        keys = [key for key, _, _ in requests]
+        rates = [rate for _, rate, _ in requests]
+        capacities = [capacity for _, _, capacity in requests]
+        with self._lock:
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self._connect()
+                with self._conn.cursor() as cursor:
+                    cursor.execute(self.TAKE_SQL, {"keys": keys, "rates": rates, "capacities": capacities})
+                    rows = cursor.fetchall()
+            except psycopg2.Error as e:
+                print(f"[ratelimit] shared bucket store unavailable, allowing request: {e}")
+                if self._conn is not None:
+                    try:
+                        self._conn.close()
+                    except Exception:
+                        pass
+                self._conn = None
+                return 0.0
+        waits = [(1.0 - tokens) / rate for tokens, rate, allowed in rows if not allowed]
+        return max(waits) if waits else 0.0
+
+
+_store = PostgresBuckets() if RATE_LIMIT_BACKEND == "postgres" else MemoryBuckets()
+
+
+def client_ip(request):
+    """
+    The client address as seen by a trusted proxy, else the peer address.
+    nginx sets X-Real-IP to the address it accepted the connection from and
+    appends that same address to X-Forwarded-For ($proxy_add_x_forwarded_for),
+    so only the last hop is the proxy's; earlier hops are whatever the client
+    sent and would let it rotate into a fresh per-IP bucket on every request.
+    """
+    if RATE_LIMIT_TRUST_PROXY:
+        real_ip = request.headers.get("x-real-ip", "").strip()
+        if real_ip:
+            return real_ip
+        forwarded = request.headers.get("x-forwarded-for", "")
+        if forwarded.strip():
+            return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def enforce(budget, request=None, username=None):
+    """Spend one token of `budget` for this user and IP, or raise 429 with Retry-After."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    rate, capacity = BUDGETS[budget]
+    requests = []
+    if username:
+        requests.append((f"{budget}:user:{username}", rate, capacity))
+    if request is not None:
+        factor = RATE_LIMIT_IP_FACTOR
+        requests.append((f"{budget}:ip:{client_ip(request)}", rate * factor, capacity * factor))
+    if not requests:
+        return
+    wait = _store.take(requests)
+    if wait > 0:
+        RATE_LIMITED.inc(budget)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests, slow down",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
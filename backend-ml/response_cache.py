@@ -0,0 +1,100 @@
+# response_cache.py
+"""
+Conditional GETs for the polled endpoints (feed, posts, pending reports).
+
+Each endpoint first reads a cheap version token for its result (see
+migrations/0006_table_versions.sql, 0008_striped_table_versions.sql and
+conversations.last_message_id) and builds a weak ETag from it. Then:
+
+- If-None-Match already holds that ETag: 304, no query, no body;
+- the body cached for that key was built for that ETag: send it as is;
+- otherwise run the query, serialize once, cache the bytes under (key, ETag).
+
+The version is read before the data, so a write that lands in between only
+makes the cached body newer than its ETag; the next poll sees a new version
+and rebuilds. The ETag decides freshness, so a stale entry is never served;
+write endpoints still drop their keys (invalidate / invalidate_prefix) so
+memory is not spent on bodies nobody will ask for again. The cache is per
+process and bounded to RESPONSE_CACHE_ENTRIES (LRU); 0 keeps ETags and 304s
+but caches no bodies.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import Response
+
+from fast_response import dumps
+from telemetry import RESPONSE_CACHE
+
+
+RESPONSE_CACHE_ENTRIES = int(os.getenv("RESPONSE_CACHE_ENTRIES", "1000"))
+
+_entries = OrderedDict()  # key -> (etag, body bytes)
+_lock = threading.Lock()
+
+
+def make_etag(*parts):
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def _client_has(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison: W/"x" and "x" name the same representation
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def _headers(etag):
+    # no-cache: clients may keep the body but must revalidate on every poll
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def cached_json(request, route, key, etag, build):
+    """Answer a GET for key at version etag; build() returns the content on a miss."""
+    if _client_has(request, etag):
+        RESPONSE_CACHE.inc(route, "not_modified")
+        return Response(status_code=304, headers=_headers(etag))
+
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == etag:
+            _entries.move_to_end(key)
+            body = entry[1]
+        else:
+            body = None
+    if body is not None:
+        RESPONSE_CACHE.inc(route, "hit")
+        return Response(body, media_type="application/json", headers=_headers(etag))
+
+    RESPONSE_CACHE.inc(route, "miss")
+    body = dumps(build())
+    if RESPONSE_CACHE_ENTRIES > 0:
+        with _lock:
+            _entries[key] = (etag, body)
+            _entries.move_to_end(key)
+            while len(_entries) > RESPONSE_CACHE_ENTRIES:
+                _entries.popitem(last=False)
+    return Response(body, media_type="application/json", headers=_headers(etag))
+
+
+def invalidate(*keys):
+    with _lock:
+        for key in keys:
+            _entries.pop(key, None)
+
+
+def invalidate_prefix(prefix):
+    with _lock:
+        for key in [k for k in _entries if k.startswith(prefix)]:
+            del _entries[key]
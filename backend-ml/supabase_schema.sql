@@ -17,6 +17,9 @@ create table if not exists posts (
   text text not null,
   status varchar(20) not null default 'approved' check (status in ('approved', 'pending', 'blocked')),
   parent_id bigint null references posts(id) on delete cascade,
+  label_scores jsonb,
+  claimed_by varchar(255),
+  claim_expires_at timestamptz,
   created_at timestamptz default now()
 );
 
@@ -28,18 +31,69 @@ create table if not exists user_profiles (
   updated_at timestamptz default now()
 );
 
+-- Monthly range partitions on created_at (chat_messages_YYYY_MM, created by
+-- ensure_chat_partitions below / chat_archive.py); old months move to chat_messages_archive.
+create sequence if not exists chat_messages_id_seq;
 create table if not exists chat_messages (
-  id bigserial primary key,
+  id bigint not null default nextval('chat_messages_id_seq'),
   sender_id bigint not null references users(id) on delete cascade,
   receiver_id bigint not null references users(id) on delete cascade,
   text text not null,
   status varchar(20) not null default 'approved' check (status in ('approved', 'pending')),
-  created_at timestamptz default now()
-);
+  label_scores jsonb,
+  created_at timestamptz not null default now(),
+  primary key (id, created_at)
+) partition by range (created_at);
+alter sequence chat_messages_id_seq owned by chat_messages.id;
+create table if not exists chat_messages_default partition of chat_messages default;
+
+create table if not exists chat_messages_archive (
+  id bigint not null,
+  sender_id bigint not null,
+  receiver_id bigint not null,
+  text text not null,
+  status varchar(20) not null default 'approved',
+  label_scores jsonb,
+  created_at timestamptz not null,
+  primary key (id, created_at)
+) partition by range (created_at);
+
+create or replace function ensure_chat_partitions(from_month date, months_ahead int default 3)
+returns int language plpgsql as $$
+declare
+  month_start date := date_trunc('month', from_month)::date;
+  last_month date := (date_trunc('month', current_date) + make_interval(months => months_ahead))::date;
+  partition_name text;
+  created int := 0;
+begin
+  while month_start <= last_month loop
+    partition_name := 'chat_messages_' || to_char(month_start, 'YYYY_MM');
+    if to_regclass(partition_name) is null then
+      execute format('create table %I (like chat_messages including defaults including constraints)', partition_name);
+      execute format(
+        'with moved as (delete from chat_messages_default where created_at >= %L and created_at < %L returning *)'
+        ' insert into %I select * from moved',
+        month_start, (month_start + interval '1 month')::date, partition_name);
+      execute format('alter table chat_messages attach partition %I for values from (%L) to (%L)',
+                     partition_name, month_start, (month_start + interval '1 month')::date);
+      created := created + 1;
+    end if;
+    month_start := (month_start + interval '1 month')::date;
+  end loop;
+  return created;
+end $$;
+
+select ensure_chat_partitions(current_date, 3);
+
+create or replace view chat_messages_all as
+select id, sender_id, receiver_id, text, status, label_scores, created_at from chat_messages
+union all
+select id, sender_id, receiver_id, text, status, label_scores, created_at from chat_messages_archive;
 
 create table if not exists message_reports (
   id bigserial primary key,
-  message_id bigint not null references chat_messages(id) on delete cascade,
+  message_id bigint not null,  -- chat_messages is partitioned: no FK on id alone
+  message_created_at timestamptz,  -- the message's partition key, for pruned joins
   reporter_id bigint not null references users(id) on delete cascade,
   reported_user_id bigint not null references users(id) on delete cascade,
   reason varchar(50) not null,
@@ -47,18 +101,93 @@ create table if not exists message_reports (
   status varchar(20) not null default 'pending' check (status in ('pending', 'resolved', 'dismissed')),
   reviewed_by bigint null references users(id) on delete set null,
   reviewed_at timestamptz null,
+  version int not null default 1,
+  collapsed_into bigint null references message_reports(id) on delete set null,
+  claimed_by varchar(255),
+  claim_expires_at timestamptz,
   created_at timestamptz default now(),
   constraint uq_message_reports_message_reporter unique (message_id, reporter_id)
 );
 
+-- Inbox summary per user pair (user_low < user_high), upserted with every chat message
+create table if not exists conversations (
+  user_low bigint not null references users(id) on delete cascade,
+  user_high bigint not null references users(id) on delete cascade,
+  last_message_id bigint not null,
+  last_sender_id bigint not null,
+  last_preview text not null,
+  last_activity timestamptz not null,
+  unread_low int not null default 0,
+  unread_high int not null default 0,
+  primary key (user_low, user_high),
+  check (user_low < user_high)
+);
+
+-- Per-user trust / abuse scores (maintained in memory by trust.py, flushed periodically)
+create table if not exists user_trust_scores (
+  user_id bigint primary key references users(id) on delete cascade,
+  abuse_score double precision not null default 0,
+  abuse_at timestamptz not null default now(),
+  first_seen timestamptz not null default now(),
+  clean_events int not null default 0,
+  blocked_sends int not null default 0,
+  pending_posts int not null default 0,
+  reports_resolved int not null default 0,
+  reports_dismissed int not null default 0
+);
+
+-- Shared token buckets for RATE_LIMIT_BACKEND=postgres (ratelimit.py); unlogged: losing them on crash is fine
+create unlogged table if not exists rate_limit_buckets (
+  key text primary key,
+  tokens double precision not null,
+  rate double precision not null,
+  capacity double precision not null,
+  allowed boolean not null default true,
+  updated_at timestamptz not null default clock_timestamp()
+);
+
 -- Helpful indexes
 create index if not exists idx_posts_created_at on posts(created_at desc);
 create index if not exists idx_posts_parent_id on posts(parent_id);
 create index if not exists idx_chat_sender_receiver_created on chat_messages(sender_id, receiver_id, created_at);
 create index if not exists idx_chat_receiver_sender_created on chat_messages(receiver_id, sender_id, created_at);
+create index if not exists idx_chat_receiver_created on chat_messages(receiver_id, created_at);
+create index if not exists idx_posts_user_created on posts(user_id, created_at desc);
+create index if not exists idx_conversations_low_activity on conversations(user_low, last_activity desc);
+create index if not exists idx_conversations_high_activity on conversations(user_high, last_activity desc);
 create index if not exists idx_message_reports_reporter on message_reports(reporter_id);
 create index if not exists idx_message_reports_reported on message_reports(reported_user_id);
 create index if not exists idx_message_reports_status on message_reports(status);
+-- Review queue: only pending rows are indexed, in queue (keyset) order
+create index if not exists idx_message_reports_pending_queue on message_reports(created_at, id) where status = 'pending';
+create index if not exists idx_posts_pending_queue on posts(created_at, id) where status = 'pending';
+
+-- Change counters behind the polled endpoints' ETags (response_cache.py); bumped once per statement
+create table if not exists table_versions (
+  table_name text primary key,
+  version bigint not null default 0,
+  updated_at timestamptz not null default now()
+);
+insert into table_versions (table_name) values ('posts'), ('message_reports'), ('chat_messages')
+on conflict (table_name) do nothing;
+
+create or replace function bump_table_version()
+returns trigger language plpgsql as $$
+begin
+  update table_versions set version = version + 1, updated_at = now() where table_name = tg_table_name;
+  return null;
+end $$;
+
+drop trigger if exists trg_posts_version on posts;
+create trigger trg_posts_version after insert or update or delete or truncate on posts
+  for each statement execute function bump_table_version();
+drop trigger if exists trg_message_reports_version on message_reports;
+create trigger trg_message_reports_version after insert or update or delete or truncate on message_reports
+  for each statement execute function bump_table_version();
+-- new messages are tracked per pair by conversations; only status changes and deletes count here
+drop trigger if exists trg_chat_messages_version on chat_messages;
+create trigger trg_chat_messages_version after update or delete or truncate on chat_messages
+  for each statement execute function bump_table_version();
 
 create or replace view v_pending_reports as
 select
@@ -76,7 +205,7 @@ select
 from message_reports r
 join users rep on rep.id = r.reporter_id
 join users rep2 on rep2.id = r.reported_user_id
-left join chat_messages m on m.id = r.message_id
+left join chat_messages_all m on m.id = r.message_id and m.created_at = r.message_created_at
 where r.status = 'pending'
 order by r.created_at desc;
 
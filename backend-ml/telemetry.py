@@ -0,0 +1,305 @@
+# telemetry.py
+"""
+In-process metrics exposed in the Prometheus text format on /metrics.
+
+Updates on the hot path never take a lock: each thread writes into its own
+shard (a plain dict held in a threading.local) and a scrape sums all shards.
+The only locked step is registering a thread's shard, once per thread per
+metric. Shard values are only ever incremented, so a scrape racing an update
+sees either the old or the new value of a bucket, never a torn total.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _snapshot(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict.items() -> list is a single C-level call, so it cannot observe a resize
+        return [list(shard.items()) for shard in shards]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1.0):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0.0) + amount
+
+    def totals(self):
+        merged = {}
+        for items in self._snapshot():
+            for key, value in items:
+                merged[key] = merged.get(key, 0.0) + value
+        return merged
+
+    def _render_samples(self):
+        for key, value in sorted(self.totals().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        shard = self._shard()
+        entry = shard.get(labelvalues)
+        if entry is None:
+            # per-bucket counts, +Inf count, sum, count
+            entry = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            shard[labelvalues] = entry
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def totals(self):
+        merged = {}
+        for items in self._snapshot():
+            for key, entry in items:
+                acc = merged.get(key)
+                if acc is None:
+                    merged[key] = list(entry)
+                else:
+                    for i, v in enumerate(entry):
+                        acc[i] += v
+        return merged
+
+    def _render_samples(self):
+        bounds = [_format_value(b) for b in self.buckets] + ["+Inf"]
+        for key, entry in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, entry):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(entry[-2])}"
+            yield f"{self.name}_count{labels} {entry[-1]}"
+
+
+class Gauge(_Metric):
+    """Last value set per label set (e.g. a probe's latest reading)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def set(self, value, *labelvalues):
+        self._values[labelvalues] = value
+
+    def _render_samples(self):
+        for key, value in sorted(list(self._values.items())):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class GaugeFunc(_Metric):
+    """Gauge computed at scrape time from other metrics."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def _render_samples(self):
+        yield f"{self.name} {_format_value(self.fn())}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "start")
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+# --- SafeChat metrics ---
+HTTP_REQUESTS = Counter("safechat_http_requests_total", "HTTP requests by route and status.",
+                        ("method", "route", "status"))
+HTTP_LATENCY = Histogram("safechat_http_request_duration_seconds", "HTTP request latency by route.",
+                         ("method", "route"))
+HTTP_ERRORS = Counter("safechat_http_errors_total", "HTTP 5xx responses and unhandled exceptions by route.",
+                      ("method", "route"))
+
+CLASSIFY_RESULTS = Counter("safechat_classify_results_total", "classify_text verdicts by deciding tier.",
+                           ("tier", "label"))
+CLASSIFY_TIER_LATENCY = Histogram("safechat_classify_tier_duration_seconds",
+                                  "Time spent in each classify_text tier.", ("tier",))
+CLASSIFY_SCRIPTS = Counter("safechat_classify_scripts_total",
+                           "Classified texts by detected script route (english, hinglish, devanagari, mixed, other).",
+                           ("script",))
+LLM_REQUESTS = Counter("safechat_llm_requests_total", "OpenRouter calls by outcome (ok or failed).",
+                       ("outcome",))
+LLM_FALLBACKS = Counter("safechat_llm_fallbacks_total",
+                        "Messages that fell back to the local model after an OpenRouter failure.")
+LLM_SHED = Counter("safechat_llm_shed_total",
+                   "Messages sent straight to the local model because every LLM slot was busy.")
+CLASSIFIER_CLIENT = Counter("safechat_classifier_client_total",
+                            "classify_text calls sent to the classifier service by outcome "
+                            "(service, cached, timeout, unavailable, skipped: in process while backing off, "
+                            "rejected: error reply for this text, too_long: over CLASSIFIER_MAX_TEXT_CHARS).",
+                            ("outcome",))
+CLASSIFIER_BATCH = Histogram("safechat_classifier_batch_texts", "Texts scored per classifier service batch.",
+                             buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+CLASSIFIER_CACHE = Counter("safechat_classifier_cache_total",
+                           "Classifier service verdict cache lookups by result (hit, miss).", ("result",))
+RATE_LIMITED = Counter("safechat_rate_limited_total", "Requests rejected with 429 by budget (write or poll).",
+                       ("budget",))
+TRUST_ROUTES = Counter("safechat_trust_routes_total", "classify_text calls by trust route (trusted, normal, offender).",
+                       ("route",))
+TRUST_FLUSHES = Counter("safechat_trust_flushes_total", "Trust score flushes to user_trust_scores by outcome.",
+                        ("outcome",))
+RESPONSE_CACHE = Counter("safechat_response_cache_total",
+                         "Conditional GETs by result (not_modified, hit, miss).", ("route", "result"))
+CHAT_WRITER_BATCH = Histogram("safechat_chat_writer_batch_rows", "Messages written per group-commit flush.",
+                              buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+CHAT_WRITER_FLUSHES = Counter("safechat_chat_writer_flushes_total",
+                              "Group-commit flushes by outcome (ok, isolated: replayed per caller, failed).",
+                              ("outcome",))
+RESPONSE_BYTES = Counter("safechat_http_compressed_bytes_total",
+                         "Bodies of compressed responses by encoding, before (raw) and after (sent) compression.",
+                         ("encoding", "stage"))
+
+DB_ACQUIRE_LATENCY = Histogram("safechat_db_acquire_duration_seconds", "Time to obtain a DB connection.",
+                               buckets=DB_BUCKETS)
+DB_ACQUIRE_ERRORS = Counter("safechat_db_acquire_errors_total", "Failed attempts to obtain a DB connection.")
+DB_FLAGGED_REQUESTS = Counter("safechat_db_flagged_requests_total",
+                              "Requests flagged by the query profiler (query/time budget, n+1, slow query).",
+                              ("route", "flag"))
+DB_QUERY_LATENCY = Histogram("safechat_db_query_duration_seconds", "Statement execution time by statement kind.",
+                             ("statement",), buckets=DB_BUCKETS)
+DB_READ_ROUTES = Counter("safechat_db_read_routes_total",
+                         "Read-only connections by where they went (replica, pinned, no_replica, fallback).",
+                         ("target",))
+DB_POOL_EVENTS = Counter("safechat_db_pool_events_total",
+                         "Connection pool events by pool (reused, opened, returned, discarded).",
+                         ("pool", "event"))
+DB_PREPARES = Counter("safechat_db_prepares_total",
+                      "PREPAREs by statement (once per connection, again after a reconnect or reset).",
+                      ("statement",))
+REPLICA_LAG = Gauge("safechat_replica_lag_seconds", "Replication lag measured by the last probe.", ("replica",))
+REPLICA_UP = Gauge("safechat_replica_up", "1 if the replica answered the last probe within the lag limit.",
+                   ("replica",))
+
+
+def _llm_fallback_ratio():
+    attempts = sum(LLM_REQUESTS.totals().values())
+    if not attempts:
+        return 0.0
+    return sum(LLM_FALLBACKS.totals().values()) / attempts
+
+
+LLM_FALLBACK_RATIO = GaugeFunc("safechat_llm_fallback_ratio",
+                               "Share of OpenRouter attempts that fell back to the local model.",
+                               _llm_fallback_ratio)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware task/queue overhead) recording
+    count, latency and errors per route template, e.g. /get_feed/{username}.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            status[0] = 500
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            # unmatched paths share one label so scanners cannot blow up cardinality
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method, path, str(status[0]))
+            HTTP_LATENCY.observe(elapsed, method, path)
+            if status[0] >= 500:
+                HTTP_ERRORS.inc(method, path)
@@ -8,6 +8,11 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import classification_report, accuracy_score
 from sklearn.utils import resample
 import joblib
+import numpy as np
+
+# Per-label heads served alongside the binary model (see classifier.score_text)
+LABELS = ["toxic", "severe_toxic", "obscene", "threat", "insult", "identity_hate"]
+HEADS_PATH = os.path.join("models", "heads.joblib")
 
 # Clean text function
 def clean_text(s):
@@ -41,6 +46,36 @@ def load_data(csv_path, text_col, label_cols):
     
     return df[['text_clean','label']]
 
+# Load data keeping each label column
+def load_multilabel_data(csv_path, text_col, label_cols):
+    df = pd.read_csv(csv_path)
+    df = df.dropna(subset=[text_col])
+    df['text_clean'] = df[text_col].map(clean_text)
+    label_list = [c.strip() for c in label_cols.split(',')]
+    df[label_list] = df[label_list].fillna(0).astype(int)
+    return df[['text_clean'] + label_list]
+
+# One logistic head per label on the shared TF-IDF features.
+# Stored as a dense (n_features, n_labels) matrix so serving is a single
+# sparse x dense product for all labels.
+def train_heads(vect, df, labels=LABELS):
+    X_t = vect.transform(df['text_clean'])
+    coef = np.zeros((X_t.shape[1], len(labels)))
+    intercept = np.zeros(len(labels))
+    for i, label in enumerate(labels):
+        y = df[label].values
+        if y.min() == y.max():
+            # no positives (or no negatives) for this label: constant head
+            intercept[i] = 20.0 if y.max() else -20.0
+            print(f"Head '{label}': single class in data, using constant score")
+            continue
+        head = LogisticRegression(max_iter=1000, class_weight='balanced')
+        head.fit(X_t, y)
+        coef[:, i] = head.coef_[0]
+        intercept[i] = head.intercept_[0]
+        print(f"Head '{label}': trained on {int(y.sum())} positives")
+    return {"labels": list(labels), "coef": coef, "intercept": intercept}
+
 # Balance dataset by oversampling minority class
 def balance_dataset(df):
     toxic = df[df['label'] == 1]
@@ -89,11 +124,15 @@ def main():
     print(classification_report(y_test, preds))
     print("Accuracy:", accuracy_score(y_test, preds))
 
+    # Per-label heads on the same vectorizer (unbalanced data, balanced class weights)
+    heads = train_heads(vect, load_multilabel_data(csv_path, text_col, label_cols))
+
     # Save artifacts
     os.makedirs("models", exist_ok=True)
     joblib.dump(vect, "models/vectorizer.joblib")
     joblib.dump(model, "models/model.joblib")
-    print("Saved vectorizer & model in 'models/' folder.")
+    joblib.dump(heads, HEADS_PATH)
+    print("Saved vectorizer, model & label heads in 'models/' folder.")
 
 if __name__ == "__main__":
     main()
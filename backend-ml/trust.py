@@ -0,0 +1,289 @@
+# trust.py
+"""
+Per-user trust / abuse scores used by classify_text to pick a classification
+path: long-standing clean users skip the LLM, repeat offenders get an
+LLM-verified verdict with a stricter local threshold, everyone else keeps the
+default tiers.
+
+Scores are kept in memory, keyed by username, and move only on events
+(a clean or blocked send, a clean or pending post, a report resolved or
+dismissed against the user) — nothing is recomputed with queries. The abuse
+score decays exponentially with TRUST_HALF_LIFE_DAYS, applied lazily when a
+user's state is touched.
+
+A background thread flushes the changes made since the last flush to
+user_trust_scores every TRUST_FLUSH_SECONDS as increments (the stored abuse
+score is decayed in SQL before the delta is added), so several workers can
+share the table without overwriting each other. The flush returns the merged
+rows, which refreshes this worker's view with the other workers' events.
+"""
+import os
+import threading
+import time
+
+from psycopg2 import Error as DatabaseError
+from psycopg2.extras import execute_values
+
+from database import get_db_connection
+from telemetry import TRUST_FLUSHES
+
+
+TRUST_ROUTING = os.getenv("TRUST_ROUTING", "1") == "1"
+TRUST_HALF_LIFE_DAYS = float(os.getenv("TRUST_HALF_LIFE_DAYS", "30"))
+TRUST_MIN_CLEAN = int(os.getenv("TRUST_MIN_CLEAN", "50"))
+TRUST_MIN_AGE_DAYS = float(os.getenv("TRUST_MIN_AGE_DAYS", "7"))
+TRUST_MAX_ABUSE = float(os.getenv("TRUST_MAX_ABUSE", "0.5"))
+OFFENDER_MIN_ABUSE = float(os.getenv("TRUST_OFFENDER_ABUSE", "3"))
+TRUST_FLUSH_SECONDS = float(os.getenv("TRUST_FLUSH_SECONDS", "30"))
+
+HALF_LIFE_SECONDS = TRUST_HALF_LIFE_DAYS * 86400.0
+
+# event -> (counter column, abuse weight)
+EVENTS = {
+    "clean": ("clean_events", 0.0),
+    "blocked_send": ("blocked_sends", 1.0),
+    "pending_post": ("pending_posts", 1.0),
+    "report_resolved": ("reports_resolved", 2.0),
+    "report_dismissed": ("reports_dismissed", 0.0),
+}
+COUNTERS = tuple(column for column, _ in EVENTS.values())
+
+
+def _decay(abuse, since, now):
+    if abuse <= 0.0 or now <= since:
+        return abuse
+    return abuse * 0.5 ** ((now - since) / HALF_LIFE_SECONDS)
+
+
+class TrustState:
+    __slots__ = ("abuse", "abuse_at", "first_seen") + COUNTERS
+
+    def __init__(self, now):
+        self.abuse = 0.0
+        self.abuse_at = now
+        self.first_seen = now
+        for column in COUNTERS:
+            setattr(self, column, 0)
+
+    def current_abuse(self, now):
+        return _decay(self.abuse, self.abuse_at, now)
+
+    def apply(self, column, weight, now, amount=1):
+        setattr(self, column, getattr(self, column) + amount)
+        if weight:
+            self.abuse = self.current_abuse(now) + weight * amount
+            self.abuse_at = now
+
+
+_lock = threading.Lock()
+_states = {}   # username -> TrustState (this worker's view)
+_pending = {}  # username -> TrustState holding only the deltas since the last flush
+_flusher = None
+_stop = threading.Event()
+
+
+def record(username, event, amount=1):
+    """Apply one event to a user's score. Cheap; never touches the database."""
+    if not username or event not in EVENTS:
+        return
+    column, weight = EVENTS[event]
+    now = time.time()
+    with _lock:
+        state = _states.get(username)
+        if state is None:
+            state = _states[username] = TrustState(now)
+        state.apply(column, weight, now, amount)
+        delta = _pending.get(username)
+        if delta is None:
+            delta = _pending[username] = TrustState(now)
+        delta.apply(column, weight, now, amount)
+
+
+def route_for(username):
+    """'trusted', 'offender' or 'normal' for the classification path."""
+    if not TRUST_ROUTING or not username:
+        return "normal"
+    state = _states.get(username)
+    if state is None:
+        return "normal"
+    now = time.time()
+    abuse = state.current_abuse(now)
+    if abuse >= OFFENDER_MIN_ABUSE:
+        return "offender"
+    if (state.clean_events >= TRUST_MIN_CLEAN
+            and abuse < TRUST_MAX_ABUSE
+            and now - state.first_seen >= TRUST_MIN_AGE_DAYS * 86400.0):
+        return "trusted"
+    return "normal"
+
+
+def snapshot(username):
+    state = _states.get(username)
+    if state is None:
+        return None
+    data = {column: getattr(state, column) for column in COUNTERS}
+    data["abuse_score"] = round(state.current_abuse(time.time()), 4)
+    data["route"] = route_for(username)
+    return data
+
+
+def _state_from_row(row):
+    state = TrustState(row["first_seen"])
+    state.abuse = row["abuse_score"]
+    state.abuse_at = row["abuse_at"]
+    for column in COUNTERS:
+        setattr(state, column, row[column])
+    return state
+
+
+ROW_COLUMNS = """
+    u.username, t.abuse_score, EXTRACT(EPOCH FROM t.abuse_at)::float8 AS abuse_at,
+    EXTRACT(EPOCH FROM t.first_seen)::float8 AS first_seen,
+    t.clean_events, t.blocked_sends, t.pending_posts, t.reports_resolved, t.reports_dismissed
+"""
+
+
+def load():
+    """Read every stored score into memory (one query, at startup)."""
+    db = get_db_connection()
+    if db is None:
+        print("[trust] could not connect to DB; starting with empty scores")
+        return 0
+    cursor = None
+    try:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(f"SELECT {ROW_COLUMNS} FROM user_trust_scores t JOIN users u ON u.id = t.user_id")
+        rows = cursor.fetchall() or []
+    except DatabaseError as e:
+        print(f"[trust] could not load scores: {e}")
+        return 0
+    finally:
+        if cursor is not None:
+            cursor.close()
+        try:
+            db.close()
+        except Exception:
+            pass
+
+    with _lock:
+        for row in rows:
+            if row["username"] not in _states:
+                _states[row["username"]] = _state_from_row(row)
+    print(f"[trust] loaded {len(rows)} user scores")
+    return len(rows)
+
+
+FLUSH_SQL = f"""
+    INSERT INTO user_trust_scores (
+        user_id, abuse_score, abuse_at, first_seen, {", ".join(COUNTERS)}
+    )
+    SELECT u.id, v.abuse, to_timestamp(v.abuse_at), to_timestamp(v.first_seen),
+           {", ".join("v." + c for c in COUNTERS)}
+    FROM (VALUES %s) AS v(username, abuse, abuse_at, first_seen, {", ".join(COUNTERS)})
+    JOIN users u ON u.username = v.username
+    ON CONFLICT (user_id) DO UPDATE SET
+        abuse_score = user_trust_scores.abuse_score
+            * power(0.5, GREATEST(EXTRACT(EPOCH FROM EXCLUDED.abuse_at - user_trust_scores.abuse_at), 0)
+                         / {HALF_LIFE_SECONDS})
+            + EXCLUDED.abuse_score,
+        abuse_at = GREATEST(user_trust_scores.abuse_at, EXCLUDED.abuse_at),
+        first_seen = LEAST(user_trust_scores.first_seen, EXCLUDED.first_seen),
+        {", ".join(f"{c} = user_trust_scores.{c} + EXCLUDED.{c}" for c in COUNTERS)}
+    RETURNING user_id
+"""
+
+
+def flush():
+    """Write the deltas collected since the last flush; on failure keep them for the next one."""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+
+    now = time.time()
+    values = [
+        (username, _decay(d.abuse, d.abuse_at, now), now, d.first_seen) + tuple(getattr(d, c) for c in COUNTERS)
+        for username, d in batch.items()
+    ]
+    db = get_db_connection()
+    cursor = None
+    try:
+        if db is None:
+            raise DatabaseError("connection failed")
+        cursor = db.cursor(dictionary=True)
+        execute_values(cursor, FLUSH_SQL, values)
+        user_ids = [row["user_id"] for row in cursor.fetchall()]
+        cursor.execute(
+            f"SELECT {ROW_COLUMNS} FROM user_trust_scores t JOIN users u ON u.id = t.user_id "
+            "WHERE t.user_id = ANY(%s)",
+            (user_ids,),
+        )
+        merged = cursor.fetchall() or []
+        db.commit()
+    except DatabaseError as e:
+        if db is not None:
+            try:
+                db.rollback()
+            except Exception:
+                pass
+        print(f"[trust] flush failed, will retry: {e}")
+        TRUST_FLUSHES.inc("failed")
+        with _lock:
+            for username, delta in batch.items():
+                newer = _pending.get(username)
+                if newer is not None:
+                    for column in COUNTERS:
+                        setattr(delta, column, getattr(delta, column) + getattr(newer, column))
+                    delta.abuse = _decay(delta.abuse, delta.abuse_at, newer.abuse_at) + newer.abuse
+                    delta.abuse_at = newer.abuse_at
+                _pending[username] = delta
+        return 0
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if db is not None:
+            try:
+                db.close()
+            except Exception:
+                pass
+
+    # Stored rows now include every worker's events; re-apply what arrived here meanwhile.
+    with _lock:
+        for row in merged:
+            state = _state_from_row(row)
+            newer = _pending.get(row["username"])
+            if newer is not None:
+                for column in COUNTERS:
+                    setattr(state, column, getattr(state, column) + getattr(newer, column))
+                state.abuse = state.current_abuse(newer.abuse_at) + newer.abuse
+                state.abuse_at = newer.abuse_at
+            _states[row["username"]] = state
+    TRUST_FLUSHES.inc("ok")
+    return len(values)
+
+
+def _flush_loop():
+    while not _stop.wait(TRUST_FLUSH_SECONDS):
+        flush()
+
+
+def start():
+    """Load stored scores and start the periodic flush thread (idempotent)."""
+    global _flusher
+    if _flusher is not None:
+        return
+    load()
+    _stop.clear()
+    _flusher = threading.Thread(target=_flush_loop, name="trust-flush", daemon=True)
+    _flusher.start()
+
+
+def stop():
+    """Stop the flush thread and write whatever is still pending."""
+    global _flusher
+    _stop.set()
+    if _flusher is not None:
+        _flusher.join(timeout=5)
+        _flusher = None
+    flush()
@@ -12,7 +12,7 @@ import usePresence from './hooks/usePresence';
 
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'http://127.0.0.1:8000';
 const api = {
-    getPosts: () => fetch(`${API_BASE_URL}/get_posts`).then(res => res.json()),
+    getPosts: (username) => fetch(`${API_BASE_URL}/get_posts?username=${encodeURIComponent(username)}`).then(res => res.json()),
     getUsers: (username) => fetch(`${API_BASE_URL}/get_users/${username}`).then(res => res.json()),
     getChatNotifications: (username, since) => {
       const query = since ? `?since=${encodeURIComponent(since)}` : '';
@@ -51,7 +51,7 @@ export default function HomePage({
 
   const fetchPosts = useCallback(async () => {
     try {
-      const fetchedPosts = await api.getPosts();
+      const fetchedPosts = await api.getPosts(user);
       if (Array.isArray(fetchedPosts)) {
         setPosts(prev => {
           const serverIds = new Set(fetchedPosts.map(p => p.id));
@@ -60,7 +60,7 @@ export default function HomePage({
         });
       }
     } catch (error) { console.error('Failed to fetch posts:', error); setPosts([]); }
-  }, []);
+  }, [user]);
 
   useEffect(() => {
     fetchPosts();